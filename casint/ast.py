@@ -1,249 +1,537 @@
 from .common import *
 
 
+# names of the builtins and functions: token type -> (ucb name, g1m name)
+BUILTIN_NAMES = {
+	CLS			: (b'Cls', b'\xd1'),
+	COORDOFF	: (b'CoordOff', b'\xf7\xd3'),
+	GRIDOFF		: (b'GridOff', b'\xf7\x7a'),
+	AXESOFF		: (b'AxesOff', b'\xf7\xd2'),
+	LABELOFF	: (b'LabelOff', b'\xf7\xd4'),
+	CLRTEXT		: (b'ClrText', b'\xf7\x18'),
+	STRING		: (b'Print', b''),
+	RETURN		: (b'return', b'\xf7\x0c'),
+	BREAK		: (b'break', b'\xf7\x0d'),
+	STOP		: (b'stop', b'\xf7\x0e'),
+	DSZ			: (b'Dsz', b'\xe8'),
+	ISZ			: (b'Isz', b'\xe9'),
+	FLINE		: (b'F_Line', b'\xf7\xa7'),
+	CIRCLE		: (b'Circle', b'\xf7\xa6'),
+	HORIZONTAL	: (b'Horizontal', b'\xf7\xa4'),
+	VERTICAL	: (b'Vertical', b'\xf7\xa3'),
+	PLOTON		: (b'PlotOn', b'\xf7\xa8'),
+	GRAPHYEQ	: (b'GraphYEq', b'\xee'),
+	PXLON		: (b'PxlOn', b'\xf7\xab'),
+	PXLOFF		: (b'PxlOff', b'\xf7\xac'),
+	PXLCHG		: (b'PxlChg', b'\xf7\xad'),
+	VIEWWINDOW	: (b'ViewWindow', b'\xeb'),
+	STOPICT		: (b'StoPict', b'\xf7\x93'),
+	RCLPICT		: (b'RclPict', b'\xf7\x94'),
+	PROG		: (b'Prog', b'\xed'),
+	TEXT		: (b'Text', b'\xf7\xa5'),
+	LOCATE		: (b'Locate', b'\xf7\x10'),
+	RANDNUM		: (b'RandNum', b'\xc1'),
+	PROMPT		: (b'Prompt', b'?'),
+	GETKEY		: (b'GetKey', b'\x7f\x8f'),
+	LOG			: (b'log', b'\x95'),
+	INTG		: (b'Intg', b'\xde'),
+	FRAC		: (b'Frac', b'\xb6'),
+	PXLTEST		: (b'PxlTest', b'\xf7\xaf')
+}
+
+# binary operators: token type -> precedence, shared by the parser and
+# the writers. All of them are left associative. Their operands are
+# unary expressions.
+BINARY_OPERATORS = {
+	OR		: 1,
+	AND		: 2,
+	EQ		: 3,
+	NEQ		: 3,
+	LT		: 4,
+	LTE		: 4,
+	GTE		: 4,
+	GT		: 4,
+	PLUS	: 5,
+	MINUS	: 5,
+	MUL		: 6,
+	DIV		: 6
+}
+
+LOWEST_PRECEDENCE = 1
+
+# the expressions that bind tighter than any binary operator, as they
+# are parsed: a prefix operator applies to a ^, whose operands are
+# implicit multiplications of operands
+PREFIX_PRECEDENCE = 7
+POWER_PRECEDENCE = 8
+IMPLICIT_MUL_PRECEDENCE = 9
+OPERAND_PRECEDENCE = 10
+
+# binary operators: token type -> (ucb repr, g1m repr)
+BINARY_OPERATOR_REPRS = {
+	OR		: (b'or', b'\x7f\xb1'),
+	AND		: (b'and', b'\x7f\xb0'),
+	EQ		: (b'==', b'='),
+	NEQ		: (b'!=', b'\x11'),
+	LT		: (b'<', b'\x3c'),
+	LTE		: (b'<=', b'\x10'),
+	GTE		: (b'>=', b'\x12'),
+	GT		: (b'>', b'\x3e'),
+	PLUS	: (b'+', b'\x89'),
+	MINUS	: (b'-', b'\x99'),
+	MUL		: (b'*', b'\xa9'),
+	DIV		: (b'/', b'\xb9'),
+	POWER	: (b'**', b'\xa8')
+}
+
+# prefix operators: token type -> (ucb repr, g1m repr)
+UNARY_OPERATOR_REPRS = {
+	PLUS	: (b'+', b'\x89'),
+	MINUS	: (b'-', b'\x87'),
+	NOT		: (b'!', b'!')
+}
+
+# the value of the MUL token the parser makes for an implicit
+# multiplication (lexed ones are b'x'), which g1m writes as nothing
+IMPLICIT_MUL_VALUE = b'*'
+IMPLICIT_MUL_REPRS = (b'*', b'')
+
+
+_ucb_indentations = [b'']
+
+
+def ucb_indentation(indent):
+    """The spaces that start a UCB line at a depth, made once per depth."""
+    while len(_ucb_indentations) <= indent:
+        _ucb_indentations.append(b' ' * UCB_INDENTATION * len(_ucb_indentations))
+    return _ucb_indentations[indent]
+
+
+def serialize_ucb(node, indent=0):
+    """
+    Returns the UCB source of a node in one buffer. The tree is walked
+    with a stack of the nodes' parts rather than by recursion.
+    """
+    out = bytearray()
+    parts = node.ucb_parts(indent)
+    if type(parts) is bytes:
+        return parts
+    parts = iter(parts)
+    stack = []
+    while True:
+        for part in parts:
+            if type(part) is bytes:
+                out += part
+                continue
+            if type(part) is tuple:
+                part, child_indent = part
+            else:
+                child_indent = indent
+            child_parts = part.ucb_parts(child_indent)
+            if type(child_parts) is bytes:
+                out += child_parts
+                continue
+            stack.append((parts, indent))
+            parts = iter(child_parts)
+            indent = child_indent
+            break
+        else:
+            if not stack:
+                return bytes(out)
+            parts, indent = stack.pop()
+
+
+def serialize_g1m(node):
+    """Returns the g1m bytes of a node in one buffer, like serialize_ucb."""
+    out = bytearray()
+    parts = node.g1m_parts()
+    if type(parts) is bytes:
+        return parts
+    parts = iter(parts)
+    stack = []
+    while True:
+        for part in parts:
+            if type(part) is bytes:
+                out += part
+                continue
+            child_parts = part.g1m_parts()
+            if type(child_parts) is bytes:
+                out += child_parts
+                continue
+            stack.append(parts)
+            parts = iter(child_parts)
+            break
+        else:
+            if not stack:
+                return bytes(out)
+            parts = stack.pop()
+
+
+def iter_child_nodes(node):
+    """Yields the direct child nodes of an AST node."""
+    for name in type(node).__slots__:
+        value = getattr(node, name)
+        if isinstance(value, AST):
+            yield value
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                if isinstance(item, AST):
+                    yield item
+                elif isinstance(item, (list, tuple)):
+                    # e.g. rows of an Initialize
+                    yield from (i for i in item if isinstance(i, AST))
+
+
 class AST(object):
+    """
+    Nodes are written by listing their parts: bytes, child nodes, and
+    (node, indent) pairs for children at another indentation. A node
+    that is all one piece returns its bytes instead.
+
+    Operands are only put in parentheses where the parser needs them,
+    going by how tightly each node binds as written.
+    """
+    __slots__ = ()
+
+    ucb_precedence = OPERAND_PRECEDENCE
+    g1m_precedence = OPERAND_PRECEDENCE
+
     def write_ucb(self, fp, indent):
-        raise NotImplementedError()
+        fp.write(serialize_ucb(self, indent))
 
 
     def write_g1m(self, fp):
+        fp.write(serialize_g1m(self))
+
+
+    def ucb_parts(self, indent):
         raise NotImplementedError()
 
 
-    def write_ucb_op(self, op, fp, indent):
-        if type(op) in (UnaryOp, BinOp):
-            fp.write(b'(')
-            op.write_ucb(fp, indent)
-            fp.write(b')')
-        else:
-            op.write_ucb(fp, indent)
+    def g1m_parts(self):
+        raise NotImplementedError()
 
 
-    def write_g1m_op(self, op, fp):
-        if type(op) in (UnaryOp, BinOp):
-            fp.write(b'(')
-            op.write_g1m(fp)
-            fp.write(b')')
-        else:
-            op.write_g1m(fp)
+    def ucb_operand(self, op, precedence):
+        """op, in parentheses unless it binds at least as tightly as precedence."""
+        if op.ucb_precedence < precedence:
+            return (b'(', op, b')')
+        return (op,)
+
+
+    def g1m_operand(self, op, precedence):
+        if op.g1m_precedence < precedence:
+            return (b'(', op, b')')
+        return (op,)
 
 
 class SpecialDebug(AST):
+    __slots__ = ('value', 'arg1')
+
     def __init__(self, token, arg1):
         self.value = token.value
         self.arg1 = arg1
 
 
-    def write_ucb(self, fp, indent):
-        pass
+    def ucb_parts(self, indent):
+        return ()
 
 
-    def write_g1m(self, fp):
-        pass
+    def g1m_parts(self):
+        return ()
 
 
 class Comment(AST):
+    __slots__ = ('comment_text',)
+
     def __init__(self, token):
         self.comment_text = token.value
 
 
-    def write_ucb(self, fp, indent):
-        fp.write(b'//')
-        fp.write(self.comment_text)
+    def ucb_parts(self, indent):
+        return b'//' + self.comment_text
 
 
-    def write_g1m(self, fp):
+    def g1m_parts(self):
         # don't write comments to g1m
-        pass
+        return ()
 
 
 class MemoryStructure(AST):
+    __slots__ = ('op', 'value')
+
     def __init__(self, op, token):
         self.op = op
         self.value = token.value
 
 
-    def write_ucb(self, fp, indent):
-        fp.write(self.op.value)
-        fp.write(self.value)
+    def ucb_parts(self, indent):
+        return self.op.value + self.value
 
 
-    def write_g1m(self, fp):
+    def g1m_parts(self):
         if self.op.type != MAT:
             raise Exception(f'Unknown MemoryStructure type: {self.op.type}')
-        fp.write(b'\x7f\x40')
-        fp.write(self.value)
+        return b'\x7f\x40' + self.value
 
 
 class MemoryIndex(AST):
     """e.g. Mat A[1, 1]"""
+    __slots__ = ('left', 'right')
+
     def __init__(self, left, right):
         self.left = left
         self.right = right
 
 
-    def write_ucb(self, fp, indent):
-        self.left.write_ucb(fp, indent)
-        fp.write(b'[')
-        self.right[0].write_ucb(fp, indent)
-        fp.write(b', ')
-        self.right[1].write_ucb(fp, indent)
-        fp.write(b']')
+    def ucb_parts(self, indent):
+        return (self.left, b'[', self.right[0], b', ', self.right[1], b']')
 
 
-    def write_g1m(self, fp):
-        self.left.write_g1m(fp)
-        fp.write(b'[')
-        self.right[0].write_g1m(fp)
-        fp.write(b',')
-        self.right[1].write_g1m(fp)
-        fp.write(b']')
+    def g1m_parts(self):
+        return (self.left, b'[', self.right[0], b',', self.right[1], b']')
 
 
 class UnaryOp(AST):
-    def __init__(self, op, expr, ucb_repr, g1m_repr):
+    __slots__ = ('op', 'expr')
+
+    ucb_precedence = PREFIX_PRECEDENCE
+    g1m_precedence = PREFIX_PRECEDENCE
+
+    def __init__(self, op, expr):
         self.op = op
         self.expr = expr
-        self.ucb_repr = ucb_repr
-        self.g1m_repr = g1m_repr
 
 
-    def write_ucb(self, fp, indent):
-        fp.write(self.ucb_repr)
-        self.write_ucb_op(self.expr, fp, indent)
+    @property
+    def ucb_repr(self):
+        return UNARY_OPERATOR_REPRS[self.op.type][0]
 
 
-    def write_g1m(self, fp):
-        fp.write(self.g1m_repr)
-        self.write_g1m_op(self.expr, fp)
+    @property
+    def g1m_repr(self):
+        return UNARY_OPERATOR_REPRS[self.op.type][1]
+
+
+    def ucb_parts(self, indent):
+        return (self.ucb_repr, *self.ucb_operand(self.expr, POWER_PRECEDENCE))
+
+
+    def g1m_parts(self):
+        return (self.g1m_repr, *self.g1m_operand(self.expr, POWER_PRECEDENCE))
 
 
 class BinOp(AST):
-    def __init__(self, left, op, right, ucb_repr, g1m_repr):
+    __slots__ = ('left', 'op', 'right')
+
+    def __init__(self, left, op, right):
         self.left = left
         self.op = op
         self.right = right
-        self.ucb_repr = ucb_repr
-        self.g1m_repr = g1m_repr
 
 
-    def write_ucb(self, fp, indent):
-        self.write_ucb_op(self.left, fp, indent)
-        fp.write(b' ')
-        fp.write(self.ucb_repr)
-        fp.write(b' ')
-        self.write_ucb_op(self.right, fp, indent)
+    @property
+    def is_implicit_mul(self):
+        return self.op.type == MUL and self.op.value == IMPLICIT_MUL_VALUE
 
 
-    def write_g1m(self, fp):
-        self.write_g1m_op(self.left, fp)
-        fp.write(self.g1m_repr)
-        self.write_g1m_op(self.right, fp)
+    @property
+    def reprs(self):
+        if self.is_implicit_mul:
+            return IMPLICIT_MUL_REPRS
+        return BINARY_OPERATOR_REPRS[self.op.type]
+
+
+    @property
+    def ucb_repr(self):
+        return self.reprs[0]
+
+
+    @property
+    def g1m_repr(self):
+        return self.reprs[1]
+
+
+    @property
+    def ucb_precedence(self):
+        if self.op.type == POWER:
+            return POWER_PRECEDENCE
+        # written as *
+        return BINARY_OPERATORS[self.op.type]
+
+
+    @property
+    def g1m_precedence(self):
+        if self.op.type == POWER:
+            return POWER_PRECEDENCE
+        if self.is_implicit_mul:
+            return IMPLICIT_MUL_PRECEDENCE
+        return BINARY_OPERATORS[self.op.type]
+
+
+    def ucb_parts(self, indent):
+        precedence = self.ucb_precedence
+        # left associative, so an equal right operand needs parentheses
+        return (
+            *self.ucb_operand(self.left, precedence), b' ', self.ucb_repr, b' ',
+            *self.ucb_operand(self.right, precedence + 1)
+        )
+
+
+    def g1m_parts(self):
+        precedence = self.g1m_precedence
+        left = self.g1m_operand(self.left, precedence)
+        if precedence == IMPLICIT_MUL_PRECEDENCE and not _is_g1m_multiplicand(self.left, self.right):
+            right = (b'(', self.right, b')')
+        else:
+            right = self.g1m_operand(self.right, precedence + 1)
+        return (*left, self.g1m_repr, *right)
+
+
+def _g1m_ends_with_num(node):
+    # the last operand written, whether or not it ends up in parentheses
+    while True:
+        if type(node) is BinOp:
+            node = node.right
+        elif type(node) is UnaryOp:
+            node = node.expr
+        elif type(node) is UnaryFunc:
+            node = node.arg1
+        else:
+            return type(node) is Num
+
+
+def _is_g1m_multiplicand(left, right):
+    """
+    Whether right can follow left in an implicit multiplication without
+    parentheses: it has to be an operand that starts with one of the
+    parser's IMPLICIT_MULTIPLICANDS, and two numbers would run together.
+    """
+    if type(right) is Num:
+        return right.value >= 0 and not _g1m_ends_with_num(left)
+    return type(right) in (Var, MemoryIndex, NullaryFunc, BinaryFunc)
 
 
 class Num(AST):
+    __slots__ = ('value',)
+
     def __init__(self, token):
         self.value = token.value
 
 
-    def write_ucb(self, fp, indent):
+    @property
+    def ucb_precedence(self):
+        # only folded constants are negative, and they're written with a sign
+        return PREFIX_PRECEDENCE if self.value < 0 else OPERAND_PRECEDENCE
+
+
+    g1m_precedence = ucb_precedence
+
+
+    def ucb_parts(self, indent):
         val = self.value
         if type(val) is float and val.is_integer():
             val = int(val)
-        fp.write(bytes(str(val), 'ascii'))
+        return bytes(str(val), 'ascii')
 
 
-    def write_g1m(self, fp):
+    def g1m_parts(self):
         val = self.value
         if type(val) is float and val.is_integer():
             val = int(val)
-        fp.write(bytes(str(val), 'ascii'))
+        if val < 0:
+            return UNARY_OPERATOR_REPRS[MINUS][1] + bytes(str(-val), 'ascii')
+        return bytes(str(val), 'ascii')
 
 
 class StringLit(AST):
+    __slots__ = ('value',)
+
     def __init__(self, token):
         self.value = token.value
 
 
-    def write_ucb(self, fp, indent):
-        fp.write(b'"')
-        fp.write(translate_casio_bytes_to_ascii(self.value))
-        fp.write(b'"')
+    def ucb_parts(self, indent):
+        return b'"' + translate_casio_bytes_to_ascii(self.value) + b'"'
 
 
-    def write_g1m(self, fp):
-        fp.write(b'"')
-        fp.write(self.value)
-        fp.write(b'"')
+    def g1m_parts(self):
+        return b'"' + self.value + b'"'
 
 
 class Var(AST):
+    __slots__ = ('value',)
+
     def __init__(self, token):
         self.value = token.value
 
 
-    def write_ucb(self, fp, indent):
-        fp.write(translate_alpha_mem_char_to_ucb(self.value))
+    def ucb_parts(self, indent):
+        return translate_alpha_mem_char_to_ucb(self.value)
 
 
-    def write_g1m(self, fp):
-        fp.write(self.value)
+    def g1m_parts(self):
+        return self.value
 
 
 class Program(AST):
+    __slots__ = ('children',)
+
     def __init__(self):
         self.children = []
 
 
-    def write_ucb(self, fp, indent):
-        for child in self.children:
-            child.write_ucb(fp, indent)
+    def ucb_parts(self, indent):
+        return self.children
 
 
-    def write_g1m(self, fp):
-        for child in self.children:
-            child.write_g1m(fp)
+    def g1m_parts(self):
+        return self.children
 
 
 class IfThen(AST):
+    __slots__ = ('condition', 'if_clause', 'else_clause')
+
     def __init__(self, condition):
         self.condition = condition
         self.if_clause = []
         self.else_clause = []
 
 
-    def write_ucb(self, fp, indent):
-        fp.write(b'if (')
-        self.condition.write_ucb(fp, indent)
-        fp.write(b') {\n')
+    def ucb_parts(self, indent):
+        yield b'if ('
+        yield self.condition
+        yield b') {\n'
         for child in self.if_clause:
-            fp.write(b' ' * UCB_INDENTATION * (indent + 1))
-            child.write_ucb(fp, indent + 1)
+            yield ucb_indentation(indent + 1)
+            yield child, indent + 1
         if self.else_clause:
-            fp.write(b' ' * UCB_INDENTATION * (indent))
-            fp.write(b'} else {\n')
+            yield ucb_indentation(indent)
+            yield b'} else {\n'
             for child in self.else_clause:
-                fp.write(b' ' * UCB_INDENTATION * (indent + 1))
-                child.write_ucb(fp, indent)
-        fp.write(b' ' * UCB_INDENTATION * (indent))
-        fp.write(b'}\n')
+                yield ucb_indentation(indent + 1)
+                yield child
+        yield ucb_indentation(indent)
+        yield b'}\n'
 
 
-    def write_g1m(self, fp):
-        fp.write(b'\xf7\x00')
-        self.condition.write_g1m(fp)
-        fp.write(b'\x0d')
-        fp.write(b'\xf7\x01')
+    def g1m_parts(self):
+        yield b'\xf7\x00'
+        yield self.condition
+        yield b'\x0d'
+        yield b'\xf7\x01'
         for child in self.if_clause:
-            child.write_g1m(fp)
+            yield child
         if self.else_clause:
-            fp.write(b'\xf7\x02')
+            yield b'\xf7\x02'
             for child in self.else_clause:
-                child.write_g1m(fp)
-        fp.write(b'\xf7\x03\x0d')
+                yield child
+        yield b'\xf7\x03\x0d'
 
 
 class ForTo(AST):
+    __slots__ = ('start', 'end', 'step', 'var', 'children')
+
     def __init__(self, start, end, step, var):
         self.start = start
         self.end = end
@@ -252,308 +540,277 @@ class ForTo(AST):
         self.children = []
 
 
-    def write_ucb(self, fp, indent):
-        fp.write(b'for (')
-        self.var.write_ucb(fp, indent)
-        fp.write(b' = ')
-        self.start.write_ucb(fp, indent)
-        fp.write(b' to ')
-        self.end.write_ucb(fp, indent)
+    def ucb_parts(self, indent):
+        yield b'for ('
+        yield self.var
+        yield b' = '
+        yield self.start
+        yield b' to '
+        yield self.end
         if self.step:
-            fp.write(b' step ')
-            self.step.write_ucb(fp, indent)
-        fp.write(b') {\n')
+            yield b' step '
+            yield self.step
+        yield b') {\n'
         for child in self.children:
-            fp.write(b' ' * UCB_INDENTATION * (indent + 1))
-            child.write_ucb(fp, indent + 1)
-        fp.write(b' ' * UCB_INDENTATION * (indent))
-        fp.write(b'}\n')
-
-
-    def write_g1m(self, fp):
-        fp.write(b'\xf7\x04')
-        self.start.write_g1m(fp)
-        fp.write(b'\x0e')
-        self.var.write_g1m(fp)
-        fp.write(b'\xf7\x05')
-        self.end.write_g1m(fp)
+            yield ucb_indentation(indent + 1)
+            yield child, indent + 1
+        yield ucb_indentation(indent)
+        yield b'}\n'
+
+
+    def g1m_parts(self):
+        yield b'\xf7\x04'
+        yield self.start
+        yield b'\x0e'
+        yield self.var
+        yield b'\xf7\x05'
+        yield self.end
         if self.step:
-            fp.write(b'\xf7\x06')
-            self.step.write_g1m(fp)
-        fp.write(b'\x0d')
+            yield b'\xf7\x06'
+            yield self.step
+        yield b'\x0d'
         for child in self.children:
-            child.write_g1m(fp)
-        fp.write(b'\xf7\x07\x0d')
+            yield child
+        yield b'\xf7\x07\x0d'
 
 
 class WhileLoop(AST):
+    __slots__ = ('condition', 'children')
+
     def __init__(self):
         self.condition = None
         self.children = []
 
 
-    def write_ucb(self, fp, indent):
-        fp.write(b'while (')
-        self.condition.write_ucb(fp, indent)
-        fp.write(b') {\n')
+    def ucb_parts(self, indent):
+        yield b'while ('
+        yield self.condition
+        yield b') {\n'
         for child in self.children:
-            fp.write(b' ' * UCB_INDENTATION * (indent + 1))
-            child.write_ucb(fp, indent + 1)
-        fp.write(b' ' * UCB_INDENTATION * (indent))
-        fp.write(b'}\n')
+            yield ucb_indentation(indent + 1)
+            yield child, indent + 1
+        yield ucb_indentation(indent)
+        yield b'}\n'
 
 
-    def write_g1m(self, fp):
-        fp.write(b'\xf7\x08')
-        self.condition.write_g1m(fp)
-        fp.write(b'\x0d')
+    def g1m_parts(self):
+        yield b'\xf7\x08'
+        yield self.condition
+        yield b'\x0d'
         for child in self.children:
-            child.write_g1m(fp)
-        fp.write(b'\xf7\x09\x0d')
+            yield child
+        yield b'\xf7\x09\x0d'
 
 
 class DoLpWhile(AST):
+    __slots__ = ('children', 'condition')
+
     def __init__(self):
         self.children = []
         self.condition = None
 
 
-    def write_ucb(self, fp, indent):
-        fp.write(b'do {\n')
+    def ucb_parts(self, indent):
+        yield b'do {\n'
         for child in self.children:
-            fp.write(b' ' * UCB_INDENTATION * (indent + 1))
-            child.write_ucb(fp, indent + 1)
-        fp.write(b' ' * UCB_INDENTATION * (indent))
-        fp.write(b'} while (')
-        self.condition.write_ucb(fp, indent)
-        fp.write(b');\n')
+            yield ucb_indentation(indent + 1)
+            yield child, indent + 1
+        yield ucb_indentation(indent)
+        yield b'} while ('
+        yield self.condition
+        yield b');\n'
 
 
-    def write_g1m(self, fp):
-        fp.write(b'\xf7\x0a\x0d')
+    def g1m_parts(self):
+        yield b'\xf7\x0a\x0d'
         for child in self.children:
-            child.write_g1m(fp)
-        fp.write(b'\xf7\x0b')
-        self.condition.write_g1m(fp)
-        fp.write(b'\x0d')
+            yield child
+        yield b'\xf7\x0b'
+        yield self.condition
+        yield b'\x0d'
+
+
+class Builtin(AST):
+    """A builtin or function, named after the type of its op token."""
+    __slots__ = ()
 
+    @property
+    def ucb_name(self):
+        return BUILTIN_NAMES[self.op.type][0]
 
-class KeywordBuiltin(AST):
-    def __init__(self, op, ucb_name, g1m_name):
+
+    @property
+    def g1m_name(self):
+        return BUILTIN_NAMES[self.op.type][1]
+
+
+class KeywordBuiltin(Builtin):
+    __slots__ = ('op',)
+
+    def __init__(self, op):
         self.op = op
-        self.ucb_name = ucb_name
-        self.g1m_name = g1m_name
 
 
-    def write_ucb(self, fp, indent):
-        fp.write(self.ucb_name)
-        fp.write(b';\n')
+    def ucb_parts(self, indent):
+        return self.ucb_name + b';\n'
 
 
-    def write_g1m(self, fp):
-        fp.write(self.g1m_name)
-        fp.write(b'\x0d')
+    def g1m_parts(self):
+        return self.g1m_name + b'\x0d'
+
 
+class NullaryBuiltin(Builtin):
+    __slots__ = ('op',)
 
-class NullaryBuiltin(AST):
-    def __init__(self, op, ucb_name, g1m_name):
+    def __init__(self, op):
         self.op = op
-        self.ucb_name = ucb_name
-        self.g1m_name = g1m_name
 
 
-    def write_ucb(self, fp, indent):
-        fp.write(self.ucb_name)
-        fp.write(b'();\n')
+    def ucb_parts(self, indent):
+        return self.ucb_name + b'();\n'
 
 
-    def write_g1m(self, fp):
-        fp.write(self.g1m_name)
-        fp.write(b'\x0d')
+    def g1m_parts(self):
+        return self.g1m_name + b'\x0d'
+
 
+class NullaryFunc(Builtin):
+    __slots__ = ('op',)
 
-class NullaryFunc(AST):
-    def __init__(self, op, ucb_name, g1m_name):
+    def __init__(self, op):
         self.op = op
-        self.ucb_name = ucb_name
-        self.g1m_name = g1m_name
 
 
-    def write_ucb(self, fp, indent):
-        fp.write(self.ucb_name)
-        fp.write(b'()')
+    def ucb_parts(self, indent):
+        return self.ucb_name + b'()'
 
 
-    def write_g1m(self, fp):
-        fp.write(self.g1m_name)
+    def g1m_parts(self):
+        return self.g1m_name
+
 
+class UnaryBuiltin(Builtin):
+    __slots__ = ('op', 'arg1')
 
-class UnaryBuiltin(AST):
-    def __init__(self, op, ucb_name, g1m_name, arg1):
+    def __init__(self, op, arg1):
         self.op = op
-        self.ucb_name = ucb_name
-        self.g1m_name = g1m_name
         self.arg1 = arg1
 
 
-    def write_ucb(self, fp, indent):
-        fp.write(self.ucb_name)
-        fp.write(b'(')
-        self.arg1.write_ucb(fp, indent)
-        fp.write(b');\n')
+    def ucb_parts(self, indent):
+        return (self.ucb_name, b'(', self.arg1, b');\n')
 
 
-    def write_g1m(self, fp):
-        fp.write(self.g1m_name)
-        self.arg1.write_g1m(fp)
-        fp.write(b'\x0d')
+    def g1m_parts(self):
+        return (self.g1m_name, self.arg1, b'\x0d')
+
+
+class UnaryFunc(Builtin):
+    __slots__ = ('op', 'arg1')
 
+    # in g1m the argument has no parentheses, so it binds like a prefix
+    # operator
+    g1m_precedence = PREFIX_PRECEDENCE
 
-class UnaryFunc(AST):
-    def __init__(self, op, ucb_name, g1m_name, arg1):
+    def __init__(self, op, arg1):
         self.op = op
-        self.ucb_name = ucb_name
-        self.g1m_name = g1m_name
         self.arg1 = arg1
 
 
-    def write_ucb(self, fp, indent):
-        fp.write(self.ucb_name)
-        fp.write(b'(')
-        self.arg1.write_ucb(fp, indent)
-        fp.write(b')')
+    def ucb_parts(self, indent):
+        return (self.ucb_name, b'(', self.arg1, b')')
 
 
-    def write_g1m(self, fp):
-        fp.write(self.g1m_name)
-        # check if this arg should be parameterized
-        # it should not be eagerly evaluated
-        self.write_g1m_op(self.arg1, fp)
+    def g1m_parts(self):
+        # the argument is not eagerly evaluated: it's a unary expression
+        return (self.g1m_name, *self.g1m_operand(self.arg1, PREFIX_PRECEDENCE))
 
 
-class BinaryBuiltin(AST):
-    def __init__(self, op, ucb_name, g1m_name, arg1, arg2):
+class BinaryBuiltin(Builtin):
+    __slots__ = ('op', 'arg1', 'arg2')
+
+    def __init__(self, op, arg1, arg2):
         self.op = op
-        self.ucb_name = ucb_name
-        self.g1m_name = g1m_name
         self.arg1 = arg1
         self.arg2 = arg2
 
 
-    def write_ucb(self, fp, indent):
-        fp.write(self.ucb_name)
-        fp.write(b'(')
-        self.arg1.write_ucb(fp, indent)
-        fp.write(b', ')
-        self.arg2.write_ucb(fp, indent)
-        fp.write(b');\n')
+    def ucb_parts(self, indent):
+        return (self.ucb_name, b'(', self.arg1, b', ', self.arg2, b');\n')
 
 
-    def write_g1m(self, fp):
-        fp.write(self.g1m_name)
-        self.arg1.write_g1m(fp)
-        fp.write(b',')
-        self.arg2.write_g1m(fp)
-        fp.write(b'\x0d')
+    def g1m_parts(self):
+        return (self.g1m_name, self.arg1, b',', self.arg2, b'\x0d')
+
 
+class BinaryFunc(Builtin):
+    __slots__ = ('op', 'arg1', 'arg2')
 
-class BinaryFunc(AST):
-    def __init__(self, op, ucb_name, g1m_name, arg1, arg2):
+    def __init__(self, op, arg1, arg2):
         self.op = op
-        self.ucb_name = ucb_name
-        self.g1m_name = g1m_name
         self.arg1 = arg1
         self.arg2 = arg2
 
 
-    def write_ucb(self, fp, indent):
-        fp.write(self.ucb_name)
-        fp.write(b'(')
-        self.arg1.write_ucb(fp, indent)
-        fp.write(b', ')
-        self.arg2.write_ucb(fp, indent)
-        fp.write(b')')
+    def ucb_parts(self, indent):
+        return (self.ucb_name, b'(', self.arg1, b', ', self.arg2, b')')
 
 
-    def write_g1m(self, fp):
-        fp.write(self.g1m_name)
-        self.arg1.write_g1m(fp)
-        fp.write(b',')
-        self.arg2.write_g1m(fp)
+    def g1m_parts(self):
+        # the name includes the opening parenthesis
+        return (self.g1m_name, self.arg1, b',', self.arg2, b')')
 
 
-class TernaryBuiltin(AST):
-    def __init__(self, op, ucb_name, g1m_name, arg1, arg2, arg3):
+class TernaryBuiltin(Builtin):
+    __slots__ = ('op', 'arg1', 'arg2', 'arg3')
+
+    def __init__(self, op, arg1, arg2, arg3):
         self.op = op
-        self.ucb_name = ucb_name
-        self.g1m_name = g1m_name
         self.arg1 = arg1
         self.arg2 = arg2
         self.arg3 = arg3
 
 
-    def write_ucb(self, fp, indent):
-        fp.write(self.ucb_name)
-        fp.write(b'(')
-        self.arg1.write_ucb(fp, indent)
-        fp.write(b', ')
-        self.arg2.write_ucb(fp, indent)
-        fp.write(b', ')
-        self.arg3.write_ucb(fp, indent)
-        fp.write(b');\n')
+    def ucb_parts(self, indent):
+        return (
+            self.ucb_name, b'(', self.arg1, b', ', self.arg2, b', ', self.arg3, b');\n'
+        )
 
 
-    def write_g1m(self, fp):
-        fp.write(self.g1m_name)
-        self.arg1.write_g1m(fp)
-        fp.write(b',')
-        self.arg2.write_g1m(fp)
-        fp.write(b',')
-        self.arg3.write_g1m(fp)
-        fp.write(b'\x0d')
+    def g1m_parts(self):
+        return (self.g1m_name, self.arg1, b',', self.arg2, b',', self.arg3, b'\x0d')
+
 
+class QuaternaryBuiltin(Builtin):
+    __slots__ = ('op', 'arg1', 'arg2', 'arg3', 'arg4')
 
-class QuaternaryBuiltin(AST):
-    def __init__(self, op, ucb_name, g1m_name, arg1, arg2, arg3, arg4):
+    def __init__(self, op, arg1, arg2, arg3, arg4):
         self.op = op
-        self.ucb_name = ucb_name
-        self.g1m_name = g1m_name
         self.arg1 = arg1
         self.arg2 = arg2
         self.arg3 = arg3
         self.arg4 = arg4
 
 
-    def write_ucb(self, fp, indent):
-        fp.write(self.ucb_name)
-        fp.write(b'(')
-        self.arg1.write_ucb(fp, indent)
-        fp.write(b', ')
-        self.arg2.write_ucb(fp, indent)
-        fp.write(b', ')
-        self.arg3.write_ucb(fp, indent)
-        fp.write(b', ')
-        self.arg4.write_ucb(fp, indent)
-        fp.write(b');\n')
+    def ucb_parts(self, indent):
+        return (
+            self.ucb_name, b'(', self.arg1, b', ', self.arg2, b', ', self.arg3, b', ',
+            self.arg4, b');\n'
+        )
 
 
-    def write_g1m(self, fp):
-        fp.write(self.g1m_name)
-        self.arg1.write_g1m(fp)
-        fp.write(b',')
-        self.arg2.write_g1m(fp)
-        fp.write(b',')
-        self.arg3.write_g1m(fp)
-        fp.write(b',')
-        self.arg4.write_g1m(fp)
-        fp.write(b'\x0d')
-
-
-class SenaryBuiltin(AST):
-    def __init__(self, op, ucb_name, g1m_name, arg1, arg2, arg3, arg4, arg5, arg6):
+    def g1m_parts(self):
+        return (
+            self.g1m_name, self.arg1, b',', self.arg2, b',', self.arg3, b',', self.arg4,
+            b'\x0d'
+        )
+
+
+class SenaryBuiltin(Builtin):
+    __slots__ = ('op', 'arg1', 'arg2', 'arg3', 'arg4', 'arg5', 'arg6')
+
+    def __init__(self, op, arg1, arg2, arg3, arg4, arg5, arg6):
         self.op = op
-        self.ucb_name = ucb_name
-        self.g1m_name = g1m_name
         self.arg1 = arg1
         self.arg2 = arg2
         self.arg3 = arg3
@@ -562,134 +819,401 @@ class SenaryBuiltin(AST):
         self.arg6 = arg6
 
 
-    def write_ucb(self, fp, indent):
-        fp.write(self.ucb_name)
-        fp.write(b'(')
-        self.arg1.write_ucb(fp, indent)
-        fp.write(b', ')
-        self.arg2.write_ucb(fp, indent)
-        fp.write(b', ')
-        self.arg3.write_ucb(fp, indent)
-        fp.write(b', ')
-        self.arg4.write_ucb(fp, indent)
-        fp.write(b', ')
-        self.arg5.write_ucb(fp, indent)
-        fp.write(b', ')
-        self.arg6.write_ucb(fp, indent)
-        fp.write(b');\n')
+    def ucb_parts(self, indent):
+        return (
+            self.ucb_name, b'(', self.arg1, b', ', self.arg2, b', ', self.arg3, b', ',
+            self.arg4, b', ', self.arg5, b', ', self.arg6, b');\n'
+        )
 
 
-    def write_g1m(self, fp):
-        fp.write(self.g1m_name)
-        self.arg1.write_g1m(fp)
-        fp.write(b',')
-        self.arg2.write_g1m(fp)
-        fp.write(b',')
-        self.arg3.write_g1m(fp)
-        fp.write(b',')
-        self.arg4.write_g1m(fp)
-        fp.write(b',')
-        self.arg5.write_g1m(fp)
-        fp.write(b',')
-        self.arg6.write_g1m(fp)
-        fp.write(b'\x0d')
+    def g1m_parts(self):
+        return (
+            self.g1m_name, self.arg1, b',', self.arg2, b',', self.arg3, b',', self.arg4,
+            b',', self.arg5, b',', self.arg6, b'\x0d'
+        )
 
 
 class Assign(AST):
+    __slots__ = ('expr', 'var')
+
     def __init__(self, expr, var):
         self.expr = expr
         self.var = var
 
 
-    def write_ucb(self, fp, indent):
-        self.var.write_ucb(fp, indent)
-        fp.write(b' = ')
-        self.expr.write_ucb(fp, indent)
-        fp.write(b';\n')
+    def ucb_parts(self, indent):
+        return (self.var, b' = ', self.expr, b';\n')
 
 
-    def write_g1m(self, fp):
-        self.expr.write_g1m(fp)
-        fp.write(b'\x0e')
-        self.var.write_g1m(fp)
-        fp.write(b'\x0d')
+    def g1m_parts(self):
+        return (self.expr, b'\x0e', self.var, b'\x0d')
 
 
 class VariableRange(AST):
+    __slots__ = ('lower', 'upper')
+
     def __init__(self, lower, upper):
         self.lower = lower
         self.upper = upper
 
 
-    def write_ucb(self, fp, indent):
-        self.lower.write_ucb(fp, indent)
-        fp.write(b'~')
-        self.upper.write_ucb(fp, indent)
+    def ucb_parts(self, indent):
+        return (self.lower, b'~', self.upper)
 
 
-    def write_g1m(self, fp):
-        self.lower.write_g1m(fp)
-        fp.write(b'~')
-        self.upper.write_g1m(fp)
+    def g1m_parts(self):
+        return (self.lower, b'~', self.upper)
 
 
 class Initialize(AST):
+    __slots__ = ('dimensions', 'mem_struct')
+
     def __init__(self, dimensions, mem_struct):
         self.dimensions = dimensions
         self.mem_struct = mem_struct
 
 
-    def write_ucb(self, fp, indent):
-        fp.write(b'dim ')
-        self.mem_struct.write_ucb(fp, indent)
-        fp.write(b' = (')
-        self.dimensions[0].write_ucb(fp, indent)
-        fp.write(b', ')
-        self.dimensions[1].write_ucb(fp, indent)
-        fp.write(b');\n')
+    def ucb_parts(self, indent):
+        return (
+            b'dim ', self.mem_struct, b' = (', self.dimensions[0], b', ',
+            self.dimensions[1], b');\n'
+        )
 
 
-    def write_g1m(self, fp):
-        fp.write(b'{')
-        self.dimensions[0].write_g1m(fp)
-        fp.write(b',')
-        self.dimensions[1].write_g1m(fp)
-        fp.write(b'}')
-        fp.write(b'\x0e')
-        fp.write(b'\x7f\x46')
-        self.mem_struct.write_g1m(fp)
-        fp.write(b'\x0d')
+    def g1m_parts(self):
+        return (
+            b'{', self.dimensions[0], b',', self.dimensions[1], b'}', b'\x0e',
+            b'\x7f\x46', self.mem_struct, b'\x0d'
+        )
 
 
 class Label(AST):
+    __slots__ = ('op',)
+
     def __init__(self, op):
         self.op = op
 
 
-    def write_ucb(self, fp, indent):
-        fp.write(b'label ')
-        self.op.write_ucb(fp, indent)
-        fp.write(b';\n')
+    def ucb_parts(self, indent):
+        return (b'label ', self.op, b';\n')
 
 
-    def write_g1m(self, fp):
-        fp.write(b'\xe2')
-        self.op.write_g1m(fp)
-        fp.write(b'\x0d')
+    def g1m_parts(self):
+        return (b'\xe2', self.op, b'\x0d')
 
 
 class Goto(AST):
+    __slots__ = ('op',)
+
     def __init__(self, op):
         self.op = op
 
 
-    def write_ucb(self, fp, indent):
-        fp.write(b'goto ')
-        self.op.write_ucb(fp, indent)
-        fp.write(b';\n')
+    def ucb_parts(self, indent):
+        return (b'goto ', self.op, b';\n')
 
 
-    def write_g1m(self, fp):
-        fp.write(b'\xec')
-        self.op.write_g1m(fp)
-        fp.write(b'\x0d')
+    def g1m_parts(self):
+        return (b'\xec', self.op, b'\x0d')
+
+
+class Shared(AST):
+    """
+    A subexpression that occurs more than once in a statement, and is
+    evaluated once for all of them by the enclosing SharedScope. Made by
+    the optimizer; the same node stands at every occurrence.
+    """
+    __slots__ = ('expr', 'value')
+
+    def __init__(self, expr):
+        self.expr = expr
+        self.value = None
+
+
+    @property
+    def ucb_precedence(self):
+        return self.expr.ucb_precedence
+
+
+    @property
+    def g1m_precedence(self):
+        return self.expr.g1m_precedence
+
+
+    def ucb_parts(self, indent):
+        return (self.expr,)
+
+
+    def g1m_parts(self):
+        return (self.expr,)
+
+
+class SharedScope(AST):
+    """Evaluates the Shared subexpressions of a statement or condition, then runs it."""
+    __slots__ = ('shared', 'expr')
+
+    def __init__(self, shared, expr):
+        self.shared = shared
+        self.expr = expr
+
+
+    @property
+    def ucb_precedence(self):
+        return self.expr.ucb_precedence
+
+
+    @property
+    def g1m_precedence(self):
+        return self.expr.g1m_precedence
+
+
+    def ucb_parts(self, indent):
+        return (self.expr,)
+
+
+    def g1m_parts(self):
+        return (self.expr,)
+
+
+class CountedForTo(AST):
+    """
+    A For loop with constant bounds whose body never writes its counter,
+    run as a counted loop. Made by the optimizer.
+    """
+    __slots__ = ('loop', 'count')
+
+    def __init__(self, loop, count):
+        self.loop = loop
+        self.count = count
+
+
+    def ucb_parts(self, indent):
+        return (self.loop,)
+
+
+    def g1m_parts(self):
+        return (self.loop,)
+
+
+class Hoisted(AST):
+    """
+    A loop-invariant subexpression, evaluated the first time it's used
+    after its HoistScope starts the loop. Made by the optimizer.
+    """
+    __slots__ = ('expr', 'value')
+
+    def __init__(self, expr):
+        self.expr = expr
+        self.value = None
+
+
+    @property
+    def ucb_precedence(self):
+        return self.expr.ucb_precedence
+
+
+    @property
+    def g1m_precedence(self):
+        return self.expr.g1m_precedence
+
+
+    def ucb_parts(self, indent):
+        return (self.expr,)
+
+
+    def g1m_parts(self):
+        return (self.expr,)
+
+
+class HoistScope(AST):
+    """Forgets the values of a loop's Hoisted subexpressions, then runs it."""
+    __slots__ = ('hoisted', 'loop')
+
+    def __init__(self, hoisted, loop):
+        self.hoisted = hoisted
+        self.loop = loop
+
+
+    def ucb_parts(self, indent):
+        return (self.loop,)
+
+
+    def g1m_parts(self):
+        return (self.loop,)
+
+
+class MatRow(AST):
+    """A row of a matrix, as the list the machine keeps. Only used through RowIndex."""
+    __slots__ = ('mem_struct', 'index')
+
+    def __init__(self, mem_struct, index):
+        self.mem_struct = mem_struct
+        self.index = index
+
+
+class RowIndex(AST):
+    """
+    A MemoryIndex into a matrix row that is looked up once per loop,
+    usually a Hoisted MatRow. Made by the optimizer; written as the
+    MemoryIndex it replaces.
+    """
+    __slots__ = ('row', 'index', 'source')
+
+    def __init__(self, row, index, source):
+        self.row = row
+        self.index = index
+        self.source = source
+
+
+    def ucb_parts(self, indent):
+        return (self.source,)
+
+
+    def g1m_parts(self):
+        return (self.source,)
+
+
+class IntMatRow(AST):
+    """A MatRow whose index is always an int, so it isn't converted."""
+    __slots__ = ('mem_struct', 'index')
+
+    def __init__(self, mem_struct, index):
+        self.mem_struct = mem_struct
+        self.index = index
+
+
+class IntRowIndex(AST):
+    """A RowIndex whose index is always an int, so it isn't converted."""
+    __slots__ = ('row', 'index', 'source')
+
+    def __init__(self, row, index, source):
+        self.row = row
+        self.index = index
+        self.source = source
+
+
+    def ucb_parts(self, indent):
+        return (self.source,)
+
+
+    def g1m_parts(self):
+        return (self.source,)
+
+
+class InlinedProg(AST):
+    """
+    The statements of a program called with Prog, run in place of the
+    call. If a Return is left in them, it's caught here. Made by the
+    optimizer.
+    """
+    __slots__ = ('name', 'children', 'returns')
+
+    def __init__(self, name, children, returns):
+        self.name = name
+        self.children = children
+        self.returns = returns
+
+
+    def ucb_parts(self, indent):
+        return self.children
+
+
+    def g1m_parts(self):
+        return self.children
+
+
+class Fused(AST):
+    """
+    Base of the nodes that run a common shape of statement or expression
+    in one visit. Made by the optimizer; each is written as its source.
+    """
+    __slots__ = ()
+
+    @property
+    def ucb_precedence(self):
+        return self.source.ucb_precedence
+
+
+    @property
+    def g1m_precedence(self):
+        return self.source.g1m_precedence
+
+
+    def ucb_parts(self, indent):
+        return (self.source,)
+
+
+    def g1m_parts(self):
+        return (self.source,)
+
+
+class SetVar(Fused):
+    """e.g. 3->A"""
+    __slots__ = ('name', 'value', 'source')
+
+    def __init__(self, name, value, source):
+        self.name = name
+        self.value = value
+        self.source = source
+
+
+class AddToVar(Fused):
+    """e.g. A+1->A, A-1->A, Isz A"""
+    __slots__ = ('name', 'step', 'source')
+
+    def __init__(self, name, step, source):
+        self.name = name
+        self.step = step
+        self.source = source
+
+
+class GetkeyToVar(Fused):
+    """Getkey->K"""
+    __slots__ = ('name', 'source')
+
+    def __init__(self, name, source):
+        self.name = name
+        self.source = source
+
+
+class AssignVar(Fused):
+    """Any other assignment to a single var, e.g. Mat A[X, Y]->Z"""
+    __slots__ = ('name', 'expr', 'source')
+
+    def __init__(self, name, expr, source):
+        self.name = name
+        self.expr = expr
+        self.source = source
+
+
+class MatElement(Fused):
+    """A read of Mat A[X, Y]"""
+    __slots__ = ('name', 'row', 'column', 'source')
+
+    def __init__(self, name, row, column, source):
+        self.name = name
+        self.row = row
+        self.column = column
+        self.source = source
+
+
+class VarCompare(Fused):
+    """e.g. K=31, with compare the fn that compares the var to value"""
+    __slots__ = ('name', 'compare', 'value', 'source')
+
+    def __init__(self, name, compare, value, source):
+        self.name = name
+        self.compare = compare
+        self.value = value
+        self.source = source
+
+
+class IfVarCompare(Fused):
+    """An If whose condition is a VarCompare; its clauses are the source's."""
+    __slots__ = ('name', 'compare', 'value', 'source')
+
+    def __init__(self, name, compare, value, source):
+        self.name = name
+        self.compare = compare
+        self.value = value
+        self.source = source
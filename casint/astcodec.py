@@ -0,0 +1,145 @@
+"""
+A compact binary form of parsed program trees, for shipping them between
+processes (and keeping them on disk) without the cost of pickling every
+node and token object.
+
+A tree is flattened in prefix order into a stream of small ints, each a
+tag in the low bits and an index or count above it. Node classes with
+their attribute names, tokens and other values are each written once, in
+tables the stream indexes into.
+"""
+import marshal
+from array import array
+
+from . import ast
+from .interpreter import Token
+
+# bump whenever the layout or the AST classes change
+CODEC_VERSION = 2
+
+TAG_BITS = 3
+TAG_MASK = (1 << TAG_BITS) - 1
+
+_NONE = 0
+_VALUE = 1
+_LIST = 2
+_TUPLE = 3
+_TOKEN = 4
+_NODE = 5
+
+
+class AstCodecException(Exception):
+    pass
+
+
+def _node_classes():
+    classes = dict()
+    pending = [ast.AST]
+    while pending:
+        cls = pending.pop()
+        classes[cls.__name__] = cls
+        pending.extend(cls.__subclasses__())
+    return classes
+
+
+class _Table():
+    """Values in order of first use, each kept once."""
+    def __init__(self):
+        self.items = []
+        self.ids = dict()
+
+    def index(self, key, item):
+        i = self.ids.get(key)
+        if i is None:
+            i = self.ids[key] = len(self.items)
+            self.items.append(item)
+        return i
+
+
+def encode_tree(tree):
+    """Returns the bytes of a tree."""
+    schemas = _Table()
+    tokens = _Table()
+    values = _Table()
+    out = []
+    append = out.append
+
+    def encode(value):
+        if value is None:
+            append(_NONE)
+        elif isinstance(value, ast.AST):
+            names = type(value).__slots__
+            key = (type(value).__name__, names)
+            append(schemas.index(key, key) << TAG_BITS | _NODE)
+            for name in names:
+                encode(getattr(value, name))
+        elif isinstance(value, Token):
+            # the value's type keeps 1 and 1.0 (or True) apart
+            key = (value.type, type(value.value), value.value)
+            append(tokens.index(key, (value.type, value.value)) << TAG_BITS | _TOKEN)
+        elif isinstance(value, list):
+            append(len(value) << TAG_BITS | _LIST)
+            for item in value:
+                encode(item)
+        elif isinstance(value, tuple):
+            append(len(value) << TAG_BITS | _TUPLE)
+            for item in value:
+                encode(item)
+        else:
+            append(values.index((type(value), value), value) << TAG_BITS | _VALUE)
+
+    encode(tree)
+    typecode = 'H' if max(out) <= 0xffff else 'I'
+    stream = array(typecode, out)
+    return marshal.dumps((
+        CODEC_VERSION, schemas.items, tokens.items, values.items,
+        typecode, stream.tobytes()
+    ))
+
+
+def decode_tree(data):
+    """Rebuilds a tree from the bytes made by `encode_tree`."""
+    try:
+        version, *tables = marshal.loads(data)
+    except (EOFError, ValueError, TypeError) as e:
+        raise AstCodecException(f'Invalid encoded tree: {e}')
+    if version != CODEC_VERSION or len(tables) != 5:
+        raise AstCodecException(f'Unknown encoded tree version: {version}')
+    schemas, tokens, values, typecode, stream_bytes = tables
+
+    classes = _node_classes()
+    try:
+        schemas = [(classes[name], names) for name, names in schemas]
+    except KeyError as e:
+        raise AstCodecException(f'Unknown node class: {e}')
+    tokens = [Token(token_type, value) for token_type, value in tokens]
+    stream = array(typecode)
+    stream.frombytes(stream_bytes)
+
+    pos = 0
+
+    def decode():
+        nonlocal pos
+        item = stream[pos]
+        pos += 1
+        tag = item & TAG_MASK
+        arg = item >> TAG_BITS
+        if tag == _NODE:
+            cls, names = schemas[arg]
+            node = cls.__new__(cls)
+            for name in names:
+                setattr(node, name, decode())
+            return node
+        if tag == _VALUE:
+            return values[arg]
+        if tag == _TOKEN:
+            return tokens[arg]
+        if tag == _NONE:
+            return None
+        if tag == _LIST:
+            return [decode() for _ in range(arg)]
+        if tag == _TUPLE:
+            return tuple([decode() for _ in range(arg)])
+        raise AstCodecException(f'Unknown tag in encoded tree: {tag}')
+
+    return decode()
@@ -0,0 +1,167 @@
+"""
+The static call graph of the programs in a collection, from the names
+given to Prog as string literals. A Prog whose name is computed can call
+anything, so its caller is marked `dynamic` and reaches every program.
+"""
+import threading
+
+from .common import *
+from .ast import StringLit, UnaryBuiltin, iter_child_nodes
+
+
+def prog_callees(tree):
+    """
+    Returns the names a tree calls with Prog, in the order they first
+    appear, and whether any Prog has a computed name.
+    """
+    names = []
+    dynamic = False
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if type(node) is UnaryBuiltin and node.op.type == PROG:
+            if type(node.arg1) is StringLit:
+                if node.arg1.value not in names:
+                    names.append(node.arg1.value)
+            else:
+                dynamic = True
+        # in source order
+        stack.extend(reversed(list(iter_child_nodes(node))))
+    return names, dynamic
+
+
+class CallGraph():
+    """
+    The calls between the programs of a collection. Programs are only
+    parsed when they're added, so a graph can cover just what an entry
+    program reaches. A collection adds to its graph from a background
+    thread too, so what's recorded is only read and written under a lock.
+    """
+    def __init__(self, items):
+        self.items = items
+        self._lock = threading.Lock()
+        # program name -> the names it calls
+        self.callees = dict()
+        # the programs with a Prog whose name is computed
+        self.dynamic = set()
+        # program name -> the error it didn't parse with
+        self.errors = dict()
+
+    @classmethod
+    def from_items(cls, items):
+        graph = cls(items)
+        for program in items.get_programs():
+            graph.add(program)
+        return graph
+
+    def add(self, program):
+        """Parses a program, if it isn't yet, and records its calls."""
+        with self._lock:
+            if program.name in self.callees or program.name in self.errors:
+                return
+        # parsed outside the lock, which the program has one of its own for
+        try:
+            tree = program.tree
+        except Exception as e:
+            with self._lock:
+                # raised again when the program is run
+                self.errors[program.name] = e
+            return
+        callees, dynamic = prog_callees(tree)
+        with self._lock:
+            # dynamic first, as having callees is what marks it as added
+            if dynamic:
+                self.dynamic.add(program.name)
+            self.callees[program.name] = callees
+
+    def reachable(self, entry):
+        """
+        The programs an entry program may run, itself first, in the order
+        they're found going down the calls. Each one is added on the way.
+        """
+        order = []
+        seen = set()
+        queue = [entry]
+        while queue:
+            program = queue.pop(0)
+            if program.name in seen:
+                continue
+            seen.add(program.name)
+            order.append(program)
+            self.add(program)
+            with self._lock:
+                if program.name in self.dynamic:
+                    names = [p.name for p in self.items.get_programs()]
+                else:
+                    names = list(self.callees.get(program.name, []))
+            for name in names:
+                callee = self.items.get_program_by_name(name)
+                if callee is not None and callee.name not in seen:
+                    queue.append(callee)
+        return order
+
+    def roots(self):
+        """The programs that no other program calls: the entry points."""
+        called = set()
+        for name, callees in self._recorded_callees().items():
+            called.update(callee for callee in callees if callee != name)
+        return [p for p in self.items.get_programs() if p.name not in called]
+
+    def unreachable(self, entries):
+        """The programs that none of the entry programs can run."""
+        reached = set()
+        for entry in entries:
+            reached.update(p.name for p in self.reachable(entry))
+        return [p for p in self.items.get_programs() if p.name not in reached]
+
+    def missing(self):
+        """(caller, name) for each call of a program that isn't in the collection."""
+        return [
+            (caller, name)
+            for caller, callees in self._recorded_callees().items()
+            for name in callees
+            if self.items.get_program_by_name(name) is None
+        ]
+
+    def cycles(self):
+        """The groups of programs that call each other, each a list of names."""
+        graph = self._recorded_callees()
+        # Tarjan's strongly connected components
+        index = dict()
+        lowlink = dict()
+        stack = []
+        on_stack = set()
+        result = []
+
+        def connect(name):
+            index[name] = lowlink[name] = len(index)
+            stack.append(name)
+            on_stack.add(name)
+            for callee in graph[name]:
+                if callee not in graph:
+                    continue
+                if callee not in index:
+                    connect(callee)
+                    lowlink[name] = min(lowlink[name], lowlink[callee])
+                elif callee in on_stack:
+                    lowlink[name] = min(lowlink[name], index[callee])
+            if lowlink[name] == index[name]:
+                group = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    group.append(member)
+                    if member == name:
+                        break
+                if len(group) > 1 or name in graph[name]:
+                    result.append(list(reversed(group)))
+
+        for name in graph:
+            if name not in index:
+                connect(name)
+        return result
+
+    def _recorded_callees(self):
+        # a copy that another thread adding programs won't change
+        with self._lock:
+            return dict(self.callees)
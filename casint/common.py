@@ -42,6 +42,7 @@ GRAPHYEQ = b'GRAPHYEQ'
 VIEWWINDOW = b'VIEWWINDOW'
 FLINE = b'FLINE'
 HORIZONTAL = b'HORIZONTAL'
+VERTICAL = b'VERTICAL'
 CIRCLE = b'CIRCLE'
 PLOTON = b'PLOTON'
 PXLON = b'PXLON'
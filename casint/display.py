@@ -0,0 +1,34 @@
+"""
+Display frontends present a `graphics.Screen` and deliver key presses
+as CASIO Getkey codes. The machine only talks to a frontend through
+this interface; see `display_sdl` and `display_terminal`.
+"""
+
+DEFAULT_CASIO_GETKEY = 0
+
+
+class InterpreterQuitException(Exception):
+    pass
+
+
+class Display():
+    def present(self, screen):
+        """Shows the screen."""
+        raise NotImplementedError()
+
+    def poll_key(self):
+        """
+        Returns the CASIO key code of a key pressed since the last poll,
+        or None. Raises InterpreterQuitException if the user quit.
+        """
+        raise NotImplementedError()
+
+    def delay(self):
+        """Waits for a frame."""
+        pass
+
+    def set_title(self, name):
+        pass
+
+    def close(self):
+        pass
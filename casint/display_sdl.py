@@ -0,0 +1,120 @@
+import ctypes
+
+import sdl2
+
+from .display import Display, InterpreterQuitException, DEFAULT_CASIO_GETKEY
+from .graphics import SCREEN_WIDTH, SCREEN_HEIGHT
+
+SDL_DELAY_MILLIS = 16
+ASPECT_RATIO = 2.0
+
+COLOR_ON = b'\x10\x10\x10'
+COLOR_OFF = b'\xe8\xe8\xee'
+
+# maps a packed frame byte to its 8 pixels as RGB24
+FRAME_BYTE_PIXELS = [
+    b''.join(COLOR_ON if c & (0x80 >> i) else COLOR_OFF for i in range(8))
+    for c in range(256)
+]
+
+SDL_CASIO_KEYMAP = {
+	sdl2.SDLK_UP		: 28,
+	sdl2.SDLK_RIGHT		: 27,
+	sdl2.SDLK_DOWN		: 37,
+	sdl2.SDLK_LEFT		: 38,
+	sdl2.SDLK_RETURN	: 31,
+	sdl2.SDLK_0			: 71,
+	sdl2.SDLK_1			: 72,
+	sdl2.SDLK_2			: 62,
+	sdl2.SDLK_3			: 52,
+	sdl2.SDLK_4			: 73,
+	sdl2.SDLK_5			: 63,
+	sdl2.SDLK_6			: 53,
+	sdl2.SDLK_7			: 74,
+	sdl2.SDLK_8			: 64,
+	sdl2.SDLK_9			: 54,
+	sdl2.SDLK_PERIOD	: 61,
+	sdl2.SDLK_KP_0		: 71,
+	sdl2.SDLK_KP_1		: 72,
+	sdl2.SDLK_KP_2		: 62,
+	sdl2.SDLK_KP_3		: 52,
+	sdl2.SDLK_KP_4		: 73,
+	sdl2.SDLK_KP_5		: 63,
+	sdl2.SDLK_KP_6		: 53,
+	sdl2.SDLK_KP_7		: 74,
+	sdl2.SDLK_KP_8		: 64,
+	sdl2.SDLK_KP_9		: 54,
+	sdl2.SDLK_KP_PERIOD	: 61,
+	sdl2.SDLK_F1		: 79,
+	sdl2.SDLK_F2		: 69,
+	sdl2.SDLK_F3		: 59,
+	sdl2.SDLK_F4		: 49,
+	sdl2.SDLK_F5		: 39,
+	sdl2.SDLK_F6		: 29,
+	sdl2.SDLK_ESCAPE	: 47,
+	sdl2.SDLK_LCTRL		: 48,
+	sdl2.SDLK_RCTRL		: 48
+}
+
+
+class SdlDisplay(Display):
+    def __init__(self):
+        sdl2.SDL_Init(sdl2.SDL_INIT_VIDEO)
+
+        self.window = sdl2.SDL_CreateWindow(
+            b'CASINT: CASIO Basic Interpreter',
+            sdl2.SDL_WINDOWPOS_CENTERED, sdl2.SDL_WINDOWPOS_CENTERED,
+            512, 256, sdl2.SDL_WINDOW_SHOWN | sdl2.SDL_WINDOW_RESIZABLE)
+
+        self.renderer = sdl2.SDL_CreateRenderer(
+            self.window, -1, sdl2.SDL_RENDERER_ACCELERATED)
+
+        sdl2.SDL_RenderSetLogicalSize(self.renderer, SCREEN_WIDTH, SCREEN_HEIGHT)
+
+        # the screen is uploaded to this texture whenever it's presented
+        self.texture = sdl2.SDL_CreateTexture(
+            self.renderer, sdl2.SDL_PIXELFORMAT_RGB24,
+            sdl2.SDL_TEXTUREACCESS_STREAMING, SCREEN_WIDTH, SCREEN_HEIGHT)
+
+    def present(self, screen):
+        pixels = b''.join([FRAME_BYTE_PIXELS[c] for c in screen.frame()])
+        sdl2.SDL_UpdateTexture(self.texture, None, pixels, SCREEN_WIDTH * 3)
+        sdl2.SDL_RenderCopy(self.renderer, self.texture, None, None)
+        sdl2.SDL_RenderPresent(self.renderer)
+
+    def _handle_windowevents(self, event):
+        if event.window.event == sdl2.SDL_WINDOWEVENT_RESIZED:
+            width = event.window.data1
+            height = event.window.data2
+            aspectRatio = float(width) / float(height)
+            if aspectRatio != ASPECT_RATIO:
+                if aspectRatio > ASPECT_RATIO:
+                    width = int(ASPECT_RATIO * float(height))
+                else:
+                    height = int(float(width) / ASPECT_RATIO)
+                sdl2.SDL_SetWindowSize(self.window, width, height)
+
+    def poll_key(self):
+        key = None
+        event = sdl2.SDL_Event()
+        while sdl2.SDL_PollEvent(ctypes.byref(event)) != 0:
+            if event.type == sdl2.SDL_QUIT:
+                raise InterpreterQuitException()
+            elif event.type == sdl2.SDL_WINDOWEVENT:
+                self._handle_windowevents(event)
+            elif event.type == sdl2.SDL_KEYDOWN:
+                key = SDL_CASIO_KEYMAP.get(event.key.keysym.sym, DEFAULT_CASIO_GETKEY)
+        return key
+
+    def delay(self):
+        sdl2.SDL_Delay(SDL_DELAY_MILLIS)
+
+    def set_title(self, name):
+        window_name = f'{name} - CASINT: CASIO Basic Interpreter'.encode()
+        sdl2.SDL_SetWindowTitle(self.window, window_name)
+
+    def close(self):
+        sdl2.SDL_DestroyTexture(self.texture)
+        sdl2.SDL_DestroyRenderer(self.renderer)
+        sdl2.SDL_DestroyWindow(self.window)
+        sdl2.SDL_Quit()
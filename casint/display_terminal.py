@@ -0,0 +1,182 @@
+"""
+A display frontend for ANSI terminals, for running without SDL (e.g. over
+SSH). The 128x64 screen is drawn as 64x16 Unicode braille cells, each
+holding 2x4 pixels. Only the cells that changed since the last frame are
+written.
+"""
+import os
+import sys
+import termios
+import time
+
+from .display import Display, InterpreterQuitException, DEFAULT_CASIO_GETKEY
+from .graphics import SCREEN_WIDTH, SCREEN_HEIGHT
+
+TERMINAL_DELAY_MILLIS = 16
+
+CELL_COLUMNS = SCREEN_WIDTH // 2
+CELL_ROWS = SCREEN_HEIGHT // 4
+BAND_PIXELS = SCREEN_WIDTH * 4
+
+# printed output goes below the cells
+PARK_CURSOR = f'\x1b[{CELL_ROWS + 1};1H'
+
+# a cell with no dots, which looks the same as a cleared terminal
+BRAILLE_BLANK = chr(0x2800)
+
+CTRL_C = b'\x03'
+ESC = b'\x1b'
+
+# the same keys as display_sdl.SDL_CASIO_KEYMAP, as the terminal sends them
+TERMINAL_CASIO_KEYMAP = {
+	b'\x1b[A'	: 28,
+	b'\x1bOA'	: 28,
+	b'\x1b[C'	: 27,
+	b'\x1bOC'	: 27,
+	b'\x1b[B'	: 37,
+	b'\x1bOB'	: 37,
+	b'\x1b[D'	: 38,
+	b'\x1bOD'	: 38,
+	b'\r'		: 31,
+	b'\n'		: 31,
+	b'0'		: 71,
+	b'1'		: 72,
+	b'2'		: 62,
+	b'3'		: 52,
+	b'4'		: 73,
+	b'5'		: 63,
+	b'6'		: 53,
+	b'7'		: 74,
+	b'8'		: 64,
+	b'9'		: 54,
+	b'.'		: 61,
+	b'\x1bOP'	: 79,
+	b'\x1b[11~'	: 79,
+	b'\x1bOQ'	: 69,
+	b'\x1b[12~'	: 69,
+	b'\x1bOR'	: 59,
+	b'\x1b[13~'	: 59,
+	b'\x1bOS'	: 49,
+	b'\x1b[14~'	: 49,
+	b'\x1b[15~'	: 39,
+	b'\x1b[17~'	: 29,
+	b'\x1b'		: 47,
+	# a terminal doesn't report Ctrl on its own
+	b'\t'		: 48
+}
+
+
+def braille_row(band):
+    """
+    Converts 4 rows of pixels to a row of braille characters.
+    Dots 1-3 and 7 are the left column, 4-6 and 8 the right.
+    """
+    r0 = band[0:SCREEN_WIDTH]
+    r1 = band[SCREEN_WIDTH:SCREEN_WIDTH * 2]
+    r2 = band[SCREEN_WIDTH * 2:SCREEN_WIDTH * 3]
+    r3 = band[SCREEN_WIDTH * 3:]
+    left = zip(r0[0::2], r1[0::2], r2[0::2], r3[0::2])
+    right = zip(r0[1::2], r1[1::2], r2[1::2], r3[1::2])
+    return ''.join(
+        chr(0x2800 | a | b << 1 | c << 2 | d << 6 | e << 3 | f << 4 | g << 5 | h << 7)
+        for (a, b, c, d), (e, f, g, h) in zip(left, right)
+    )
+
+
+def read_key_sequence(data, i):
+    """Returns the key sequence starting at i and the index after it."""
+    if data[i:i+1] != ESC or i + 1 == len(data):
+        return data[i:i+1], i + 1
+    j = i + 1
+    if data[j:j+1] == b'O':
+        # SS3: one more character
+        return data[i:j+2], j + 2
+    if data[j:j+1] == b'[':
+        # CSI: parameters up to a final byte
+        j += 1
+        while j < len(data) and not 0x40 <= data[j] <= 0x7e:
+            j += 1
+        return data[i:j+1], j + 1
+    # escape on its own, followed by another key
+    return ESC, j
+
+
+class TerminalDisplay(Display):
+    def __init__(self, fin=None, fout=None):
+        self.fin = fin or sys.stdin
+        self.fout = fout or sys.stdout
+        self.fd = self.fin.fileno()
+        if not os.isatty(self.fd):
+            raise Exception('The terminal display needs a terminal for input')
+
+        # unbuffered input without echo; Ctrl-C is read as a key
+        self.saved_attrs = termios.tcgetattr(self.fd)
+        attrs = termios.tcgetattr(self.fd)
+        attrs[3] &= ~(termios.ICANON | termios.ECHO | termios.ISIG)
+        attrs[6][termios.VMIN] = 0
+        attrs[6][termios.VTIME] = 0
+        termios.tcsetattr(self.fd, termios.TCSANOW, attrs)
+
+        self._write('\x1b[?25l')
+        self._reset()
+
+    def _write(self, s):
+        self.fout.flush()
+        self.fout.buffer.write(s.encode('utf-8'))
+        self.fout.buffer.flush()
+
+    def _reset(self):
+        # what's on the terminal: the pixels of each band, and its cells
+        self.bands = [None] * CELL_ROWS
+        self.cells = [BRAILLE_BLANK * CELL_COLUMNS] * CELL_ROWS
+        self._write('\x1b[2J' + PARK_CURSOR)
+
+    def present(self, screen):
+        pixels = screen.pixels
+        out = []
+        for row in range(CELL_ROWS):
+            start = row * BAND_PIXELS
+            band = bytes(pixels[start:start + BAND_PIXELS])
+            if band == self.bands[row]:
+                continue
+            self.bands[row] = band
+            cells = braille_row(band)
+            prev = self.cells[row]
+            # write each run of changed cells
+            col = 0
+            while col < CELL_COLUMNS:
+                if cells[col] == prev[col]:
+                    col += 1
+                    continue
+                end = col + 1
+                while end < CELL_COLUMNS and cells[end] != prev[end]:
+                    end += 1
+                out.append(f'\x1b[{row + 1};{col + 1}H{cells[col:end]}')
+                col = end
+            self.cells[row] = cells
+        if out:
+            out.append(PARK_CURSOR)
+            self._write(''.join(out))
+
+    def poll_key(self):
+        data = os.read(self.fd, 1024)
+        key = None
+        i = 0
+        while i < len(data):
+            sequence, i = read_key_sequence(data, i)
+            if sequence == CTRL_C:
+                raise InterpreterQuitException()
+            key = TERMINAL_CASIO_KEYMAP.get(sequence, DEFAULT_CASIO_GETKEY)
+        return key
+
+    def delay(self):
+        time.sleep(TERMINAL_DELAY_MILLIS / 1000)
+
+    def set_title(self, name):
+        self._write(f'\x1b]0;{name} - CASINT: CASIO Basic Interpreter\x07')
+        # a new program: redraw everything, over anything printed since
+        self._reset()
+
+    def close(self):
+        self._write(PARK_CURSOR + '\x1b[?25h')
+        termios.tcsetattr(self.fd, termios.TCSANOW, self.saved_attrs)
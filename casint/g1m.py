@@ -1,3 +1,5 @@
+import re
+
 from .common import *
 from .ast import *
 from .interpreter import (
@@ -6,408 +8,160 @@ from .interpreter import (
     LexerException,
     ParserException,
     Token,
-    is_variable,
-    is_numeric,
+    index_by_byte,
     parse_word_as_number
 )
 
 
+# single byte opcodes: byte -> (token type, value)
+G1M_OPCODES = {
+    b'\xd1':  (CLS, b'Cls'),
+    b'\xe8':  (DSZ, b'Dsz '),
+    b'\xe9':  (ISZ, b'Isz '),
+    b'\xeb':  (VIEWWINDOW, b'ViewWindow'),
+    b'\xec':  (GOTO, b'Goto '),
+    b'\xed':  (PROG, b'Prog'),
+    b'\xee':  (GRAPHYEQ, b'Graph Y='),
+    b'\xe2':  (LBL, b'Lbl '),
+    b'\x95':  (LOG, b'log '),
+    b'\xde':  (INTG, b'Intg '),
+    b'\xb6':  (FRAC, b'Frac '),
+    b'\xc1':  (RANDNUM, b'Ran# '),
+    b',':     (COMMA, b','),
+    b':':     (SEMI, b':'),
+    b'=':     (EQ, b'=='),
+    b'\x10':  (LTE, b'<='),
+    b'\x12':  (GTE, b'>='),
+    b'\x11':  (NEQ, b'!='),
+    b'\x3c':  (LT, b'<'),
+    b'\x3e':  (GT, b'>'),
+    b'\x13':  (INLINEIF, b'=>'),
+    b'\x0c':  (DISP, b'DISP'),
+    b'\x0d':  (SEMI, b'EOL'),
+    b'?':     (PROMPT, b'?'),
+    b'\x0e':  (ASSIGN, b'->'),
+    b'\x89':  (PLUS, b'+'),
+    b'\x99':  (MINUS, b'-'),
+    b'\x87':  (MINUS, b'-'),
+    b'\xa9':  (MUL, b'x'),
+    b'\xb9':  (DIV, b'/'),
+    b'\xa6':  (INTG, b'Int '),
+    b'\xa8':  (POWER, b'^'),
+    b'\x8b':  (SQUARED, b'^2'),
+    b'(':     (LPAREN, b'('),
+    b')':     (RPAREN, b')'),
+    b'{':     (LBRACE, b'{'),
+    b'}':     (RBRACE, b'}'),
+    b'[':     (LBRACKET, b'['),
+    b']':     (RBRACKET, b']'),
+    b'~':     (VARIABLERANGE, b'~')
+}
+
+# two byte opcodes, by their lead byte: second byte -> (token type, value)
+G1M_MULTIBYTE_OPCODES = {
+    b'\x7f': {
+        b'\x40': (MAT, b'Mat '),
+        b'\x46': (DIM, b'Dim '),
+        b'\x8f': (GETKEY, b'Getkey'),
+        b'\xb0': (AND, b' And '),
+        b'\xb1': (OR, b' Or ')
+    },
+    # none of the 0xe6 characters are supported yet
+    b'\xe6': {},
+    b'\xf7': {
+        b'\x00': (IF, b'If '),
+        b'\x01': (THEN, b'Then '),
+        b'\x02': (ELSE, b'Else'),
+        b'\x03': (IFEND, b'IfEnd'),
+        b'\x04': (FOR, b'For '),
+        b'\x05': (TO, b'To '),
+        b'\x06': (STEP, b'Step '),
+        b'\x07': (NEXT, b'Next'),
+        b'\x08': (WHILE, b'While '),
+        b'\x09': (WHILEEND, b'WhileEnd'),
+        b'\x0a': (DO, b'Do'),
+        b'\x0b': (LPWHILE, b'LpWhile '),
+        b'\x0c': (RETURN, b'Return'),
+        b'\x0d': (BREAK, b'Break'),
+        b'\x0e': (STOP, b'Stop'),
+        b'\x10': (LOCATE, b'Locate '),
+        b'\x18': (CLRTEXT, b'ClrText'),
+        b'\x93': (STOPICT, b'StoPict '),
+        b'\x94': (RCLPICT, b'RclPict '),
+        b'\xa3': (VERTICAL, b'Vertical '),
+        b'\xa4': (HORIZONTAL, b'Horizontal '),
+        b'\xa5': (TEXT, b'Text '),
+        b'\xa6': (CIRCLE, b'Circle '),
+        b'\xa7': (FLINE, b'F-Line '),
+        b'\xa8': (PLOTON, b'PlotOn '),
+        b'\xab': (PXLON, b'PxlOn '),
+        b'\xac': (PXLOFF, b'PxlOff '),
+        b'\xad': (PXLCHG, b'PxlChg '),
+        b'\xaf': (PXLTEST, b'PxlTest('),
+        b'\xd3': (COORDOFF, b'CoordOff'),
+        b'\x7a': (GRIDOFF, b'GridOff'),
+        b'\xd2': (AXESOFF, b'AxesOff'),
+        b'\xd4': (LABELOFF, b'LabelOff')
+    }
+}
+
+
+G1M_NUMBER = re.compile(rb'[0-9.]+')
+# a comment runs to the end of the statement
+G1M_COMMENT = re.compile(rb'[^:\r\x00]*')
+
+
 class G1mLexer(Lexer):
     def numeric(self):
-        """Return a (multidigit) integer consumed from the input."""
-        result = b''
-        while self.current_char is not None and is_numeric(self.current_char):
-            result += self.current_char
-            self.advance()
-        #print(f'numeric: {result}')
-        return parse_word_as_number(result)
+        """Return a (multidigit) number consumed from the input."""
+        return parse_word_as_number(self.match(G1M_NUMBER))
 
 
     def string(self):
-        result = b''
-        self.advance()
-        while self.current_char is not None and self.current_char != b'"':
-            result += self.current_char
-            self.advance()
-        self.advance()
-        #print(f'string lit: {result}')
-        return result
+        return self.quoted()
 
 
     def comment(self):
-        result = b''
-        while self.current_char is not None and self.current_char not in (b':', b'\x0d'):
-            result += self.current_char
-            self.advance()
-        return result
+        # NB: includes the leading quote
+        return self.match(G1M_COMMENT)
+
+
+    def variable(self):
+        token = Token(VARIABLE, self.text[self.pos:self.pos+1])
+        self.pos += 1
+        return token
 
 
     def get_next_token(self):
         """Lexical analyzer (also known as scanner or tokenizer)
         This method is responsible for breaking a sentence
         apart into tokens. One token at a time.
+        The lead byte of each token is looked up in G1M_LEAD_TABLE.
         """
-        while self.current_char is not None:
-            #print(f'{self.current_char}')
-
-            if self.current_char == b'\xd1':
-                self.advance()
-                return Token(CLS, b'Cls')
-
-            if self.current_char == b'\xe8':
-                self.advance()
-                return Token(DSZ, b'Dsz ')
-
-            if self.current_char == b'\xe9':
-                self.advance()
-                return Token(ISZ, b'Isz ')
-
-            if self.current_char == b'\xeb':
-                self.advance()
-                return Token(VIEWWINDOW, b'ViewWindow')
-
-            if self.current_char == b'\xec':
-                self.advance()
-                return Token(GOTO, b'Goto ')
-
-            if self.current_char == b'\xed':
-                self.advance()
-                return Token(PROG, b'Prog')
-
-            if self.current_char == b'\xee':
-                self.advance()
-                return Token(GRAPHYEQ, b'Graph Y=')
-
-            if self.current_char == b'\xe2':
-                self.advance()
-                return Token(LBL, b'Lbl ')
-
-            if self.current_char == b'\x95':
-                self.advance()
-                return Token(LOG, b'log ')
-
-            if self.current_char == b'\xde':
-                self.advance()
-                return Token(INTG, b'Intg ')
-
-            if self.current_char == b'\xb6':
-                self.advance()
-                return Token(FRAC, b'Frac ')
-
-            if self.current_char == b'\xc1':
-                self.advance()
-                return Token(RANDNUM, b'Ran# ')
-
-            if self.current_char == b'\x7f' and self.peek() == b'\x40':
-                self.advance()
-                self.advance()
-                return Token(MAT, b'Mat ')
-
-            if self.current_char == b'\x7f' and self.peek() == b'\x46':
-                self.advance()
-                self.advance()
-                return Token(DIM, b'Dim ')
-
-            if self.current_char == b'\x7f' and self.peek() == b'\x8f':
-                self.advance()
-                self.advance()
-                return Token(GETKEY, b'Getkey')
-
-            if self.current_char == b'\x7f' and self.peek() == b'\xb0':
-                self.advance()
-                self.advance()
-                return Token(AND, b' And ')
-
-            if self.current_char == b'\x7f' and self.peek() == b'\xb1':
-                self.advance()
-                self.advance()
-                return Token(OR, b' Or ')
-
-            if self.current_char == b'\xf7' and self.peek() == b'\x00':
-                self.advance()
-                self.advance()
-                return Token(IF, b'If ')
-
-            if self.current_char == b'\xf7' and self.peek() == b'\x01':
-                self.advance()
-                self.advance()
-                return Token(THEN, b'Then ')
-
-            if self.current_char == b'\xf7' and self.peek() == b'\x02':
-                self.advance()
-                self.advance()
-                return Token(ELSE, b'Else')
-
-            if self.current_char == b'\xf7' and self.peek() == b'\x03':
-                self.advance()
-                self.advance()
-                return Token(IFEND, b'IfEnd')
-
-            if self.current_char == b'\xf7' and self.peek() == b'\x04':
-                self.advance()
-                self.advance()
-                return Token(FOR, b'For ')
-
-            if self.current_char == b'\xf7' and self.peek() == b'\x05':
-                self.advance()
-                self.advance()
-                return Token(TO, b'To ')
-
-            if self.current_char == b'\xf7' and self.peek() == b'\x06':
-                self.advance()
-                self.advance()
-                return Token(STEP, b'Step ')
-
-            if self.current_char == b'\xf7' and self.peek() == b'\x07':
-                self.advance()
-                self.advance()
-                return Token(NEXT, b'Next')
-
-            if self.current_char == b'\xf7' and self.peek() == b'\x08':
-                self.advance()
-                self.advance()
-                return Token(WHILE, b'While ')
-
-            if self.current_char == b'\xf7' and self.peek() == b'\x09':
-                self.advance()
-                self.advance()
-                return Token(WHILEEND, b'WhileEnd')
-
-            if self.current_char == b'\xf7' and self.peek() == b'\x0a':
-                self.advance()
-                self.advance()
-                return Token(DO, b'Do')
-
-            if self.current_char == b'\xf7' and self.peek() == b'\x0b':
-                self.advance()
-                self.advance()
-                return Token(LPWHILE, b'LpWhile ')
-
-            if self.current_char == b'\xf7' and self.peek() == b'\x0c':
-                self.advance()
-                self.advance()
-                return Token(RETURN, b'Return')
-
-            if self.current_char == b'\xf7' and self.peek() == b'\x0d':
-                self.advance()
-                self.advance()
-                return Token(BREAK, b'Break')
-
-            if self.current_char == b'\xf7' and self.peek() == b'\x0e':
-                self.advance()
-                self.advance()
-                return Token(STOP, b'Stop')
-
-            if self.current_char == b'\xf7' and self.peek() == b'\x10':
-                self.advance()
-                self.advance()
-                return Token(LOCATE, b'Locate ')
-
-            if self.current_char == b'\xf7' and self.peek() == b'\x18':
-                self.advance()
-                self.advance()
-                return Token(CLRTEXT, b'ClrText')
-
-            if self.current_char == b'\xf7' and self.peek() == b'\x93':
-                self.advance()
-                self.advance()
-                return Token(STOPICT, b'StoPict ')
-
-            if self.current_char == b'\xf7' and self.peek() == b'\x94':
-                self.advance()
-                self.advance()
-                return Token(RCLPICT, b'RclPict ')
-
-            if self.current_char == b'\xf7' and self.peek() == b'\xa4':
-                self.advance()
-                self.advance()
-                return Token(HORIZONTAL, b'Horizontal ')
-
-            if self.current_char == b'\xf7' and self.peek() == b'\xa5':
-                self.advance()
-                self.advance()
-                return Token(TEXT, b'Text ')
-
-            if self.current_char == b'\xf7' and self.peek() == b'\xa6':
-                self.advance()
-                self.advance()
-                return Token(CIRCLE, b'Circle ')
-
-            if self.current_char == b'\xf7' and self.peek() == b'\xa7':
-                self.advance()
-                self.advance()
-                return Token(FLINE, b'F-Line ')
-
-            if self.current_char == b'\xf7' and self.peek() == b'\xa8':
-                self.advance()
-                self.advance()
-                return Token(PLOTON, b'PlotOn ')
-
-            if self.current_char == b'\xf7' and self.peek() == b'\xab':
-                self.advance()
-                self.advance()
-                return Token(PXLON, b'PxlOn ')
-
-            if self.current_char == b'\xf7' and self.peek() == b'\xac':
-                self.advance()
-                self.advance()
-                return Token(PXLOFF, b'PxlOff ')
-
-            if self.current_char == b'\xf7' and self.peek() == b'\xad':
-                self.advance()
-                self.advance()
-                return Token(PXLCHG, b'PxlChg ')
-
-            if self.current_char == b'\xf7' and self.peek() == b'\xaf':
-                self.advance()
-                self.advance()
-                return Token(PXLTEST, b'PxlTest(')
-
-            if self.current_char == b'\xf7' and self.peek() == b'\xd3':
-                self.advance()
-                self.advance()
-                return Token(COORDOFF, b'CoordOff')
-
-            if self.current_char == b'\xf7' and self.peek() == b'\x7a':
-                self.advance()
-                self.advance()
-                return Token(GRIDOFF, b'GridOff')
-
-            if self.current_char == b'\xf7' and self.peek() == b'\xd2':
-                self.advance()
-                self.advance()
-                return Token(AXESOFF, b'AxesOff')
-
-            if self.current_char == b'\xf7' and self.peek() == b'\xd4':
-                self.advance()
-                self.advance()
-                return Token(LABELOFF, b'LabelOff')
-
-            if self.current_char == b',':
-                self.advance()
-                return Token(COMMA, b',')
-
-            if self.current_char == b':':
-                self.advance()
-                return Token(SEMI, b':')
-
-            if self.current_char == b'=':
-                self.advance()
-                return Token(EQ, b'==')
-
-            if self.current_char == b'\x10':
-                self.advance()
-                return Token(LTE, b'<=')
-
-            if self.current_char == b'\x12':
-                self.advance()
-                return Token(GTE, b'>=')
-
-            if self.current_char == b'\x11':
-                self.advance()
-                return Token(NEQ, b'!=')
-
-            if self.current_char == b'\x3c':
-                self.advance()
-                return Token(LT, b'<')
-
-            if self.current_char == b'\x3e':
-                self.advance()
-                return Token(GT, b'>')
-
-            if self.current_char == b'\x13':
-                self.advance()
-                return Token(INLINEIF, b'=>')
-
-            if self.current_char == b'\x0c':
-                self.advance()
-                return Token(DISP, b'DISP')
-
-            if self.current_char == b'\x0d':
-                self.advance()
-                return Token(SEMI, b'EOL')
-
-            if self.current_char == b'?':
-                self.advance()
-                return Token(PROMPT, b'?')
-
-            if self.current_char == b'\x0e':
-                self.advance()
-                return Token(ASSIGN, b'->')
-
-            if is_variable(self.current_char):
-                token = Token(VARIABLE, self.current_char)
-                self.advance()
-                return token
-
-            if is_numeric(self.current_char):
-                return Token(NUMBER, self.numeric())
-
-            if self.current_char == b'"':
-                return Token(STRING, self.string())
-
-            if self.current_char == b'\'':
-                return Token(COMMENT, self.comment())
-
-            if self.current_char == b'\x89':
-                self.advance()
-                return Token(PLUS, b'+')
-
-            if self.current_char in (b'\x99', b'\x87'):
-                self.advance()
-                return Token(MINUS, b'-')
-
-            if self.current_char == b'\xa9':
-                self.advance()
-                return Token(MUL, b'x')
-
-            if self.current_char == b'\xb9':
-                self.advance()
-                return Token(DIV, b'/')
-
-            if self.current_char == b'\xa6':
-                self.advance()
-                return Token(INTG, b'Int ')
-
-            if self.current_char == b'\xa8':
-                self.advance()
-                return Token(POWER, b'^')
-
-            if self.current_char == b'\x8b':
-                self.advance()
-                return Token(SQUARED, b'^2')
-
-            if self.current_char == b'(':
-                self.advance()
-                return Token(LPAREN, b'(')
-
-            if self.current_char == b')':
-                self.advance()
-                return Token(RPAREN, b')')
-
-            if self.current_char == b'{':
-                self.advance()
-                return Token(LBRACE, b'{')
-
-            if self.current_char == b'}':
-                self.advance()
-                return Token(RBRACE, b'}')
-
-            if self.current_char == b'[':
-                self.advance()
-                return Token(LBRACKET, b'[')
-
-            if self.current_char == b']':
-                self.advance()
-                return Token(RBRACKET, b']')
-
-            if self.current_char == b'~':
-                self.advance()
-                return Token(VARIABLERANGE, b'~')
-
+        c = self.char()
+        if c is None:
+            return Token(EOF, None)
+
+        entry = G1M_LEAD_TABLE[c]
+
+        if type(entry) is tuple:
+            # single byte opcode
+            self.pos += 1
+            return Token(*entry)
+
+        if type(entry) is dict:
+            # two byte opcode
+            opcode = entry.get(self.peek())
+            if opcode is None:
+                self.error()
+            self.pos += 2
+            return Token(*opcode)
+
+        if entry is None:
             self.error()
 
-        return Token(EOF, None)
+        # variable, number, string or comment
+        return entry(self)
 
 
 class G1mParser(Parser):
@@ -509,49 +263,49 @@ class G1mParser(Parser):
     def stopict(self, token):
         self.eat(STOPICT)
         arg1 = self.num_limited(1, 20)
-        return UnaryBuiltin(token, b'StoPict', b'\xf7\x93', arg1)
+        return UnaryBuiltin(token, arg1)
 
 
     def rclpict(self, token):
         self.eat(RCLPICT)
         arg1 = self.num_limited(1, 20)
-        return UnaryBuiltin(token, b'RclPict', b'\xf7\x94', arg1)
+        return UnaryBuiltin(token, arg1)
 
 
     def prog(self, token):
         self.eat(PROG)
         arg1 = self.string_literal()
-        return UnaryBuiltin(token, b'Prog', b'\xed', arg1)
+        return UnaryBuiltin(token, arg1)
 
 
-    def nullary_builtin(self, token, ucb_name, g1m_name):
+    def nullary_builtin(self, token):
         self.eat(token.type)
-        return NullaryBuiltin(token, ucb_name, g1m_name)
+        return NullaryBuiltin(token)
 
 
-    def nullary_func(self, token, ucb_name, g1m_name):
+    def nullary_func(self, token):
         self.eat(token.type)
-        return NullaryFunc(token, ucb_name, g1m_name)
+        return NullaryFunc(token)
 
 
-    def unary_builtin(self, token, ucb_name, g1m_name, fn1):
+    def unary_builtin(self, token, fn1):
         self.eat(token.type)
         arg1 = fn1()
-        return UnaryBuiltin(token, ucb_name, g1m_name, arg1)
+        return UnaryBuiltin(token, arg1)
 
 
-    def unary_func(self, token, ucb_name, g1m_name):
+    def unary_func(self, token):
         self.eat(token.type)
         arg1 = self.expression(eager=False)
-        return UnaryFunc(token, ucb_name, g1m_name, arg1)
+        return UnaryFunc(token, arg1)
 
 
-    def binary_builtin(self, token, ucb_name, g1m_name):
+    def binary_builtin(self, token):
         self.eat(token.type)
         arg1 = self.expression()
         self.eat(COMMA)
         arg2 = self.expression()
-        return BinaryBuiltin(token, ucb_name, g1m_name, arg1, arg2)
+        return BinaryBuiltin(token, arg1, arg2)
 
 
     def pxltest(self, token):
@@ -560,7 +314,7 @@ class G1mParser(Parser):
         self.eat(COMMA)
         arg2 = self.expression()
         self.eat(RPAREN)
-        return BinaryFunc(token, b'PxlTest', b'\xf7\xaf', arg1, arg2)
+        return BinaryFunc(token, arg1, arg2)
 
 
     def text(self, token):
@@ -574,7 +328,7 @@ class G1mParser(Parser):
             arg3 = self.string_literal()
         else:
             arg3 = self.expression()
-        return TernaryBuiltin(token, b'Text', b'\xf7\xa5', arg1, arg2, arg3)
+        return TernaryBuiltin(token, arg1, arg2, arg3)
 
 
     def locate(self, token):
@@ -588,10 +342,20 @@ class G1mParser(Parser):
             arg3 = self.string_literal()
         else:
             arg3 = self.expression()
-        return TernaryBuiltin(token, b'Locate', b'\xf7\x10', arg1, arg2, arg3)
+        return TernaryBuiltin(token, arg1, arg2, arg3)
 
 
-    def quaternary_builtin(self, token, ucb_name, g1m_name):
+    def ternary_builtin(self, token):
+        self.eat(token.type)
+        arg1 = self.expression()
+        self.eat(COMMA)
+        arg2 = self.expression()
+        self.eat(COMMA)
+        arg3 = self.expression()
+        return TernaryBuiltin(token, arg1, arg2, arg3)
+
+
+    def quaternary_builtin(self, token):
         self.eat(token.type)
         arg1 = self.expression()
         self.eat(COMMA)
@@ -600,10 +364,10 @@ class G1mParser(Parser):
         arg3 = self.expression()
         self.eat(COMMA)
         arg4 = self.expression()
-        return QuaternaryBuiltin(token, ucb_name, g1m_name, arg1, arg2, arg3, arg4)
+        return QuaternaryBuiltin(token, arg1, arg2, arg3, arg4)
 
 
-    def senary_builtin(self, token, ucb_name, g1m_name):
+    def senary_builtin(self, token):
         self.eat(token.type)
         arg1 = self.expression()
         self.eat(COMMA)
@@ -616,11 +380,13 @@ class G1mParser(Parser):
         arg5 = self.expression()
         self.eat(COMMA)
         arg6 = self.expression()
-        return SenaryBuiltin(token, ucb_name, g1m_name, arg1, arg2, arg3, arg4, arg5, arg6)
+        return SenaryBuiltin(token, arg1, arg2, arg3, arg4, arg5, arg6)
 
 
-    def assignment_statement(self):
-        expr = self.expression()
+    def assignment(self, first, expr):
+        # expr -> var
+        if self.current_token.type != ASSIGN:
+            return None
         self.eat(ASSIGN)
         var = self.variable_or_mat_set()
         node = Assign(expr, var)
@@ -638,3 +404,23 @@ class G1mParser(Parser):
         right = self.memory_structure()
         node = Initialize((x, y), right)
         return node
+
+
+def _build_lead_table():
+    table = [None] * 256
+    for c in ALPHA_MEM_CHARS:
+        table[c] = G1mLexer.variable
+    for c in b'0123456789.':
+        table[c] = lambda lexer: Token(NUMBER, lexer.numeric())
+    table[ord('"')] = lambda lexer: Token(STRING, lexer.string())
+    table[ord('\'')] = lambda lexer: Token(COMMENT, lexer.comment())
+    for c, opcode in index_by_byte(G1M_OPCODES).items():
+        table[c] = opcode
+    for c, opcodes in index_by_byte(G1M_MULTIBYTE_OPCODES).items():
+        table[c] = index_by_byte(opcodes)
+    return table
+
+
+# what to do for each lead byte: a single byte opcode, a table of
+# second bytes, a function that lexes the token, or None for an error
+G1M_LEAD_TABLE = _build_lead_table()
@@ -1,279 +1,367 @@
-import ctypes
-import sdl2
+"""
+Software rendering of the 128x64 monochrome screen.
 
+Everything is drawn into a `Screen`, a bytearray with one byte per pixel
+(1 = dark). A display frontend (see `display`) only has to present a
+finished screen, so drawing doesn't depend on SDL.
+"""
+import struct
+from os.path import join as path_join, dirname
 
-def setpixel(renderer, x, y):
-	sdl2.SDL_RenderDrawPoint(renderer, x, y)
+SCREEN_WIDTH = 128
+SCREEN_HEIGHT = 64
+SCREEN_PIXELS = SCREEN_WIDTH * SCREEN_HEIGHT
+FRAME_BYTES = SCREEN_PIXELS // 8
 
-def pxltest(renderer, x, y):
-    """
-    Checks the pixel at (x, y).
-    Returns True if it is dark (#101010), else False.
-    NB: this is an expensive method to call. Would be good to cache if possible
-    """
-    # define a rectangle around the pixel
-    pxl = sdl2.SDL_Rect(x, y, 1, 1)
-    # create a pointer to where SDL will store the pixel data
-    p = ctypes.c_void_p()
-    # get the pixel
-    sdl2.SDL_RenderReadPixels(renderer, pxl, sdl2.SDL_PIXELFORMAT_RGBA8888, ctypes.byref(p), 512)
-    p_bytes = ctypes.cast(p, ctypes.POINTER(ctypes.c_uint8 * 4))
-    m = memoryview(p_bytes).cast('B')
-    return m[1:4] == b'\x10\x10\x10'
-
-def fline(renderer, x0, y0, x1, y1):
+# the light background colour of the font bitmaps, as stored (BGR)
+BMP_COLOR_OFF = b'\xee\xe8\xe8'
+
+# pixels to '0'/'1' digits and back, for packing frames
+PIXELS_TO_DIGITS = bytes.maketrans(b'\x00\x01', b'01')
+DIGITS_TO_PIXELS = bytes.maketrans(b'01', b'\x00\x01')
+
+BLANK_ROW = bytes(SCREEN_WIDTH)
+FILLED_ROW = b'\x01' * SCREEN_WIDTH
+
+
+class Screen():
+    def __init__(self):
+        self.pixels = bytearray(SCREEN_PIXELS)
+
+    def clear(self):
+        self.pixels[:] = bytes(SCREEN_PIXELS)
+
+    def copy_from(self, other):
+        self.pixels[:] = other.pixels
+
+    def set_pixel(self, x, y, is_on):
+        if 0 <= x < SCREEN_WIDTH and 0 <= y < SCREEN_HEIGHT:
+            self.pixels[y * SCREEN_WIDTH + x] = 1 if is_on else 0
+
+    def test_pixel(self, x, y):
+        """Returns True if the pixel at (x, y) is dark."""
+        if 0 <= x < SCREEN_WIDTH and 0 <= y < SCREEN_HEIGHT:
+            return self.pixels[y * SCREEN_WIDTH + x] == 1
+        return False
+
+    def fill_spans(self, spans, is_on=True):
+        """
+        Fills a list of (x, y, w, h) spans (see `raster`). The spans are
+        expected to be on the screen already.
+        """
+        row = FILLED_ROW if is_on else BLANK_ROW
+        pixels = self.pixels
+        for x, y, w, h in spans:
+            i = y * SCREEN_WIDTH + x
+            for _ in range(h):
+                pixels[i:i + w] = row[:w]
+                i += SCREEN_WIDTH
+
+    def fill(self, x0, y0, x1, y1, is_on=True):
+        """Fills the rectangle from (x0, y0) up to, but excluding, (x1, y1)."""
+        x0 = max(x0, 0)
+        y0 = max(y0, 0)
+        x1 = min(x1, SCREEN_WIDTH)
+        y1 = min(y1, SCREEN_HEIGHT)
+        if x0 < x1 and y0 < y1:
+            self.fill_spans([(x0, y0, x1 - x0, y1 - y0)], is_on)
+
+    def blit(self, bitmap, pitch, src, x, y):
+        """
+        Copies the (x, y, w, h) rectangle `src` of a bitmap to (x, y),
+        clipped to the screen.
+        """
+        sx, sy, w, h = src
+        if x < 0:
+            sx -= x
+            w += x
+            x = 0
+        if y < 0:
+            sy -= y
+            h += y
+            y = 0
+        w = min(w, SCREEN_WIDTH - x)
+        h = min(h, SCREEN_HEIGHT - y)
+        if w <= 0 or h <= 0:
+            return
+        pixels = self.pixels
+        s = sy * pitch + sx
+        d = y * SCREEN_WIDTH + x
+        for _ in range(h):
+            pixels[d:d + w] = bitmap[s:s + w]
+            s += pitch
+            d += SCREEN_WIDTH
+
+    def scroll_up(self, rows):
+        """Moves the screen up by `rows`, clearing the rows left at the bottom."""
+        n = rows * SCREEN_WIDTH
+        self.pixels[:SCREEN_PIXELS - n] = self.pixels[n:]
+        self.pixels[SCREEN_PIXELS - n:] = bytes(n)
+
+    def frame(self):
+        """
+        Returns the screen as a 1-bit frame: 8 pixels per byte, most
+        significant bit first, 1 = dark.
+        """
+        digits = self.pixels.translate(PIXELS_TO_DIGITS)
+        return int(digits, 2).to_bytes(FRAME_BYTES, 'big')
+
+    def load_frame(self, frame):
+        digits = format(int.from_bytes(frame[:FRAME_BYTES], 'big'), f'0{SCREEN_PIXELS}b')
+        self.pixels[:] = digits.encode('ascii').translate(DIGITS_TO_PIXELS)
+
+
+class Font():
+    def __init__(self, bitmap, pitch, rects, default):
+        self.bitmap = bitmap
+        self.pitch = pitch
+        self.rects = rects
+        self.default = default
+
+    def inverted(self):
+        bitmap = bytes(1 - p for p in self.bitmap)
+        return Font(bitmap, self.pitch, self.rects, self.default)
+
+
+def load_bitmap(filename):
     """
-    Modified Bresenham's line algorithm.
-    Renders points to form a line between two positions.
+    Reads a 24-bit BMP next to this module as one byte per pixel.
+    Returns (width, bitmap).
     """
-    dx = abs(x1 - x0)
-    dy = abs(y1 - y0)
-
-    c = 0
-    points = (sdl2.SDL_Point * 128)()
-
-    x, y = x0, y0
-    sx = -1 if x0 > x1 else 1
-    sy = -1 if y0 > y1 else 1
-    if dx > dy:
-        err = dx / 2.0
-        while x != x1:
-            points[c] = sdl2.SDL_Point(x, y)
-            c += 1
-            err -= dy
-            if err <= 0:
-                y += sy
-                err += dx
-            x += sx
-    else:
-        err = dy / 2.0
-        while y != y1:
-            points[c] = sdl2.SDL_Point(x, y)
-            c += 1
-            err -= dx
-            if err <= 0:
-                x += sx
-                err += dy
-            y += sy
-    points[c] = sdl2.SDL_Point(x, y)
-    c += 1
-    ptr = ctypes.cast(points, ctypes.POINTER(sdl2.SDL_Point))
-    sdl2.SDL_RenderDrawPoints(renderer, ptr, c)
-
-def fill(renderer, x0, y0, x1, y1):
-    rect = sdl2.SDL_Rect(x0, y0, x1-x0, y1-y0)
-    sdl2.SDL_RenderFillRect(renderer, rect)
+    with open(path_join(dirname(__file__), filename), 'rb') as fp:
+        data = fp.read()
+    offset, = struct.unpack_from('<I', data, 10)
+    width, height, planes, bpp = struct.unpack_from('<iiHH', data, 18)
+    if bpp != 24:
+        raise Exception(f'Unknown bitmap format: {filename} ({bpp} bpp)')
+    stride = (width * 3 + 3) & ~3
+    bitmap = bytearray(width * abs(height))
+    for y in range(abs(height)):
+        # rows are stored bottom up, unless the height is negative
+        src_y = height - 1 - y if height > 0 else y
+        row = data[offset + src_y * stride:offset + src_y * stride + width * 3]
+        for x in range(width):
+            if row[x * 3:x * 3 + 3] != BMP_COLOR_OFF:
+                bitmap[y * width + x] = 1
+    return width, bytes(bitmap)
+
+
+def load_font(filename, rects, default):
+    width, bitmap = load_bitmap(filename)
+    return Font(bitmap, width, rects, default)
+
+
+def read_char(message, i):
+    """Returns the character at i and the index after it."""
+    c = message[i:i+1]
+    if c in (b'\x7f', b'\xe6', b'\xf7'):
+        i += 1
+        c += message[i:i+1]
+    return c, i + 1
+
 
 GRAPH_RECTS = {
-    b'A':        sdl2.SDL_Rect(0,  0,  4,  6),
-    b'B':        sdl2.SDL_Rect(6,  0,  4,  6),
-    b'C':        sdl2.SDL_Rect(12, 0,  4,  6),
-    b'D':        sdl2.SDL_Rect(18, 0,  4,  6),
-    b'E':        sdl2.SDL_Rect(24, 0,  4,  6),
-    b'F':        sdl2.SDL_Rect(30, 0,  4,  6),
-    b'G':        sdl2.SDL_Rect(36, 0,  4,  6),
-    b'H':        sdl2.SDL_Rect(42, 0,  4,  6),
-    b'I':        sdl2.SDL_Rect(48, 0,  4,  6),
-    b'J':        sdl2.SDL_Rect(54, 0,  4,  6),
-    b'K':        sdl2.SDL_Rect(60, 0,  6,  6),
-    b'L':        sdl2.SDL_Rect(66, 0,  4,  6),
-    b'M':        sdl2.SDL_Rect(72, 0,  6,  6),
-    b'N':        sdl2.SDL_Rect(78, 0,  6,  6),
-    b'O':        sdl2.SDL_Rect(84, 0,  4,  6),
-    b'P':        sdl2.SDL_Rect(90, 0,  4,  6),
-    b'Q':        sdl2.SDL_Rect(0,  6,  6,  6),
-    b'R':        sdl2.SDL_Rect(6,  6,  4,  6),
-    b'S':        sdl2.SDL_Rect(12, 6,  4,  6),
-    b'T':        sdl2.SDL_Rect(18, 6,  4,  6),
-    b'U':        sdl2.SDL_Rect(24, 6,  4,  6),
-    b'V':        sdl2.SDL_Rect(30, 6,  4,  6),
-    b'W':        sdl2.SDL_Rect(36, 6,  6,  6),
-    b'X':        sdl2.SDL_Rect(42, 6,  4,  6),
-    b'Y':        sdl2.SDL_Rect(48, 6,  4,  6),
-    b'Z':        sdl2.SDL_Rect(54, 6,  4,  6),
-    b' ':        sdl2.SDL_Rect(60, 6,  4,  6),
-    b'a':        sdl2.SDL_Rect(0,  24, 4,  6),
-    b'b':        sdl2.SDL_Rect(6,  24, 4,  6),
-    b'c':        sdl2.SDL_Rect(12, 24, 4,  6),
-    b'd':        sdl2.SDL_Rect(18, 24, 4,  6),
-    b'e':        sdl2.SDL_Rect(24, 24, 4,  6),
-    b'f':        sdl2.SDL_Rect(30, 24, 4,  6),
-    b'g':        sdl2.SDL_Rect(36, 24, 4,  6),
-    b'h':        sdl2.SDL_Rect(42, 24, 4,  6),
-    b'i':        sdl2.SDL_Rect(48, 24, 2,  6),
-    b'j':        sdl2.SDL_Rect(54, 24, 4,  6),
-    b'k':        sdl2.SDL_Rect(60, 24, 6,  6),
-    b'l':        sdl2.SDL_Rect(66, 24, 4,  6),
-    b'm':        sdl2.SDL_Rect(72, 24, 6,  6),
-    b'n':        sdl2.SDL_Rect(78, 24, 5,  6),
-    b'o':        sdl2.SDL_Rect(84, 24, 4,  6),
-    b'p':        sdl2.SDL_Rect(90, 24, 4,  6),
-    b'q':        sdl2.SDL_Rect(0,  30, 6,  6),
-    b'r':        sdl2.SDL_Rect(6,  30, 5,  6),
-    b's':        sdl2.SDL_Rect(12, 30, 4,  6),
-    b't':        sdl2.SDL_Rect(18, 30, 4,  6),
-    b'u':        sdl2.SDL_Rect(24, 30, 4,  6),
-    b'v':        sdl2.SDL_Rect(30, 30, 4,  6),
-    b'w':        sdl2.SDL_Rect(36, 30, 6,  6),
-    b'x':        sdl2.SDL_Rect(42, 30, 4,  6),
-    b'y':        sdl2.SDL_Rect(48, 30, 4,  6),
-    b'z':        sdl2.SDL_Rect(54, 30, 4,  6),
-    b'0':        sdl2.SDL_Rect(0,  12, 4,  6),
-    b'1':        sdl2.SDL_Rect(6,  12, 4,  6),
-    b'2':        sdl2.SDL_Rect(12, 12, 4,  6),
-    b'3':        sdl2.SDL_Rect(18, 12, 4,  6),
-    b'4':        sdl2.SDL_Rect(24, 12, 4,  6),
-    b'5':        sdl2.SDL_Rect(30, 12, 4,  6),
-    b'6':        sdl2.SDL_Rect(36, 12, 4,  6),
-    b'7':        sdl2.SDL_Rect(42, 12, 4,  6),
-    b'8':        sdl2.SDL_Rect(48, 12, 4,  6),
-    b'9':        sdl2.SDL_Rect(54, 12, 4,  6),
-    b'.':        sdl2.SDL_Rect(60, 12, 4,  6),
-    b':':        sdl2.SDL_Rect(66, 18, 3,  6),
-    b'\'':       sdl2.SDL_Rect(90, 18, 3,  6),
-    b'<':        sdl2.SDL_Rect(78, 18, 4,  6),
-    b'>':        sdl2.SDL_Rect(84, 18, 4,  6),
-    b'(':        sdl2.SDL_Rect(0,  18, 3,  6),
-    b')':        sdl2.SDL_Rect(6,  18, 3,  6),
-    b'[':        sdl2.SDL_Rect(24, 18, 3,  6),
-    b']':        sdl2.SDL_Rect(30, 18, 3,  6),
-    b'/':        sdl2.SDL_Rect(60, 30, 4,  6),
-    b'=':        sdl2.SDL_Rect(72, 30, 4,  6),
-    b'?':        sdl2.SDL_Rect(84, 30, 4,  6),
-    b',':        sdl2.SDL_Rect(48, 18, 3,  6),
-    b'*':        sdl2.SDL_Rect(66, 30, 6,  6),
-    b'#':        sdl2.SDL_Rect(90, 30, 6,  6),
-    b'-':        sdl2.SDL_Rect(84, 12, 4,  6),
-    b'\x89':     sdl2.SDL_Rect(72, 12, 4,  6),    # +
-    b'\x99':     sdl2.SDL_Rect(84, 12, 4,  6),    # -
-    b'\xb9':     sdl2.SDL_Rect(78, 12, 4,  6),    # /
-    b'\x0e':     sdl2.SDL_Rect(42, 18, 6,  6),    # ->
-    b'\x99':     sdl2.SDL_Rect(84, 12, 4,  6),    # -
-    b'\xab':     sdl2.SDL_Rect(72, 18, 2,  6),    # !
-    b'\xa8':     sdl2.SDL_Rect(36, 18, 4,  6),    # ^
-    b'\xa9':     sdl2.SDL_Rect(66, 12, 4,  6),    # x (aka *)
-    b'\xe6\x90': sdl2.SDL_Rect(90, 6,  6,  6),    # <-
-    b'\x7f\x40': sdl2.SDL_Rect(0,  36, 18, 6)     # Mat
+    b'A':        (0,  0,  4,  6),
+    b'B':        (6,  0,  4,  6),
+    b'C':        (12, 0,  4,  6),
+    b'D':        (18, 0,  4,  6),
+    b'E':        (24, 0,  4,  6),
+    b'F':        (30, 0,  4,  6),
+    b'G':        (36, 0,  4,  6),
+    b'H':        (42, 0,  4,  6),
+    b'I':        (48, 0,  4,  6),
+    b'J':        (54, 0,  4,  6),
+    b'K':        (60, 0,  6,  6),
+    b'L':        (66, 0,  4,  6),
+    b'M':        (72, 0,  6,  6),
+    b'N':        (78, 0,  6,  6),
+    b'O':        (84, 0,  4,  6),
+    b'P':        (90, 0,  4,  6),
+    b'Q':        (0,  6,  6,  6),
+    b'R':        (6,  6,  4,  6),
+    b'S':        (12, 6,  4,  6),
+    b'T':        (18, 6,  4,  6),
+    b'U':        (24, 6,  4,  6),
+    b'V':        (30, 6,  4,  6),
+    b'W':        (36, 6,  6,  6),
+    b'X':        (42, 6,  4,  6),
+    b'Y':        (48, 6,  4,  6),
+    b'Z':        (54, 6,  4,  6),
+    b' ':        (60, 6,  4,  6),
+    b'a':        (0,  24, 4,  6),
+    b'b':        (6,  24, 4,  6),
+    b'c':        (12, 24, 4,  6),
+    b'd':        (18, 24, 4,  6),
+    b'e':        (24, 24, 4,  6),
+    b'f':        (30, 24, 4,  6),
+    b'g':        (36, 24, 4,  6),
+    b'h':        (42, 24, 4,  6),
+    b'i':        (48, 24, 2,  6),
+    b'j':        (54, 24, 4,  6),
+    b'k':        (60, 24, 6,  6),
+    b'l':        (66, 24, 4,  6),
+    b'm':        (72, 24, 6,  6),
+    b'n':        (78, 24, 5,  6),
+    b'o':        (84, 24, 4,  6),
+    b'p':        (90, 24, 4,  6),
+    b'q':        (0,  30, 6,  6),
+    b'r':        (6,  30, 5,  6),
+    b's':        (12, 30, 4,  6),
+    b't':        (18, 30, 4,  6),
+    b'u':        (24, 30, 4,  6),
+    b'v':        (30, 30, 4,  6),
+    b'w':        (36, 30, 6,  6),
+    b'x':        (42, 30, 4,  6),
+    b'y':        (48, 30, 4,  6),
+    b'z':        (54, 30, 4,  6),
+    b'0':        (0,  12, 4,  6),
+    b'1':        (6,  12, 4,  6),
+    b'2':        (12, 12, 4,  6),
+    b'3':        (18, 12, 4,  6),
+    b'4':        (24, 12, 4,  6),
+    b'5':        (30, 12, 4,  6),
+    b'6':        (36, 12, 4,  6),
+    b'7':        (42, 12, 4,  6),
+    b'8':        (48, 12, 4,  6),
+    b'9':        (54, 12, 4,  6),
+    b'.':        (60, 12, 4,  6),
+    b':':        (66, 18, 3,  6),
+    b'\'':       (90, 18, 3,  6),
+    b'<':        (78, 18, 4,  6),
+    b'>':        (84, 18, 4,  6),
+    b'(':        (0,  18, 3,  6),
+    b')':        (6,  18, 3,  6),
+    b'[':        (24, 18, 3,  6),
+    b']':        (30, 18, 3,  6),
+    b'/':        (60, 30, 4,  6),
+    b'=':        (72, 30, 4,  6),
+    b'?':        (84, 30, 4,  6),
+    b',':        (48, 18, 3,  6),
+    b'*':        (66, 30, 6,  6),
+    b'#':        (90, 30, 6,  6),
+    b'-':        (84, 12, 4,  6),
+    b'\x89':     (72, 12, 4,  6),    # +
+    b'\x99':     (84, 12, 4,  6),    # -
+    b'\xb9':     (78, 12, 4,  6),    # /
+    b'\x0e':     (42, 18, 6,  6),    # ->
+    b'\x99':     (84, 12, 4,  6),    # -
+    b'\xab':     (72, 18, 2,  6),    # !
+    b'\xa8':     (36, 18, 4,  6),    # ^
+    b'\xa9':     (66, 12, 4,  6),    # x (aka *)
+    b'\xe6\x90': (90, 6,  6,  6),    # <-
+    b'\x7f\x40': (0,  36, 18, 6)     # Mat
 }
 
 GRAPH_RECT_DEFAULT = GRAPH_RECTS[b' ']
 
-def text(renderer, texture, x, y, message):
+
+def text(screen, font, x, y, message):
     i = 0
     while i < len(message):
-        c = message[i:i+1]
-        if c in (b'\x7f', b'\xe6', b'\xf7'):
-            i += 1
-            c += message[i:i+1]
-        src = GRAPH_RECTS.get(c, GRAPH_RECT_DEFAULT)
-        dst = sdl2.SDL_Rect(x, y, src.w, src.h)
-        sdl2.SDL_RenderCopy(renderer, texture, src, dst)
-        x += src.w
-        i += 1
+        c, i = read_char(message, i)
+        src = font.rects.get(c, font.default)
+        screen.blit(font.bitmap, font.pitch, src, x, y)
+        x += src[2]
 
 TEXT_RECTS = {
-    b'A':        sdl2.SDL_Rect(0,  0,  6,  8),
-    b'B':        sdl2.SDL_Rect(6,  0,  6,  8),
-    b'C':        sdl2.SDL_Rect(12, 0,  6,  8),
-    b'D':        sdl2.SDL_Rect(18, 0,  6,  8),
-    b'E':        sdl2.SDL_Rect(24, 0,  6,  8),
-    b'F':        sdl2.SDL_Rect(30, 0,  6,  8),
-    b'G':        sdl2.SDL_Rect(36, 0,  6,  8),
-    b'H':        sdl2.SDL_Rect(42, 0,  6,  8),
-    b'I':        sdl2.SDL_Rect(48, 0,  6,  8),
-    b'J':        sdl2.SDL_Rect(54, 0,  6,  8),
-    b'K':        sdl2.SDL_Rect(60, 0,  6,  8),
-    b'L':        sdl2.SDL_Rect(66, 0,  6,  8),
-    b'M':        sdl2.SDL_Rect(72, 0,  6,  8),
-    b'N':        sdl2.SDL_Rect(78, 0,  6,  8),
-    b'O':        sdl2.SDL_Rect(84, 0,  6,  8),
-    b'P':        sdl2.SDL_Rect(90, 0,  6,  8),
-    b'Q':        sdl2.SDL_Rect(0,  8,  6,  8),
-    b'R':        sdl2.SDL_Rect(6,  8,  6,  8),
-    b'S':        sdl2.SDL_Rect(12, 8,  6,  8),
-    b'T':        sdl2.SDL_Rect(18, 8,  6,  8),
-    b'U':        sdl2.SDL_Rect(24, 8,  6,  8),
-    b'V':        sdl2.SDL_Rect(30, 8,  6,  8),
-    b'W':        sdl2.SDL_Rect(36, 8,  6,  8),
-    b'X':        sdl2.SDL_Rect(42, 8,  6,  8),
-    b'Y':        sdl2.SDL_Rect(48, 8,  6,  8),
-    b'Z':        sdl2.SDL_Rect(54, 8,  6,  8),
-    b' ':        sdl2.SDL_Rect(60, 8,  6,  8),
-    b'a':        sdl2.SDL_Rect(0,  32, 6,  8),
-    b'b':        sdl2.SDL_Rect(6,  32, 6,  8),
-    b'c':        sdl2.SDL_Rect(12, 32, 6,  8),
-    b'd':        sdl2.SDL_Rect(18, 32, 6,  8),
-    b'e':        sdl2.SDL_Rect(24, 32, 6,  8),
-    b'f':        sdl2.SDL_Rect(30, 32, 6,  8),
-    b'g':        sdl2.SDL_Rect(36, 32, 6,  8),
-    b'h':        sdl2.SDL_Rect(42, 32, 6,  8),
-    b'i':        sdl2.SDL_Rect(48, 32, 6,  8),
-    b'j':        sdl2.SDL_Rect(54, 32, 6,  8),
-    b'k':        sdl2.SDL_Rect(60, 32, 6,  8),
-    b'l':        sdl2.SDL_Rect(66, 32, 6,  8),
-    b'm':        sdl2.SDL_Rect(72, 32, 6,  8),
-    b'n':        sdl2.SDL_Rect(78, 32, 6,  8),
-    b'o':        sdl2.SDL_Rect(84, 32, 6,  8),
-    b'p':        sdl2.SDL_Rect(90, 32, 6,  8),
-    b'q':        sdl2.SDL_Rect(0,  40, 6,  8),
-    b'r':        sdl2.SDL_Rect(6,  40, 6,  8),
-    b's':        sdl2.SDL_Rect(12, 40, 6,  8),
-    b't':        sdl2.SDL_Rect(18, 40, 6,  8),
-    b'u':        sdl2.SDL_Rect(24, 40, 6,  8),
-    b'v':        sdl2.SDL_Rect(30, 40, 6,  8),
-    b'w':        sdl2.SDL_Rect(36, 40, 6,  8),
-    b'x':        sdl2.SDL_Rect(42, 40, 6,  8),
-    b'y':        sdl2.SDL_Rect(48, 40, 6,  8),
-    b'z':        sdl2.SDL_Rect(54, 40, 6,  8),
-    b'0':        sdl2.SDL_Rect(0,  16, 6,  8),
-    b'1':        sdl2.SDL_Rect(6,  16, 6,  8),
-    b'2':        sdl2.SDL_Rect(12, 16, 6,  8),
-    b'3':        sdl2.SDL_Rect(18, 16, 6,  8),
-    b'4':        sdl2.SDL_Rect(24, 16, 6,  8),
-    b'5':        sdl2.SDL_Rect(30, 16, 6,  8),
-    b'6':        sdl2.SDL_Rect(36, 16, 6,  8),
-    b'7':        sdl2.SDL_Rect(42, 16, 6,  8),
-    b'8':        sdl2.SDL_Rect(48, 16, 6,  8),
-    b'9':        sdl2.SDL_Rect(54, 16, 6,  8),
-    b'.':        sdl2.SDL_Rect(60, 16, 6,  8),
-    b':':        sdl2.SDL_Rect(66, 24, 6,  8),
-    b'\'':       sdl2.SDL_Rect(90, 24, 6,  8),
-    b'<':        sdl2.SDL_Rect(78, 24, 6,  8),
-    b'>':        sdl2.SDL_Rect(84, 24, 6,  8),
-    b'(':        sdl2.SDL_Rect(0,  24, 6,  8),
-    b')':        sdl2.SDL_Rect(6,  24, 6,  8),
-    b'[':        sdl2.SDL_Rect(24, 24, 6,  8),
-    b']':        sdl2.SDL_Rect(30, 24, 6,  8),
-    b'/':        sdl2.SDL_Rect(60, 40, 6,  8),
-    b'=':        sdl2.SDL_Rect(72, 40, 6,  8),
-    b'?':        sdl2.SDL_Rect(84, 40, 6,  8),
-    b',':        sdl2.SDL_Rect(48, 24, 6,  8),
-    b'*':        sdl2.SDL_Rect(66, 40, 6,  8),
-    b'#':        sdl2.SDL_Rect(90, 40, 6,  8),
-    b'-':        sdl2.SDL_Rect(84, 16, 6,  8),
-    b'\x89':     sdl2.SDL_Rect(72, 16, 6,  8),    # +
-    b'\x99':     sdl2.SDL_Rect(84, 16, 6,  8),    # -
-    b'\xb9':     sdl2.SDL_Rect(78, 16, 6,  8),    # /
-    b'\x0e':     sdl2.SDL_Rect(42, 24, 6,  8),    # ->
-    b'\x99':     sdl2.SDL_Rect(84, 16, 6,  8),    # -
-    b'\xab':     sdl2.SDL_Rect(72, 24, 6,  8),    # !
-    b'\xa8':     sdl2.SDL_Rect(36, 24, 6,  8),    # ^
-    b'\xa9':     sdl2.SDL_Rect(66, 16, 6,  8),    # x (aka *)
-    b'\xe6\x90': sdl2.SDL_Rect(90, 8,  6,  8),    # <-
-    b'\x7f\x40': sdl2.SDL_Rect(0,  48, 24, 8)     # Mat
+    b'A':        (0,  0,  6,  8),
+    b'B':        (6,  0,  6,  8),
+    b'C':        (12, 0,  6,  8),
+    b'D':        (18, 0,  6,  8),
+    b'E':        (24, 0,  6,  8),
+    b'F':        (30, 0,  6,  8),
+    b'G':        (36, 0,  6,  8),
+    b'H':        (42, 0,  6,  8),
+    b'I':        (48, 0,  6,  8),
+    b'J':        (54, 0,  6,  8),
+    b'K':        (60, 0,  6,  8),
+    b'L':        (66, 0,  6,  8),
+    b'M':        (72, 0,  6,  8),
+    b'N':        (78, 0,  6,  8),
+    b'O':        (84, 0,  6,  8),
+    b'P':        (90, 0,  6,  8),
+    b'Q':        (0,  8,  6,  8),
+    b'R':        (6,  8,  6,  8),
+    b'S':        (12, 8,  6,  8),
+    b'T':        (18, 8,  6,  8),
+    b'U':        (24, 8,  6,  8),
+    b'V':        (30, 8,  6,  8),
+    b'W':        (36, 8,  6,  8),
+    b'X':        (42, 8,  6,  8),
+    b'Y':        (48, 8,  6,  8),
+    b'Z':        (54, 8,  6,  8),
+    b' ':        (60, 8,  6,  8),
+    b'a':        (0,  32, 6,  8),
+    b'b':        (6,  32, 6,  8),
+    b'c':        (12, 32, 6,  8),
+    b'd':        (18, 32, 6,  8),
+    b'e':        (24, 32, 6,  8),
+    b'f':        (30, 32, 6,  8),
+    b'g':        (36, 32, 6,  8),
+    b'h':        (42, 32, 6,  8),
+    b'i':        (48, 32, 6,  8),
+    b'j':        (54, 32, 6,  8),
+    b'k':        (60, 32, 6,  8),
+    b'l':        (66, 32, 6,  8),
+    b'm':        (72, 32, 6,  8),
+    b'n':        (78, 32, 6,  8),
+    b'o':        (84, 32, 6,  8),
+    b'p':        (90, 32, 6,  8),
+    b'q':        (0,  40, 6,  8),
+    b'r':        (6,  40, 6,  8),
+    b's':        (12, 40, 6,  8),
+    b't':        (18, 40, 6,  8),
+    b'u':        (24, 40, 6,  8),
+    b'v':        (30, 40, 6,  8),
+    b'w':        (36, 40, 6,  8),
+    b'x':        (42, 40, 6,  8),
+    b'y':        (48, 40, 6,  8),
+    b'z':        (54, 40, 6,  8),
+    b'0':        (0,  16, 6,  8),
+    b'1':        (6,  16, 6,  8),
+    b'2':        (12, 16, 6,  8),
+    b'3':        (18, 16, 6,  8),
+    b'4':        (24, 16, 6,  8),
+    b'5':        (30, 16, 6,  8),
+    b'6':        (36, 16, 6,  8),
+    b'7':        (42, 16, 6,  8),
+    b'8':        (48, 16, 6,  8),
+    b'9':        (54, 16, 6,  8),
+    b'.':        (60, 16, 6,  8),
+    b':':        (66, 24, 6,  8),
+    b'\'':       (90, 24, 6,  8),
+    b'<':        (78, 24, 6,  8),
+    b'>':        (84, 24, 6,  8),
+    b'(':        (0,  24, 6,  8),
+    b')':        (6,  24, 6,  8),
+    b'[':        (24, 24, 6,  8),
+    b']':        (30, 24, 6,  8),
+    b'/':        (60, 40, 6,  8),
+    b'=':        (72, 40, 6,  8),
+    b'?':        (84, 40, 6,  8),
+    b',':        (48, 24, 6,  8),
+    b'*':        (66, 40, 6,  8),
+    b'#':        (90, 40, 6,  8),
+    b'-':        (84, 16, 6,  8),
+    b'\x89':     (72, 16, 6,  8),    # +
+    b'\x99':     (84, 16, 6,  8),    # -
+    b'\xb9':     (78, 16, 6,  8),    # /
+    b'\x0e':     (42, 24, 6,  8),    # ->
+    b'\x99':     (84, 16, 6,  8),    # -
+    b'\xab':     (72, 24, 6,  8),    # !
+    b'\xa8':     (36, 24, 6,  8),    # ^
+    b'\xa9':     (66, 16, 6,  8),    # x (aka *)
+    b'\xe6\x90': (90, 8,  6,  8),    # <-
+    b'\x7f\x40': (0,  48, 24, 8)     # Mat
 }
 
 TEXT_RECT_DEFAULT = TEXT_RECTS[b' ']
 
-def locate(renderer, texture, x, y, message):
+
+def locate(screen, font, x, y, message):
     i = 0
     while i < len(message):
-        c = message[i:i+1]
-        if c in (b'\x7f', b'\xe6', b'\xf7'):
-            i += 1
-            c += message[i:i+1]
-        src = TEXT_RECTS.get(c, TEXT_RECT_DEFAULT)
-        dst = sdl2.SDL_Rect((x-1) * 6 + 1, (y-1) * 8, src.w, src.h)
-        sdl2.SDL_RenderCopy(renderer, texture, src, dst)
+        c, i = read_char(message, i)
+        src = font.rects.get(c, font.default)
+        screen.blit(font.bitmap, font.pitch, src, (x-1) * 6 + 1, (y-1) * 8)
         x += 1
-        i += 1
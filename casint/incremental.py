@@ -0,0 +1,198 @@
+"""
+Incremental re-parsing of UCB programs, for reloading a program while it
+is being edited.
+
+A parse keeps the program's tokens and, for each top-level statement, its
+token range and how far the parser looked ahead for it. After an edit:
+
+- tokens that end before the first changed byte are kept, and statements
+  that only looked at those tokens are kept too;
+- lexing resumes after the last kept statement, and stops as soon as it
+  reaches a token boundary inside the unchanged tail of the file, where
+  the old tokens are spliced back in (moved by the change in length);
+- parsing resumes after the last kept statement, and stops as soon as a
+  statement starts where an old statement in the tail started, which
+  are all kept.
+
+Lexing only depends on the bytes from the current position on, and a
+top-level statement only on the tokens it looks at, so the result is the
+same tree a full parse would give. Anything unusual (an error, or a
+program wrapped in braces) falls back to a full parse.
+"""
+from bisect import bisect_left
+
+from .common import *
+from .ast import Program
+from .interpreter import TokenArray
+from .ucb import UcbLexer, UcbParser
+
+
+def _common_prefix(a, b):
+    n = min(len(a), len(b))
+    if a[:n] == b[:n]:
+        return n
+    lo, hi = 0, n
+    # binary search on slices, which compare in C
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _common_suffix(a, b, limit):
+    lo, hi = 0, limit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid:] == b[len(b) - mid:]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+class IncrementalParse():
+    """
+    A parsed UCB program that can be updated after an edit.
+    `statements` holds (start, end, lookahead, node) for each top-level
+    statement: its first token, the token after it, and the furthest
+    token the parser looked at for it.
+    """
+    def __init__(self, text, filepath, tokens, statements, tree=None, reused=0):
+        self.text = text
+        self.filepath = filepath
+        self.tokens = tokens
+        # None if the program can only be parsed in full
+        self.statements = statements
+        self._tree = tree
+        # how many statements were kept from the previous parse
+        self.reused = reused
+
+
+    @property
+    def tree(self):
+        if self._tree is None:
+            self._tree = Program()
+            self._tree.children.extend(node for _, _, _, node in self.statements)
+        return self._tree
+
+
+    @classmethod
+    def parse(cls, text, filepath):
+        text = bytes(text)
+        tokens = TokenArray(UcbLexer(text, filepath))
+        try:
+            statements = _parse_statements(text, filepath, tokens, 0, [], None)
+        except Exception:
+            # a full parse either works or raises the error to report
+            tree = UcbParser(UcbLexer(text, filepath)).parse()
+            return cls(text, filepath, None, None, tree)
+        return cls(text, filepath, tokens, statements)
+
+
+    def update(self, text):
+        """Returns the parse of an edited version of the program."""
+        text = bytes(text)
+        if self.statements is not None:
+            try:
+                return self._update(text)
+            except Exception:
+                pass
+        return IncrementalParse.parse(text, self.filepath)
+
+
+    def _update(self, text):
+        old_text = self.text
+        old = self.tokens
+        prefix = _common_prefix(old_text, text)
+        suffix = _common_suffix(old_text, text, min(len(old_text), len(text)) - prefix)
+        shift = len(text) - len(old_text)
+
+        # tokens that the lexer read (one byte past their end) before
+        # the change, and the statements that only looked at those
+        kept_tokens = bisect_left(old.offsets, prefix)
+        kept = 0
+        while kept < len(self.statements) and self.statements[kept][2] < kept_tokens:
+            kept += 1
+        restart = self.statements[kept - 1][1] if kept else 0
+
+        # re-lex from the end of the last kept statement up to a token
+        # boundary in the unchanged tail
+        tokens = TokenArray()
+        tokens.extend(old, 0, restart)
+        lexer = UcbLexer(text, self.filepath)
+        lexer.seek(old.offsets[restart - 1] if restart else 0)
+        tail_start = len(text) - suffix
+        old_offsets = old.offsets
+
+        def resync(pos):
+            if pos < tail_start:
+                return None
+            i = bisect_left(old_offsets, pos - shift)
+            if i < len(old_offsets) and old_offsets[i] == pos - shift:
+                return i
+            return None
+
+        old_index = tokens.lex(lexer, resync)
+        old_starts = None
+        if old_index is not None:
+            # the old tokens after old_index line up with the new ones
+            # from here on
+            splice = len(tokens)
+            tokens.extend(old, old_index + 1, len(old), shift)
+            moved = splice - (old_index + 1)
+            old_starts = {
+                start + moved: i
+                for i, (start, _, _, _) in enumerate(self.statements)
+                if start > old_index
+            }
+
+        def reuse(cursor):
+            # the old statements from one that starts here on
+            i = old_starts.get(cursor) if old_starts else None
+            if i is None:
+                return None
+            return [
+                (start + moved, end + moved, lookahead + moved, node)
+                for start, end, lookahead, node in self.statements[i:]
+            ]
+
+        statements = _parse_statements(
+            text, self.filepath, tokens, restart, self.statements[:kept], reuse
+        )
+        old_nodes = set(id(node) for _, _, _, node in self.statements)
+        reused = sum(1 for _, _, _, node in statements if id(node) in old_nodes)
+        return IncrementalParse(text, self.filepath, tokens, statements, reused=reused)
+
+
+def _parse_statements(text, filepath, tokens, cursor, statements, reuse):
+    """
+    Parses top-level statements from the given token, like
+    UcbParser.statement_list, recording where each one is. reuse(cursor)
+    may return the rest of the statements from where one starts.
+    """
+    statements = list(statements)
+    parser = UcbParser(UcbLexer(text, filepath), tokens)
+    parser.rewind(cursor)
+    parser.high_water = cursor
+    if tokens.token(0).type == LBRACE:
+        raise Exception('Programs in braces are parsed in full')
+
+    while True:
+        while parser.current_token.type == SEMI:
+            parser.eat(SEMI)
+        if parser.current_token.type == EOF:
+            return statements
+
+        if reuse is not None:
+            rest = reuse(parser.cursor)
+            if rest is not None:
+                return statements + rest
+
+        start = parser.cursor
+        node = parser.statement()
+        if not node:
+            parser.error()
+        statements.append((start, parser.cursor, max(parser.cursor, parser.high_water), node))
@@ -0,0 +1,452 @@
+"""
+Flow-insensitive range and type inference for the vars of a collection of
+programs. Vars and mats are shared by all the programs (Prog doesn't give
+a new scope), so all of them are looked at together.
+
+Every var and mat gets one Range for the whole run: the union of the 0 it
+starts as and of everything assigned to it anywhere, widened to infinity
+where it keeps growing. With those:
+
+- `counters` are the vars whose For loops can count with ints instead of
+  floats: all their loops have constant integral start and step, and no
+  int arithmetic that their values can reach may go past SAFE_INTEGER, up
+  to which ints and floats give the same results (an int with a float
+  gives a float, as before);
+- `int_vars` are the vars that then only ever hold ints, so that they can
+  index a mat without being converted.
+"""
+import math
+
+from .common import *
+from .ast import *
+
+# integers up to this are exact as floats, so int and float arithmetic
+# give the same values
+SAFE_INTEGER = 2 ** 53
+
+# passes over the programs after which ranges that still grow are widened
+WIDEN_AFTER = 3
+
+# the largest constant exponent that powers are bounded for
+MAX_BOUNDED_EXPONENT = 64
+
+COMPARISON_OPERATORS = frozenset((EQ, NEQ, LT, GT, LTE, GTE, AND, OR))
+
+# operators that give an int when both operands are ints
+INT_OPERATORS = frozenset((PLUS, MINUS, MUL, POWER))
+
+
+class Range():
+    """The values an expression may have: lo..hi, and whether all are integers."""
+    __slots__ = ('lo', 'hi', 'integral')
+
+    def __init__(self, lo, hi, integral):
+        # nan comes from e.g. inf - inf, where nothing is known
+        self.lo = -math.inf if math.isnan(lo) else lo
+        self.hi = math.inf if math.isnan(hi) else hi
+        self.integral = integral
+
+    def __eq__(self, other):
+        return (self.lo, self.hi, self.integral) == (other.lo, other.hi, other.integral)
+
+    def __repr__(self):
+        return f'Range({self.lo}, {self.hi}, {self.integral})'
+
+    def union(self, other):
+        return Range(min(self.lo, other.lo), max(self.hi, other.hi), self.integral and other.integral)
+
+    def widen(self, other):
+        """The union, with the bounds that grew moved to infinity."""
+        return Range(
+            self.lo if other.lo >= self.lo else -math.inf,
+            self.hi if other.hi <= self.hi else math.inf,
+            self.integral and other.integral
+        )
+
+    def is_bounded(self):
+        """Whether any integers in the range are exact as floats."""
+        return -SAFE_INTEGER <= self.lo and self.hi <= SAFE_INTEGER
+
+    def is_safe_integer(self):
+        return self.integral and self.is_bounded()
+
+
+UNKNOWN = Range(-math.inf, math.inf, False)
+ZERO = Range(0, 0, True)
+BOOLEAN = Range(0, 1, True)
+# CASIO key codes have at most two digits
+GETKEY_RANGE = Range(0, 99, True)
+RANDNUM_RANGE = Range(0, 1, False)
+FRAC_RANGE = Range(-1, 1, False)
+
+
+def constant_range(value):
+    if type(value) not in (int, float) or not math.isfinite(value):
+        return UNKNOWN
+    return Range(value, value, float(value).is_integer())
+
+
+def literal_value(node):
+    """The value of a number literal, maybe negated, or None."""
+    if type(node) is Num:
+        return node.value
+    if type(node) is UnaryOp and node.op.type == MINUS:
+        value = literal_value(node.expr)
+        return None if value is None else -value
+    return None
+
+
+def _power_range(base, exponent):
+    if exponent.lo != exponent.hi:
+        return UNKNOWN
+    n = exponent.lo
+    if base.lo == base.hi:
+        try:
+            return constant_range(base.lo ** n)
+        except (ArithmeticError, ValueError, TypeError):
+            return UNKNOWN
+    if not float(n).is_integer() or not 0 <= n <= MAX_BOUNDED_EXPONENT:
+        return UNKNOWN
+    n = int(n)
+    values = []
+    for bound in (base.lo, base.hi):
+        try:
+            values.append(bound ** n)
+        except OverflowError:
+            values.append(math.copysign(math.inf, bound) if n % 2 else math.inf)
+    if base.lo < 0 < base.hi:
+        values.append(0)
+    return Range(min(values), max(values), base.integral)
+
+
+class IntegerFacts():
+    def __init__(self, trees):
+        self.vars = dict()
+        self.mats = dict()
+        self.counters = set()
+        self.int_vars = set()
+
+        self.nodes = []
+        for tree in trees:
+            stack = [tree]
+            while stack:
+                node = stack.pop()
+                self.nodes.append(node)
+                stack.extend(iter_child_nodes(node))
+
+        self._infer_ranges()
+        self._find_counters()
+        self._find_int_vars()
+
+
+    def var_range(self, name):
+        return self.vars.get(name, ZERO)
+
+
+    def range(self, node):
+        """The Range of an expression."""
+        cls = type(node)
+        if cls is Num:
+            return constant_range(node.value)
+        if cls is Var:
+            return self.var_range(node.value)
+        if cls is MemoryIndex:
+            if node.left.op.type == MAT:
+                return self.mats.get(node.left.value, ZERO)
+            return UNKNOWN
+        if cls is BinOp:
+            op = node.op.type
+            if op in COMPARISON_OPERATORS:
+                return BOOLEAN
+            left = self.range(node.left)
+            right = self.range(node.right)
+            integral = left.integral and right.integral
+            if op == PLUS:
+                return Range(left.lo + right.lo, left.hi + right.hi, integral)
+            if op == MINUS:
+                return Range(left.lo - right.hi, left.hi - right.lo, integral)
+            if op == MUL:
+                # 0 * inf is 0 here: the bound is infinite, the values aren't
+                products = [
+                    0 if (a == 0 or b == 0) else a * b
+                    for a in (left.lo, left.hi) for b in (right.lo, right.hi)
+                ]
+                return Range(min(products), max(products), integral)
+            if op == POWER:
+                return _power_range(left, right)
+            return UNKNOWN
+        if cls is UnaryOp:
+            if node.op.type == MINUS:
+                expr = self.range(node.expr)
+                return Range(-expr.hi, -expr.lo, expr.integral)
+            return UNKNOWN
+        if cls is UnaryFunc:
+            if node.op.type == INTG:
+                arg = self.range(node.arg1)
+                lo = math.trunc(arg.lo) if math.isfinite(arg.lo) else arg.lo
+                hi = math.trunc(arg.hi) if math.isfinite(arg.hi) else arg.hi
+                return Range(lo, hi, True)
+            if node.op.type == FRAC:
+                return FRAC_RANGE
+            return UNKNOWN
+        if cls is BinaryFunc:
+            if node.op.type == PXLTEST:
+                return BOOLEAN
+            return UNKNOWN
+        if cls is NullaryFunc:
+            if node.op.type == GETKEY:
+                return GETKEY_RANGE
+            if node.op.type == RANDNUM:
+                return RANDNUM_RANGE
+        return UNKNOWN
+
+
+    def is_int(self, node):
+        """Whether an expression always gives an int, not a float."""
+        cls = type(node)
+        if cls is Num:
+            return type(node.value) is int
+        if cls is Var:
+            return node.value in self.int_vars
+        if cls is BinOp:
+            if node.op.type in COMPARISON_OPERATORS:
+                return True
+            if node.op.type in (PLUS, MINUS, MUL):
+                return self.is_int(node.left) and self.is_int(node.right)
+            return False
+        if cls is UnaryOp:
+            return node.op.type == MINUS and self.is_int(node.expr)
+        if cls is BinaryFunc:
+            return node.op.type == PXLTEST
+        if cls is NullaryFunc:
+            return node.op.type == GETKEY
+        return False
+
+
+    def _writes(self):
+        """Yields (target, Range) for each assignment, with the current ranges."""
+        for node in self.nodes:
+            cls = type(node)
+            if cls is Assign:
+                yield node.var, self.range(node.expr)
+            elif cls is ForTo:
+                yield node.var, self._counter_range(node)
+            elif cls is Initialize:
+                yield node.mem_struct, ZERO
+            elif cls is UnaryBuiltin and node.op.type in (ISZ, DSZ):
+                value = self.range(node.arg1)
+                delta = 1 if node.op.type == ISZ else -1
+                yield node.arg1, Range(value.lo + delta, value.hi + delta, value.integral)
+
+
+    def _counter_range(self, node):
+        # the machine assigns start, then counter + step while it passes
+        # the check against end
+        start = self.range(node.start)
+        end = self.range(node.end)
+        step = self.range(node.step)
+        counter = self.range(node.var)
+        integral = counter.integral and step.integral
+        result = start
+        if start.lo < end.hi and step.hi > 0:
+            lo = counter.lo + step.lo
+            if lo <= end.hi:
+                result = result.union(Range(lo, end.hi, integral))
+        if start.hi > end.lo and step.lo < 0:
+            hi = counter.hi + step.hi
+            if hi >= end.lo:
+                result = result.union(Range(end.lo, hi, integral))
+        if start.lo <= end.hi and end.lo <= start.hi:
+            result = result.union(Range(end.lo, end.hi, integral))
+        return result
+
+
+    def _assign_range(self, target, value, passes):
+        cls = type(target)
+        if cls is Var:
+            table, names = self.vars, (target.value,)
+        elif cls is VariableRange:
+            table = self.vars
+            names = [bytes((c,)) for c in range(target.lower.value[0], target.upper.value[0] + 1)]
+        elif cls is MemoryIndex:
+            table, names = self.mats, (target.left.value,)
+        elif cls is MemoryStructure:
+            table, names = self.mats, (target.value,)
+        else:
+            return False
+        changed = False
+        for name in names:
+            old = table.get(name, ZERO)
+            new = old.union(value)
+            if new != old:
+                table[name] = old.widen(new) if passes > WIDEN_AFTER else new
+                changed = True
+        return changed
+
+
+    def _infer_ranges(self):
+        passes = 0
+        changed = True
+        while changed:
+            passes += 1
+            changed = False
+            for target, value in list(self._writes()):
+                if self._assign_range(target, value, passes):
+                    changed = True
+
+
+    def _find_counters(self):
+        candidates = dict()
+        for node in self.nodes:
+            if type(node) is not ForTo:
+                continue
+            if type(node.var) is not Var:
+                continue
+            name = node.var.value
+            start = literal_value(node.start)
+            step = literal_value(node.step)
+            candidates[name] = (
+                candidates.get(name, True)
+                and start is not None and float(start).is_integer()
+                and step is not None and float(step).is_integer()
+                and self.var_range(name).is_bounded()
+            )
+        candidates = set(name for name, ok in candidates.items() if ok)
+
+        if self._is_safe(candidates):
+            self.counters = candidates
+            return
+        # some of them reach unbounded int arithmetic together
+        for name in sorted(candidates):
+            if self._is_safe(self.counters | {name}):
+                self.counters.add(name)
+
+
+    def _is_safe(self, counters):
+        """
+        Whether counting with ints in the loops of these vars keeps every
+        int result within SAFE_INTEGER.
+        """
+        may_int = dict()
+        new_vars = set(counters)
+        new_mats = set()
+
+        def new_int(node):
+            # whether the node may give an int that comes from a counter
+            key = id(node)
+            if key not in memo:
+                memo[key] = self._new_int(node, new_vars, new_mats, new_int, may_int)
+            return memo[key]
+
+        changed = True
+        while changed:
+            changed = False
+            memo = dict()
+            for node in self.nodes:
+                cls = type(node)
+                if cls is Assign and new_int(node.expr):
+                    targets = node.var
+                elif cls is ForTo and new_int(node.start):
+                    targets = node.var
+                else:
+                    continue
+                if type(targets) is Var:
+                    names, table = (targets.value,), new_vars
+                elif type(targets) is VariableRange:
+                    names = [bytes((c,)) for c in range(targets.lower.value[0], targets.upper.value[0] + 1)]
+                    table = new_vars
+                elif type(targets) is MemoryIndex:
+                    names, table = (targets.left.value,), new_mats
+                else:
+                    continue
+                for name in names:
+                    if name not in table:
+                        table.add(name)
+                        changed = True
+
+        for node in self.nodes:
+            cls = type(node)
+            arithmetic = (
+                (cls is BinOp and node.op.type in INT_OPERATORS)
+                or (cls is UnaryOp and node.op.type == MINUS)
+            )
+            if arithmetic and new_int(node) and not self.range(node).is_bounded():
+                return False
+        return True
+
+
+    def _new_int(self, node, new_vars, new_mats, new_int, may_int):
+        cls = type(node)
+        if cls is Var:
+            return node.value in new_vars
+        if cls is MemoryIndex:
+            return node.left.value in new_mats
+        if cls is BinOp:
+            if node.op.type not in INT_OPERATORS:
+                return False
+            return (
+                (new_int(node.left) and self._may_int(node.right, may_int))
+                or (self._may_int(node.left, may_int) and new_int(node.right))
+            )
+        if cls is UnaryOp:
+            return node.op.type == MINUS and new_int(node.expr)
+        return False
+
+
+    def _may_int(self, node, memo):
+        """Whether a node may give an int at all (vars start as int 0)."""
+        key = id(node)
+        if key in memo:
+            return memo[key]
+        cls = type(node)
+        if cls is Num:
+            result = type(node.value) is int
+        elif cls in (Var, MemoryIndex):
+            result = True
+        elif cls is BinOp:
+            if node.op.type in COMPARISON_OPERATORS:
+                result = True
+            elif node.op.type in INT_OPERATORS:
+                result = self._may_int(node.left, memo) and self._may_int(node.right, memo)
+            else:
+                result = False
+        elif cls is UnaryOp:
+            result = self._may_int(node.expr, memo)
+        elif cls is UnaryFunc:
+            result = False
+        elif cls is NullaryFunc:
+            result = node.op.type != RANDNUM
+        else:
+            result = True
+        memo[key] = result
+        return result
+
+
+    def _find_int_vars(self):
+        # start from every var, and drop those that may be given a float
+        names = set()
+        for node in self.nodes:
+            if type(node) is Var:
+                names.add(node.value)
+        self.int_vars = names
+
+        changed = True
+        while changed:
+            changed = False
+            for node in self.nodes:
+                cls = type(node)
+                if cls is Assign and not self.is_int(node.expr):
+                    target = node.var
+                elif cls is ForTo and not (type(node.var) is Var and node.var.value in self.counters):
+                    target = node.var
+                else:
+                    continue
+                if type(target) is Var:
+                    dropped = {target.value}
+                elif type(target) is VariableRange:
+                    dropped = set(bytes((c,)) for c in range(target.lower.value[0], target.upper.value[0] + 1))
+                else:
+                    continue
+                if dropped & self.int_vars:
+                    self.int_vars -= dropped
+                    changed = True
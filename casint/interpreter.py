@@ -1,7 +1,15 @@
+import re
+from array import array
+from bisect import bisect_left
+
 from .common import *
 from .ast import *
 
 
+# bump whenever a change to the lexers or parsers changes the trees they build
+PARSER_VERSION = 2
+
+
 class LexerException(Exception):
     pass
 
@@ -11,6 +19,8 @@ class ParserException(Exception):
 
 
 class Token(object):
+    __slots__ = ('type', 'value')
+
     def __init__(self, type, value):
         self.type = type
         self.value = value
@@ -27,105 +37,211 @@ class Token(object):
         return self.__str__()
 
 
-def is_variable(char):
-    return char in ALPHA_MEM_CHARS
-
-
-def is_numeric(char):
-    return char in b'01234567890.'
-
-
-def is_ucb_word_character(char):
-    return char in UCB_WORD_CHARACTERS
-
-
 def parse_word_as_number(word):
     if b'.' in word:
         return float(word)
     return float(int(word))
 
 
+# the body of a string, up to the closing quote or the end of the input
+STRING_BODY = re.compile(rb'[^"\x00]*')
+
+
+def index_by_byte(table):
+    """Re-keys a table of single character bytes by byte value."""
+    return {c[0]: value for c, value in table.items()}
+
+
 class Lexer():
+    """
+    Scans `text` by index. Characters are byte values (ints); whole tokens
+    are sliced out at once, and line/column numbers are only worked out
+    when a position is reported.
+    """
     def __init__(self, text, filepath):
-        self.text = text
+        self.text = bytes(text)
         self.filepath = filepath
         self.pos = 0
-        self.pos_ln = 1
-        self.pos_col = 1
-        self.current_char = self.text[self.pos:self.pos+1]
-        if self.current_char == b'\x00':
-            self.current_char = None
+        # offsets of the newlines, found when a position is first needed
+        self.newlines = None
+
+
+    def position(self, pos=None):
+        """Returns the line and column of a position (default: the current one)."""
+        if pos is None:
+            pos = self.pos
+        if self.newlines is None:
+            self.newlines = [m.start() for m in re.finditer(b'\n', self.text)]
+        line = bisect_left(self.newlines, pos)
+        line_start = self.newlines[line - 1] + 1 if line else 0
+        return line + 1, pos - line_start + 1
 
 
     def error(self):
+        ln, col = self.position()
         raise LexerException(
             f'Invalid character:'
             f' filepath={self.filepath}'
-            f' pos={self.pos} ln={self.pos_ln} col={self.pos_col}'
+            f' pos={self.pos} ln={ln} col={col}'
             f' chrs={self.text[self.pos:self.pos+20]}'
         )
 
 
-    def advance(self):
-        """Advance the `pos` pointers and set the `current_char` variable."""
-        self.pos += 1
-        if self.current_char == b'\n':
-            self.pos_ln += 1
-            self.pos_col = 1
-        else:
-            self.pos_col += 1
+    def char(self):
+        """The current byte, or None at the end of the input (or a NUL)."""
+        pos = self.pos
+        if pos < len(self.text) and self.text[pos]:
+            return self.text[pos]
+        return None
 
-        if self.pos >= len(self.text):
-            self.current_char = None  # Indicates end of input
-        else:
-            self.current_char = self.text[self.pos:self.pos+1]
-            if self.current_char == b'\x00':
-                self.current_char = None
 
+    def current_char(self, pos=None):
+        """The character at a position (default: the current one) as bytes, for messages."""
+        if pos is None:
+            pos = self.pos
+        c = self.text[pos:pos+1]
+        return None if c in (b'', b'\x00') else c
 
-    def freeze(self):
-        return self.pos, self.pos_ln, self.pos_col
 
+    def peek(self):
+        """The byte after the current one, or None past the end."""
+        pos = self.pos + 1
+        if pos < len(self.text):
+            return self.text[pos]
+        return None
 
-    def seek(self, pos, ln, col):
-        self.pos = pos
-        self.pos_ln = ln
-        self.pos_col = col
-        self.current_char = self.text[self.pos:self.pos+1]
-        if self.current_char == b'\x00':
-            self.current_char = None
 
+    def match(self, pattern):
+        """Consumes and returns what a compiled regex matches at the current position."""
+        m = pattern.match(self.text, self.pos)
+        self.pos = m.end()
+        return m.group()
 
-    def peek(self):
-        peek_pos = self.pos + 1
-        if peek_pos > len(self.text) - 1:
-            return None
-        char = self.text[peek_pos:peek_pos+1]
-        return char
+
+    def quoted(self):
+        """Consumes a string starting at its opening quote and returns its body."""
+        self.pos += 1
+        result = self.match(STRING_BODY)
+        # the closing quote
+        self.pos += 1
+        return result
+
+
+    def freeze(self):
+        return self.pos
 
 
-    def peek_next_token(self):
-        pos, ln, col = self.freeze()
-        self.advance()
-        token = self.get_next_token()
-        self.seek(pos, ln, col)
-        return token
+    def seek(self, pos):
+        self.pos = pos
+
+
+# prefix operators, which apply to an exponentiation; ^ binds tighter,
+# and its operands are implicit multiplications
+UNARY_OPERATORS = frozenset((PLUS, MINUS, NOT))
+
+# tokens that start an implicit multiplication, e.g. 2A or A(B+1)
+IMPLICIT_MULTIPLICANDS = frozenset((
+    LPAREN, RANDNUM, PROMPT, GETKEY, LOG, INTG, FRAC, PXLTEST, NUMBER, MAT, VARIABLE
+))
+
+
+class TokenArray():
+    """
+    All the tokens of a program, lexed once. Equal tokens are interned, so
+    each token is stored as an index into a table of distinct tokens, plus
+    the offset the lexer had reached after it (for error messages).
+    If lexing fails, the error is kept and raised when the parser reaches
+    the token that couldn't be lexed, just like lexing on demand would.
+    """
+    def __init__(self, lexer=None):
+        self.ids = array('I')
+        self.offsets = array('I')
+        self.table = []
+        self.table_ids = dict()
+        self.error = None
+        if lexer is not None:
+            self.lex(lexer)
+
+
+    def _intern(self, token):
+        # the value's type keeps 1 and 1.0 (or True) apart
+        key = (token.type, type(token.value), token.value)
+        token_id = self.table_ids.get(key)
+        if token_id is None:
+            token_id = self.table_ids[key] = len(self.table)
+            self.table.append(token)
+        return token_id
+
+
+    def lex(self, lexer, stop=None):
+        """
+        Appends the tokens from the lexer's position to the end of the
+        input, or until stop(offset) returns something other than None
+        for the offset after a token. Returns that value.
+        """
+        intern = self._intern
+        append_id = self.ids.append
+        append_offset = self.offsets.append
+        get_next_token = lexer.get_next_token
+        while True:
+            try:
+                token = get_next_token()
+            except Exception as e:
+                self.error = e
+                return None
+            append_id(intern(token))
+            append_offset(lexer.pos)
+            if token.type == EOF:
+                return None
+            if stop is not None:
+                result = stop(lexer.pos)
+                if result is not None:
+                    return result
+
+
+    def extend(self, other, start, end, shift=0):
+        """Appends tokens start:end of another array, moved by shift bytes."""
+        ids = [self._intern(token) for token in other.table]
+        self.ids.extend(ids[i] for i in other.ids[start:end])
+        self.offsets.extend(offset + shift for offset in other.offsets[start:end])
+
+
+    def __len__(self):
+        return len(self.ids)
+
+
+    def token(self, i):
+        if i >= len(self.ids):
+            if self.error is not None:
+                raise self.error.with_traceback(None)
+            # the EOF token repeats
+            i = len(self.ids) - 1
+        return self.table[self.ids[i]]
 
 
 class Parser():
-    def __init__(self, lexer):
+    def __init__(self, lexer, tokens=None):
         self.lexer = lexer
+        # lex the whole input once (unless it's been done already);
+        # backtracking only moves the cursor
+        self.tokens = TokenArray(lexer) if tokens is None else tokens
+        self.cursor = 0
+        # the furthest token looked at before backtracking
+        self.high_water = 0
         # set current token to the first token taken from the input
-        self.current_token = self.lexer.get_next_token()
+        self.current_token = self.tokens.token(0)
 
 
     def error(self, message=''):
+        # where the lexer was after reading the current token
+        pos = self.tokens.offsets[min(self.cursor, len(self.tokens) - 1)]
+        ln, col = self.lexer.position(pos)
         raise ParserException(
             f'Invalid syntax:'
             f' tok={self.current_token}'
             f' filepath={self.lexer.filepath}'
-            f' pos={self.lexer.pos} ln={self.lexer.pos_ln} col={self.lexer.pos_col}'
-            f' chr={self.lexer.current_char}'
+            f' pos={pos} ln={ln} col={col}'
+            f' chr={self.lexer.current_char(pos)}'
             f' msg={message}'
         )
 
@@ -136,23 +252,18 @@ class Parser():
         # and assign the next token to the self.current_token,
         # otherwise raise an exception.
         if self.current_token.type == token_type:
-            self.current_token = self.lexer.get_next_token()
+            self.cursor += 1
+            self.current_token = self.tokens.token(self.cursor)
         else:
             self.error(f'expected {token_type} token')
 
 
-    def try_parse(self, parse_func):
-        pos, ln, col = self.lexer.freeze()
-        token = self.current_token
-        try:
-            parse_func()
-        except Exception as e:
-            return False
-        else:
-            return True
-        finally:
-            self.lexer.seek(pos, ln, col)
-            self.current_token = token
+    def rewind(self, cursor):
+        """Goes back to an earlier token."""
+        if self.cursor > self.high_water:
+            self.high_water = self.cursor
+        self.cursor = cursor
+        self.current_token = self.tokens.token(cursor)
 
 
     def program(self):
@@ -167,29 +278,29 @@ class Parser():
         token = self.current_token
 
         if token.type == CLS:
-            node = self.nullary_builtin(token, b'Cls', b'\xd1')
+            node = self.nullary_builtin(token)
 
         elif token.type == COORDOFF:
             self.eat(COORDOFF)
-            node = NullaryBuiltin(token, b'CoordOff', b'\xf7\xd3')
+            node = NullaryBuiltin(token)
 
         elif token.type == GRIDOFF:
             self.eat(GRIDOFF)
-            node = NullaryBuiltin(token, b'GridOff', b'\xf7\x7a')
+            node = NullaryBuiltin(token)
 
         elif token.type == AXESOFF:
             self.eat(AXESOFF)
-            node = NullaryBuiltin(token, b'AxesOff', b'\xf7\xd2')
+            node = NullaryBuiltin(token)
 
         elif token.type == LABELOFF:
             self.eat(LABELOFF)
-            node = NullaryBuiltin(token, b'LabelOff', b'\xf7\xd4')
+            node = NullaryBuiltin(token)
 
         elif token.type == CLRTEXT:
-            node = self.nullary_builtin(token, b'ClrText', b'\xf7\x18')
+            node = self.nullary_builtin(token)
 
         elif token.type == STRING:
-            node = UnaryBuiltin(token, b'Print', b'', self.string_literal())
+            node = UnaryBuiltin(token, self.string_literal())
 
         elif token.type == COMMENT:
             self.eat(COMMENT)
@@ -197,15 +308,15 @@ class Parser():
 
         elif token.type == RETURN:
             self.eat(RETURN)
-            node = KeywordBuiltin(token, b'return', b'\xf7\x0c')
+            node = KeywordBuiltin(token)
 
         elif token.type == BREAK:
             self.eat(BREAK)
-            node = KeywordBuiltin(token, b'break', b'\xf7\x0d')
+            node = KeywordBuiltin(token)
 
         elif token.type == STOP:
             self.eat(STOP)
-            node = KeywordBuiltin(token, b'stop', b'\xf7\x0e')
+            node = KeywordBuiltin(token)
 
         elif token.type == LBL:
             self.eat(LBL)
@@ -237,10 +348,10 @@ class Parser():
             node = self.prog(token)
 
         elif token.type == DSZ:
-            node = self.unary_builtin(token, b'Dsz', b'\xe8', self.variable_or_mat_get)
+            node = self.unary_builtin(token, self.variable_or_mat_get)
 
         elif token.type == ISZ:
-            node = self.unary_builtin(token, b'Isz', b'\xe9', self.variable_or_mat_get)
+            node = self.unary_builtin(token, self.variable_or_mat_get)
 
         elif token.type == STOPICT:
             node = self.stopict(token)
@@ -255,59 +366,70 @@ class Parser():
             node = self.locate(token)
 
         elif token.type == FLINE:
-            node = self.quaternary_builtin(token, b'F_Line', b'\xf7\xa7')
+            node = self.quaternary_builtin(token)
 
         elif token.type == CIRCLE:
-            self.eat(CIRCLE)
-            arg1 = self.expression()
-            self.eat(COMMA)
-            arg2 = self.expression()
-            self.eat(COMMA)
-            arg3 = self.expression()
-            node = TernaryBuiltin(token, b'Circle', b'\xf7\xa6', arg1, arg2, arg3)
+            node = self.ternary_builtin(token)
 
         elif token.type == HORIZONTAL:
-            return self.unary_builtin(token, b'Horizontal', b'\xf7\xa4', self.expression)
+            return self.unary_builtin(token, self.expression)
+
+        elif token.type == VERTICAL:
+            return self.unary_builtin(token, self.expression)
 
         elif token.type == PLOTON:
-            self.eat(PLOTON)
-            arg1 = self.expression()
-            self.eat(COMMA)
-            arg2 = self.expression()
-            node = BinaryBuiltin(token, b'PlotOn', b'\xf7\xa8', arg1, arg2)
+            node = self.binary_builtin(token)
 
         elif token.type == GRAPHYEQ:
-            return self.unary_builtin(token, b'GraphYEq', b'\xee', self.expression)
+            return self.unary_builtin(token, self.expression)
 
         elif token.type == PXLON:
-            node = self.binary_builtin(token, b'PxlOn', b'\xf7\xab')
+            node = self.binary_builtin(token)
 
         elif token.type == PXLOFF:
-            node = self.binary_builtin(token, b'PxlOff', b'\xf7\xac')
+            node = self.binary_builtin(token)
 
         elif token.type == PXLCHG:
-            node = self.binary_builtin(token, b'PxlChg', b'\xf7\xad')
+            node = self.binary_builtin(token)
 
         elif token.type == VIEWWINDOW:
-            node = self.senary_builtin(token, b'ViewWindow', b'\xeb')
+            node = self.senary_builtin(token)
 
         elif token.type == LBRACKET:
             node = self.initialize_memory_values()
 
         else:
-            # read ahead.
-            if self.try_parse(self.assignment_statement):
-                node = self.assignment_statement()
+            node = self.expression_statement()
 
-            elif self.try_parse(self.expression):
-                node = self.expression()
+        return node
 
-                if self.current_token.type == INLINEIF:
-                    # conditional jump, i.e. inline-if
-                    node = self.inline_if(node)
 
-            else:
-                node = self.empty()
+    def expression_statement(self):
+        """
+        Parses an expression once, then finishes the statement as an
+        assignment, an inline-if or just the expression.
+        """
+        first = self.current_token
+        cursor = self.cursor
+        try:
+            node = self.expression()
+        except Exception:
+            self.rewind(cursor)
+            return self.empty()
+
+        cursor = self.cursor
+        try:
+            assignment = self.assignment(first, node)
+        except Exception:
+            # not an assignment after all, leave what follows the expression
+            self.rewind(cursor)
+            assignment = None
+        if assignment:
+            return assignment
+
+        if self.current_token.type == INLINEIF:
+            # conditional jump, i.e. inline-if
+            return self.inline_if(node)
 
         return node
 
@@ -395,162 +517,48 @@ class Parser():
 
 
     def expression(self, eager=True):
-        node = self.and_expression(eager=eager)
-
-        while eager and self.current_token.type == OR:
-            token = self.current_token
-            self.eat(OR)
-
-            node = BinOp(left=node, op=token, right=self.and_expression(eager=eager), ucb_repr=b'or', g1m_repr=b'\x7f\xb1')
-
-        return node
-
-
-    def and_expression(self, eager=True):
-        node = self.compare_eq_neq_expression(eager=eager)
-
-        while eager and self.current_token.type == AND:
-            token = self.current_token
-            self.eat(AND)
-
-            node = BinOp(left=node, op=token, right=self.compare_eq_neq_expression(eager=eager), ucb_repr=b'and', g1m_repr=b'\x7f\xb0')
-
-        return node
-
-
-    def compare_eq_neq_expression(self, eager=True):
-        node = self.compare_lt_gt_expression(eager=eager)
-
-        while eager and self.current_token.type in (EQ, NEQ):
-            token = self.current_token
-            ucb_repr = None
-            g1m_repr = None
-
-            if token.type == EQ:
-                self.eat(EQ)
-                ucb_repr = b'=='
-                g1m_repr = b'='
-            else:
-                self.eat(NEQ)
-                ucb_repr = b'!='
-                g1m_repr = b'\x11'
-
-            node = BinOp(left=node, op=token, right=self.compare_lt_gt_expression(eager=eager), ucb_repr=ucb_repr, g1m_repr=g1m_repr)
-
-        return node
-
-
-    def compare_lt_gt_expression(self, eager=True):
-        node = self.addition_subtraction_expression(eager=eager)
-
-        while eager and self.current_token.type in (LT, LTE, GTE, GT):
-            token = self.current_token
-            ucb_repr = None
-            g1m_repr = None
-
-            if token.type == LT:
-                self.eat(LT)
-                ucb_repr = b'<'
-                g1m_repr = b'\x3c'
-            elif token.type == LTE:
-                self.eat(LTE)
-                ucb_repr = b'<='
-                g1m_repr = b'\x10'
-            elif token.type == GTE:
-                self.eat(GTE)
-                ucb_repr = b'>='
-                g1m_repr = b'\x12'
-            else:
-                self.eat(GT)
-                ucb_repr = b'>'
-                g1m_repr = b'\x3e'
-
-            node = BinOp(left=node, op=token, right=self.addition_subtraction_expression(eager=eager), ucb_repr=ucb_repr, g1m_repr=g1m_repr)
-
-        return node
-
-
-    def addition_subtraction_expression(self, eager=True):
-        node = self.multiplication_division_expression(eager=eager)
-
-        while eager and self.current_token.type in (PLUS, MINUS):
-            token = self.current_token
-            ucb_repr = None
-            g1m_repr = None
-
-            if token.type == PLUS:
-                self.eat(PLUS)
-                ucb_repr = b'+'
-                g1m_repr = b'\x89'
-            else:
-                self.eat(MINUS)
-                ucb_repr = b'-'
-                g1m_repr = b'\x99'
-
-            node = BinOp(left=node, op=token, right=self.multiplication_division_expression(eager=eager), ucb_repr=ucb_repr, g1m_repr=g1m_repr)
-
-        return node
-
-
-    def multiplication_division_expression(self, eager=True):
+        # a non-eager expression stops before any binary operator but ^,
+        # e.g. the argument of a G1M function
+        if not eager:
+            return self.unary_expression()
+        return self.binary_expression(LOWEST_PRECEDENCE)
+
+
+    def binary_expression(self, min_precedence):
+        """
+        Precedence climbing: operators of the same precedence are applied
+        left to right in a loop, and only a higher precedence operator on
+        the right recurses.
+        """
         node = self.unary_expression()
 
-        while eager and self.current_token.type in (MUL, DIV):
+        while True:
             token = self.current_token
-            ucb_repr = None
-            g1m_repr = None
-
-            if token.type == MUL:
-                self.eat(MUL)
-                ucb_repr = b'*'
-                g1m_repr = b'\xa9'
-            else:
-                self.eat(DIV)
-                ucb_repr = b'/'
-                g1m_repr = b'\xb9'
+            precedence = BINARY_OPERATORS.get(token.type)
+            if precedence is None or precedence < min_precedence:
+                return node
+            self.eat(token.type)
 
-            node = BinOp(left=node, op=token, right=self.unary_expression(), ucb_repr=ucb_repr, g1m_repr=g1m_repr)
-
-        return node
+            right = self.binary_expression(precedence + 1)
+            node = BinOp(left=node, op=token, right=right)
 
 
     def unary_expression(self):
-        if self.current_token.type in (PLUS, MINUS, NOT):
-            token = self.current_token
-            ucb_repr = None
-            g1m_repr = None
-
-            if token.type == PLUS:
-                self.eat(PLUS)
-                ucb_repr = b'+'
-                g1m_repr = b'\x89'
-            elif token.type == MINUS:
-                self.eat(MINUS)
-                ucb_repr = b'-'
-                g1m_repr = b'\x87'
-            else:
-                self.eat(NOT)
-                ucb_repr = b'!'
-                g1m_repr = b'!'
-
-            return UnaryOp(op=token, expr=self.exponentiation_expression(), ucb_repr=ucb_repr, g1m_repr=g1m_repr)
+        token = self.current_token
+        if token.type not in UNARY_OPERATORS:
+            return self.exponentiation_expression()
 
-        return self.exponentiation_expression()
+        self.eat(token.type)
+        return UnaryOp(op=token, expr=self.exponentiation_expression())
 
 
     def exponentiation_expression(self):
         node = self.implicit_multiplication_expression()
 
-        while self.current_token.type in (POWER,):
+        while self.current_token.type == POWER:
             token = self.current_token
-            ucb_repr = None
-            g1m_repr = None
-
             self.eat(POWER)
-            ucb_repr = b'**'
-            g1m_repr = b'\xa8'
-
-            node = BinOp(left=node, op=token, right=self.implicit_multiplication_expression(), ucb_repr=ucb_repr, g1m_repr=g1m_repr)
+            node = BinOp(left=node, op=token, right=self.implicit_multiplication_expression())
 
         return node
 
@@ -559,9 +567,9 @@ class Parser():
         node = self.nullary_expression()
 
         # multiply adjacent highest-precedence nodes
-        while self.current_token.type in (LPAREN, RANDNUM, PROMPT, GETKEY, LOG, INTG, FRAC, PXLTEST, NUMBER, MAT, VARIABLE):
-            token = Token(MUL, b'*')
-            node = BinOp(left=node, op=token, right=self.nullary_expression(), ucb_repr=b'*', g1m_repr=b'')
+        while self.current_token.type in IMPLICIT_MULTIPLICANDS:
+            token = Token(MUL, IMPLICIT_MUL_VALUE)
+            node = BinOp(left=node, op=token, right=self.nullary_expression())
 
         return node
 
@@ -580,17 +588,17 @@ class Parser():
 
         # function call (produces a value)
         elif token.type == RANDNUM:
-            return self.nullary_func(token, b'RandNum', b'\xc1')
+            return self.nullary_func(token)
         elif token.type == PROMPT:
-            return self.nullary_func(token, b'Prompt', b'?')
+            return self.nullary_func(token)
         elif token.type == GETKEY:
-            return self.nullary_func(token, b'GetKey', b'\x7f\x8f')
+            return self.nullary_func(token)
         elif token.type == LOG:
-            return self.unary_func(token, b'Log', b'\x95')
+            return self.unary_func(token)
         elif token.type == INTG:
-            return self.unary_func(token, b'Intg', b'\xde')
+            return self.unary_func(token)
         elif token.type == FRAC:
-            return self.unary_func(token, b'Frac', b'\xb6')
+            return self.unary_func(token)
         elif token.type == PXLTEST:
             return self.pxltest(token)
 
@@ -615,9 +623,15 @@ class Parser():
     def variable_or_mat_set(self):
         token = self.current_token
         node = self.variable_or_mat_get()
-        if token.type == VARIABLE and self.current_token.type == VARIABLERANGE:
+        if token.type == VARIABLE:
+            node = self.variable_range(node)
+        return node
+
+
+    def variable_range(self, node):
+        """Extends a variable to a range, e.g. A~Z, if one follows."""
+        if self.current_token.type == VARIABLERANGE:
             self.eat(VARIABLERANGE)
-            token = self.current_token
             upper = self.variable()
             if node.value[0] > upper.value[0]:
                 self.error()
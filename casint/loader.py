@@ -1,10 +1,16 @@
 import os
 import struct
+import threading
+from concurrent.futures import ProcessPoolExecutor
 
 import bitstring
 
+from .astcodec import encode_tree, decode_tree
+from .callgraph import CallGraph
 from .common import translate_casio_bytes_to_ascii, translate_ascii_bytes_to_casio
 from .g1m import G1mLexer, G1mParser
+from .inference import IntegerFacts
+from .optimizer import optimize_tree
 from .ucb import UcbLexer, UcbParser
 
 
@@ -30,11 +36,76 @@ class CasioItem():
         raise NotImplementedError()
 
 
+# the lexer and parser for each source format
+PROGRAM_PARSERS = {
+    'g1m': (G1mLexer, G1mParser),
+    'ucb': (UcbLexer, UcbParser)
+}
+
+
 class CasioProgram(CasioItem):
-    def __init__(self, name, size, tree):
+    '''
+    A program keeps its source bytes and is only parsed the first time its
+    tree is used, so any parse error is raised from there.
+    '''
+    def __init__(self, name, size, source, source_format, filepath, cache=None):
         super().__init__(name)
         self.size = size
-        self.tree = tree
+        self.source = source
+        self.source_format = source_format
+        self.filepath = filepath
+        self.cache = cache
+        self._tree = None
+        self._optimized_tree = None
+        self._optimized_facts = None
+        # the collection may be parsing it in the background
+        self._parse_lock = threading.Lock()
+
+
+    @property
+    def tree(self):
+        if self._tree is None:
+            with self._parse_lock:
+                if self._tree is None and not self.load_cached():
+                    self._tree = parse_program_source(self.source, self.source_format, self.filepath)
+                    if self.cache:
+                        self.cache.store(self.source, self.source_format, tree=self._tree)
+        return self._tree
+
+
+    def get_optimized_tree(self, facts=None, programs=None):
+        '''The tree the machine runs: see optimizer.py.'''
+        if self._optimized_tree is None or self._optimized_facts is not facts:
+            self._optimized_tree = optimize_tree(self.tree, facts, programs)
+            self._optimized_facts = facts
+        return self._optimized_tree
+
+
+    def forget_optimized_tree(self):
+        self._optimized_tree = None
+        self._optimized_facts = None
+
+
+    def load_cached(self):
+        '''Takes the tree from the cache, if it's there.'''
+        if self.cache:
+            self._tree = self.cache.load(self.source, self.source_format)
+        return self._tree is not None
+
+
+    @property
+    def is_parsed(self):
+        return self._tree is not None
+
+
+    def replace_source(self, source, tree):
+        '''Swaps in a new version of the program, e.g. after its file was edited.'''
+        self.source = source
+        self.size = len(source)
+        self._tree = tree
+        self.forget_optimized_tree()
+        if self.cache:
+            self.cache.store(source, self.source_format, tree=tree)
 
 
     def get_ucb_filename(self):
@@ -59,6 +130,41 @@ class CasioProgram(CasioItem):
         return self.__str__()
 
 
+def parse_program_source(source, source_format, filepath):
+    lexer_class, parser_class = PROGRAM_PARSERS[source_format]
+    parser = parser_class(lexer_class(source, filepath))
+    return parser.parse()
+
+
+def _parse_encoded(args):
+    # runs in a worker process; the tree goes back in its compact form
+    try:
+        return encode_tree(parse_program_source(*args))
+    except Exception:
+        # left unparsed, so the error is raised when the tree is used
+        return None
+
+
+def parse_programs(programs, workers=None):
+    '''
+    Parses programs across a pool of worker processes (by default one per
+    core). Programs that fail to parse are left as they are, and raise
+    their error on first use as usual.
+    '''
+    programs = [p for p in programs if not p.is_parsed and not p.load_cached()]
+    if not programs:
+        return
+    jobs = [(p.source, p.source_format, p.filepath) for p in programs]
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunksize = max(1, len(jobs) // (4 * workers))
+        for program, data in zip(programs, executor.map(_parse_encoded, jobs, chunksize=chunksize)):
+            if data is not None:
+                program._tree = decode_tree(data)
+                if program.cache:
+                    program.cache.store(program.source, program.source_format, data=data)
+
+
 class CasioPict(CasioItem):
     def __init__(self, name, image_bits):
         super().__init__(name)
@@ -137,12 +243,129 @@ class CasioItemCollection():
     def __init__(self, items):
         self.items = items
         self.program_count = len(self.get_programs())
+        self._programs_by_name = dict()
+        for item in items:
+            self._index(item)
+        self._integer_facts = None
+        self._call_graph = None
+        self._prefetch_thread = None
+        # bumped whenever a program changes, so a prefetch started before
+        # doesn't store facts that may no longer hold
+        self._generation = 0
+        # set by a watcher, which may swap in a new version of a program
+        # while another one that was optimized with (or inlined) the old
+        # one runs
+        self.watched = False
 
 
     def __iter__(self):
         return iter(self.items)
 
 
+    def add(self, item):
+        self.items.append(item)
+        self.program_count = len(self.get_programs())
+        self._index(item)
+        self.forget_optimized_trees()
+
+
+    def _index(self, item):
+        # the first of two programs with the same name is the one run
+        if type(item) is CasioProgram:
+            self._programs_by_name.setdefault(item.name, item)
+
+
+    def get_call_graph(self):
+        '''The calls between the programs parsed so far: see callgraph.py.'''
+        if self._call_graph is None:
+            self._call_graph = CallGraph(self)
+        return self._call_graph
+
+
+    def load_program(self, program):
+        '''
+        Parses what a program about to run may call, then the rest of the
+        programs on a background thread, so they're ready if they're needed
+        and the integer facts can be worked out.
+        '''
+        graph = self.get_call_graph()
+        graph.reachable(program)
+        if self._prefetch_thread is None or not self._prefetch_thread.is_alive():
+            if self._integer_facts is None:
+                self._prefetch_thread = threading.Thread(
+                    target=self._prefetch,
+                    args=(graph, self._generation),
+                    daemon=True
+                )
+                self._prefetch_thread.start()
+
+
+    def _prefetch(self, graph, generation):
+        # callees come right after their callers, the order they're run in
+        for program in self.get_programs():
+            graph.reachable(program)
+        if self.watched:
+            return
+        facts = IntegerFacts(self._parsed_trees())
+        if generation == self._generation:
+            self._integer_facts = facts
+
+
+    def _parsed_trees(self):
+        # programs that don't parse can't run, so they're left out
+        trees = []
+        for program in self.get_programs():
+            try:
+                trees.append(program.tree)
+            except Exception:
+                pass
+        return trees
+
+
+    def get_integer_facts(self):
+        '''
+        What inference.py finds about the vars of all the programs, which
+        share them. None while the programs are still being parsed in the
+        background; until then programs are optimized without them. Also
+        None if the collection is watched, as what holds for all programs
+        may not hold for a new version of one.
+        '''
+        if self.watched:
+            return None
+        if self._integer_facts is None:
+            if self._prefetch_thread is not None and self._prefetch_thread.is_alive():
+                return None
+            self._integer_facts = IntegerFacts(self._parsed_trees())
+        return self._integer_facts
+
+
+    def get_optimized_tree(self, program):
+        # a program inlined into a running one would keep its old version
+        programs = None if self.watched else self._callee_tree
+        return program.get_optimized_tree(self.get_integer_facts(), programs)
+
+
+    def _callee_tree(self, name):
+        # for inlining: a program that isn't there or doesn't parse is
+        # left to fail when it's called
+        program = self.get_program_by_name(name)
+        if program is None:
+            return None
+        try:
+            return program.tree
+        except Exception:
+            return None
+
+
+    def forget_optimized_trees(self):
+        '''To be called when a program changes, which may change what holds for the others.'''
+        self._generation += 1
+        self._integer_facts = None
+        self._call_graph = None
+        for program in self.get_programs():
+            program.forget_optimized_tree()
+
+
     def __len__(self):
         return len(self.items)
 
@@ -151,9 +374,7 @@ class CasioItemCollection():
         '''
         Gets a program by its casio name.
         '''
-        for item in self.items:
-            if type(item) is CasioProgram and item.name == name:
-                return item
+        return self._programs_by_name.get(name)
 
 
     def get_program_by_index(self, index):
@@ -182,9 +403,10 @@ class CasioItemCollection():
 
 
 class G1mFile():
-    def __init__(self, filepath, debug=False):
+    def __init__(self, filepath, debug=False, cache=None):
         self.filepath = filepath
         self.debug = debug
+        self.cache = cache
 
 
     def _read_header(self, fp):
@@ -258,14 +480,13 @@ class G1mFile():
 
     def _read_program(self, item_title, item_data):
         password = item_data[:8]
-        lexer = G1mLexer(item_data[10:], self.filepath)
-        parser = G1mParser(lexer)
-        tree = parser.parse()
-
         program = CasioProgram(
             item_title.partition(b'\x00')[0],
             len(item_data),
-            tree
+            item_data[10:],
+            'g1m',
+            self.filepath,
+            self.cache
         )
         return program
 
@@ -440,18 +661,17 @@ def get_item_name_from_filename(filename):
     return translate_ascii_bytes_to_casio(item_name)
 
 
-def load_program_from_ucb_file(filepath, progam_name):
+def load_program_from_ucb_file(filepath, progam_name, cache=None):
     with open(filepath, 'rb') as fp:
         ucb_data = fp.read()
 
-    lexer = UcbLexer(ucb_data, filepath)
-    parser = UcbParser(lexer)
-    tree = parser.parse()
-
     return CasioProgram(
         progam_name,
         len(ucb_data),
-        tree
+        ucb_data,
+        'ucb',
+        filepath,
+        cache
     )
 
 
@@ -476,14 +696,20 @@ def load_pict_from_ucb_file(filepath, pict_name):
     return CasioPict(pict_name, image_bits)
 
 
-def load_items_from_ucb_dir(dirpath):
+def load_items_from_ucb_dir(dirpath, workers=0, cache=None):
+    '''
+    Loads the programs and picts in a directory. Programs are parsed when
+    first used, or up front in `workers` processes (None for one per core).
+    Trees are kept in `cache` (a treecache.TreeCache) if one is given.
+    '''
     items = []
     for filename in os.listdir(dirpath):
         filepath = os.path.join(dirpath, filename)
         if filename.lower().endswith('.ucb'):
             item = load_program_from_ucb_file(
                 filepath,
-                get_item_name_from_filename(filename)
+                get_item_name_from_filename(filename),
+                cache
             )
         elif filename.lower().endswith('.bmp'):
             item = load_pict_from_ucb_file(
@@ -493,10 +719,20 @@ def load_items_from_ucb_dir(dirpath):
         else:
             continue
         items.append(item)
-    return CasioItemCollection(items)
+    items = CasioItemCollection(items)
+    if workers != 0:
+        parse_programs(items.get_programs(), workers)
+    return items
 
 
-def load_items_from_g1m_file(filepath):
-    g1mfile = G1mFile(filepath, debug=False)
-    items = g1mfile.load()
-    return CasioItemCollection(items)
+def load_items_from_g1m_file(filepath, workers=0, cache=None):
+    '''
+    Loads the items in a G1M file. Programs are parsed when first used,
+    or up front in `workers` processes (None for one per core).
+    Trees are kept in `cache` (a treecache.TreeCache) if one is given.
+    '''
+    g1mfile = G1mFile(filepath, debug=False, cache=cache)
+    items = CasioItemCollection(g1mfile.load())
+    if workers != 0:
+        parse_programs(items.get_programs(), workers)
+    return items
@@ -1,56 +1,26 @@
-import ctypes
-from os.path import join as path_join, dirname
 from random import random as rand_num
 
-import sdl2
-
 from .common import *
 from .loader import CasioProgram, CasioPict
 from .interpreter import Var, VariableRange, MemoryIndex, Label
-from .graphics import setpixel, pxltest, fline, text, locate
-
-SDL_DELAY_MILLIS = 16
-ASPECT_RATIO = 2.0
-
-DEFAULT_CASIO_GETKEY = 0
-SDL_CASIO_KEYMAP = {
-	sdl2.SDLK_UP		: 28,
-	sdl2.SDLK_RIGHT		: 27,
-	sdl2.SDLK_DOWN		: 37,
-	sdl2.SDLK_LEFT		: 38,
-	sdl2.SDLK_RETURN	: 31,
-	sdl2.SDLK_0			: 71,
-	sdl2.SDLK_1			: 72,
-	sdl2.SDLK_2			: 62,
-	sdl2.SDLK_3			: 52,
-	sdl2.SDLK_4			: 73,
-	sdl2.SDLK_5			: 63,
-	sdl2.SDLK_6			: 53,
-	sdl2.SDLK_7			: 74,
-	sdl2.SDLK_8			: 64,
-	sdl2.SDLK_9			: 54,
-	sdl2.SDLK_PERIOD	: 61,
-	sdl2.SDLK_KP_0		: 71,
-	sdl2.SDLK_KP_1		: 72,
-	sdl2.SDLK_KP_2		: 62,
-	sdl2.SDLK_KP_3		: 52,
-	sdl2.SDLK_KP_4		: 73,
-	sdl2.SDLK_KP_5		: 63,
-	sdl2.SDLK_KP_6		: 53,
-	sdl2.SDLK_KP_7		: 74,
-	sdl2.SDLK_KP_8		: 64,
-	sdl2.SDLK_KP_9		: 54,
-	sdl2.SDLK_KP_PERIOD	: 61,
-	sdl2.SDLK_F1		: 79,
-	sdl2.SDLK_F2		: 69,
-	sdl2.SDLK_F3		: 59,
-	sdl2.SDLK_F4		: 49,
-	sdl2.SDLK_F5		: 39,
-	sdl2.SDLK_F6		: 29,
-	sdl2.SDLK_ESCAPE	: 47,
-	sdl2.SDLK_LCTRL		: 48,
-	sdl2.SDLK_RCTRL		: 48
-}
+from .ast import RowIndex, IntRowIndex
+from .graphics import (
+    Screen,
+    load_font,
+    text,
+    locate,
+    GRAPH_RECTS,
+    GRAPH_RECT_DEFAULT,
+    TEXT_RECTS,
+    TEXT_RECT_DEFAULT
+)
+from .display import InterpreterQuitException, DEFAULT_CASIO_GETKEY
+from . import raster
+from .vectorize import compile_expression
+
+# Xmin, Xmax, Xscale, Ymin, Ymax, Yscale
+# one unit per pixel, with y increasing down the screen
+DEFAULT_VIEW_WINDOW = (1, 127, 0, 63, 1, 0)
 
 
 class SubroutineReturnException(Exception):
@@ -65,10 +35,6 @@ class ProgramStopException(Exception):
     pass
 
 
-class InterpreterQuitException(Exception):
-    pass
-
-
 class GotoException(Exception):
     def __init__(self, node):
         super().__init__()
@@ -76,28 +42,76 @@ class GotoException(Exception):
 
 
 class NodeVisitor(object):
+    '''
+    Visits a node with _visit_<class name> or, if there's none and the
+    node has an op, with _visit_<class name>_<op type> (e.g.
+    _visit_BinOp_PLUS). Methods are looked up once per class and op type.
+    '''
+    def __init__(self):
+        # node class -> the method (or op dispatch) that visits it
+        self._visitors = dict()
+
     def _visit(self, node):
-        method_name = '_visit_' + type(node).__name__
-        #print(f'DBG: invoking {method_name}')
-        visitor = getattr(self, method_name, self._generic_visit)
+        try:
+            visitor = self._visitors[type(node)]
+        except KeyError:
+            visitor = self._visitors[type(node)] = self._find_visitor(type(node))
+        #print(f'DBG: invoking {visitor}')
         return visitor(node)
 
+    def _find_visitor(self, cls):
+        visitor = getattr(self, '_visit_' + cls.__name__, None)
+        if visitor is not None:
+            return visitor
+        if 'op' in getattr(cls, '__slots__', ()):
+            return self._op_visitor(cls)
+        return self._generic_visit
+
+    def _op_visitor(self, cls):
+        # op type -> method, for the nodes of one class
+        visitors = dict()
+
+        def visit(node):
+            try:
+                visitor = visitors[node.op.type]
+            except KeyError:
+                op = node.op.type
+                visitor = getattr(self, '_visit_{}_{}'.format(cls.__name__, str(op, 'ascii')), None)
+                if visitor is None:
+                    raise Exception('Unknown {} op type: {}'.format(cls.__name__, op))
+                visitors[op] = visitor
+            return visitor(node)
+
+        return visit
+
     def _generic_visit(self, node):
         raise Exception('No _visit_{} method'.format(type(node).__name__))
 
 
 class CasioMachine(NodeVisitor):
-    def __init__(self, items):
+    def __init__(self, items, display, recorder=None, watcher=None, optimize=True):
+        super().__init__()
         self.items = items
+        # the frontend that presents the screen and reads keys
+        self.display = display
+        # optional FrameRecorder for presented frames
+        self.recorder = recorder
+        # optional watch.UcbDirWatcher that reloads edited programs
+        self.watcher = watcher
+        # run the optimized trees, unless debugging the interpreter itself
+        self.optimize = optimize
 
         self.key = None
+        # compiled Graph Y= expressions, by node
+        self.graph_functions = dict()
 
         # initialize
-        self._initialize_sdl2()
+        self._initialize_screens()
         self._initialize_text()
         self._initialize_vars()
         self._initialize_mats()
         self._initialize_picts()
+        self._initialize_view_window()
 
         self._refresh_screen()
 
@@ -114,217 +128,57 @@ class CasioMachine(NodeVisitor):
     def _initialize_picts(self):
         self.picts = dict()
         for pict in self.items.get_picts():
-            texture = self._create_texture_from_pict(pict)
-            self.picts[pict.num] = texture
+            print(f'Initializing pict: {pict.stringname}')
+            screen = Screen()
+            screen.load_frame(pict.image_bits[:128 * 64].tobytes())
+            self.picts[pict.num] = screen
 
-    def _initialize_sdl2(self):
-        sdl2.SDL_Init(sdl2.SDL_INIT_VIDEO)
+    def _initialize_view_window(self):
+        self._set_view_window(*DEFAULT_VIEW_WINDOW)
 
-        self.window = sdl2.SDL_CreateWindow(
-            b'CASINT: CASIO Basic Interpreter',
-            sdl2.SDL_WINDOWPOS_CENTERED, sdl2.SDL_WINDOWPOS_CENTERED,
-            512, 256, sdl2.SDL_WINDOW_SHOWN | sdl2.SDL_WINDOW_RESIZABLE)
+    def _initialize_screens(self):
+        self.screen_graph = Screen()
+        self.screen_text = Screen()
+        self.current_screen = self.screen_graph
 
-        self.renderer = sdl2.SDL_CreateRenderer(
-            self.window, -1, sdl2.SDL_RENDERER_ACCELERATED)
-
-        sdl2.SDL_RenderSetLogicalSize(self.renderer, 128, 64)
-
-        self.texture_graph = sdl2.SDL_CreateTexture(
-            self.renderer, sdl2.SDL_PIXELFORMAT_RGBA8888,
-            sdl2.SDL_TEXTUREACCESS_TARGET, 128, 64)
-
-        self.texture_text = sdl2.SDL_CreateTexture(
-            self.renderer, sdl2.SDL_PIXELFORMAT_RGBA8888,
-            sdl2.SDL_TEXTUREACCESS_TARGET, 128, 64)
-
-        # for scrolling the text screen
-        self.texture_scroll = sdl2.SDL_CreateTexture(
-            self.renderer, sdl2.SDL_PIXELFORMAT_RGBA8888,
-            sdl2.SDL_TEXTUREACCESS_TARGET, 128, 64)
-
-        # init with a clear screen
-        self._render_begin(self.texture_graph)
-        self._clear_screen()
-        self._render_end()
-
-        self._render_begin(self.texture_text)
-        self._clear_screen()
-        self._render_end()
-
-        self.font_graph, self.font_graph_inverted = self._load_texture('img/font_graph.bmp')
-        self.font_text, self.font_text_inverted = self._load_texture('img/font_text.bmp')
+        self.font_graph = load_font('img/font_graph.bmp', GRAPH_RECTS, GRAPH_RECT_DEFAULT)
+        self.font_text = load_font('img/font_text.bmp', TEXT_RECTS, TEXT_RECT_DEFAULT)
+        self.font_text_inverted = self.font_text.inverted()
 
     def _initialize_text(self):
         self.text_line = 0
 
-    def _create_inverted_texture(self, surface):
-        # copy the pixels in
-        sdl2.SDL_LockSurface(surface)
-        surface_p = ctypes.c_void_p.from_address(surface.contents.pixels)
-        pixelsize = surface.contents.format.contents.BytesPerPixel
-        assert pixelsize == 3
-        bytecount = surface.contents.w * surface.contents.h * pixelsize
-        # create memory for copy of pixel data
-        new_p = (ctypes.c_uint8 * bytecount)()
-        ref_p = ctypes.byref(new_p)
-        ctypes.memmove(
-            ref_p,
-            ctypes.byref(surface_p),
-            bytecount
-        )
-        sdl2.SDL_UnlockSurface(surface)
-
-        # swap pixels
-        m = memoryview(new_p).cast('B')
-        i = 0
-        j = pixelsize
-        while j < bytecount:
-            if m[i:j] == b'\xee\xe8\xe8':
-                m[i:j] = b'\x10\x10\x10'
-            else:
-                m[i:j] = b'\xee\xe8\xe8'
-            i += pixelsize
-            j += pixelsize
-
-        new_surface = sdl2.SDL_CreateRGBSurfaceWithFormatFrom(
-            ref_p,
-            surface.contents.w,
-            surface.contents.h,
-            surface.contents.format.contents.BitsPerPixel,
-            surface.contents.pitch,
-            surface.contents.format.contents.format
-        )
-        texture = sdl2.SDL_CreateTextureFromSurface(self.renderer, new_surface)
-        sdl2.SDL_FreeSurface(new_surface)
-        return texture
-
-    def _load_texture(self, filename):
-        filepath = path_join(dirname(__file__), filename).encode()
-        surface = sdl2.SDL_LoadBMP(filepath)
-        texture = sdl2.SDL_CreateTextureFromSurface(self.renderer, surface)
-        # create a copy of inverted pixels
-        inverted_texture = self._create_inverted_texture(surface)
-        # free the surface
-        sdl2.SDL_FreeSurface(surface)
-        return texture, inverted_texture
-
-
-    def _create_texture_from_pict(self, pict):
-        print(f'Initializing pict: {pict.stringname}')
-
-        width = 128
-        height = 64
-        pixelsize = 3
-        bytecount = width * height * pixelsize
-        assert len(pict.image_bits) * pixelsize >= bytecount
-
-        # create memory for pixel data
-        new_p = (ctypes.c_uint8 * bytecount)()
-        ref_p = ctypes.byref(new_p)
-
-        # set pixels
-        m = memoryview(new_p).cast('B')
-        i = 0
-        j = pixelsize
-        for pixel in pict.image_bits[:width * height]:
-            if pixel:
-                m[i:j] = b'\x10\x10\x10'
-            else:
-                m[i:j] = b'\xee\xe8\xe8'
-            i += pixelsize
-            j += pixelsize
-
-        new_surface = sdl2.SDL_CreateRGBSurfaceWithFormatFrom(
-            ref_p,
-            width,
-            height,
-            8 * pixelsize,
-            width * pixelsize,
-            sdl2.SDL_PIXELFORMAT_BGR24
-        )
-        texture = sdl2.SDL_CreateTextureFromSurface(self.renderer, new_surface)
-        sdl2.SDL_FreeSurface(new_surface)
-        return texture
-
-    def _render_begin(self, texture_target):
-        self.current_texture = texture_target
-        sdl2.SDL_SetRenderTarget(self.renderer, self.current_texture)
-
-    def _render_end(self):
-        sdl2.SDL_SetRenderTarget(self.renderer, None)
-
-    def _set_color(self, is_on):
-        if is_on:
-            sdl2.SDL_SetRenderDrawColor(self.renderer, 0x10, 0x10, 0x10, sdl2.SDL_ALPHA_OPAQUE)
-        else:
-            sdl2.SDL_SetRenderDrawColor(self.renderer, 0xe8, 0xe8, 0xee, sdl2.SDL_ALPHA_OPAQUE)
-
-    def _clear_screen(self):
-        self._set_color(False)
-        sdl2.SDL_RenderClear(self.renderer)
+    def _render_begin(self, screen):
+        # the screen that was drawn to last is the one that's presented
+        self.current_screen = screen
+        return screen
 
     def _refresh_screen(self):
-        sdl2.SDL_RenderCopy(self.renderer, self.current_texture, None, None)
-        sdl2.SDL_RenderPresent(self.renderer)
-
-    def _set_window_title(self, name):
-        window_name = f'{name} - CASINT: CASIO Basic Interpreter'.encode()
-        sdl2.SDL_SetWindowTitle(self.window, window_name)
-
-    def _handle_windowevents(self, event):
-        if event.window.event == sdl2.SDL_WINDOWEVENT_RESIZED:
-            width = event.window.data1
-            height = event.window.data2
-            aspectRatio = float(width) / float(height)
-            if aspectRatio != ASPECT_RATIO:
-                if aspectRatio > ASPECT_RATIO:
-                    width = int(ASPECT_RATIO * float(height))
-                else:
-                    height = int(float(width) / ASPECT_RATIO)
-                sdl2.SDL_SetWindowSize(self.window, width, height)
+        self.display.present(self.current_screen)
+        if self.recorder:
+            self.recorder.capture(self.current_screen.frame())
 
     def _handle_events(self, pump=True, delay=True):
         self._refresh_screen()
         if pump:
-            event = sdl2.SDL_Event()
-            setkey = False
-            while sdl2.SDL_PollEvent(ctypes.byref(event)) != 0:
-                if event.type == sdl2.SDL_QUIT:
-                    raise InterpreterQuitException()
-                elif event.type == sdl2.SDL_WINDOWEVENT:
-                    self._handle_windowevents(event)
-                elif event.type == sdl2.SDL_KEYDOWN:
-                    self.key = event.key.keysym.sym
-                    setkey = True
-            if not setkey:
-                self.key = None
+            self.key = self.display.poll_key()
+            if self.watcher:
+                self.watcher.poll()
         if delay:
-            sdl2.SDL_Delay(SDL_DELAY_MILLIS)
+            self.display.delay()
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        sdl2.SDL_DestroyTexture(self.texture_graph)
-        sdl2.SDL_DestroyTexture(self.texture_text)
-        sdl2.SDL_DestroyTexture(self.texture_scroll)
-        sdl2.SDL_DestroyTexture(self.font_text)
-        sdl2.SDL_DestroyTexture(self.font_text_inverted)
-        sdl2.SDL_DestroyTexture(self.font_graph)
-        sdl2.SDL_DestroyTexture(self.font_graph_inverted)
-        # clean up stored picts
-        for pict in list(self.picts.values()):
-            sdl2.SDL_DestroyTexture(pict)
-        sdl2.SDL_DestroyWindow(self.window)
-        sdl2.SDL_DestroyRenderer(self.renderer)
-        sdl2.SDL_Quit()
+        self.display.close()
 
     def run(self, name):
         program = self.items.get_program_by_name(name)
-        self._set_window_title(program.stringname)
+        self.items.load_program(program)
+        self.display.set_title(program.stringname)
         try:
-            self._visit(program.tree)
+            self._visit(self._program_tree(program))
         except ProgramStopException:
             pass
 
@@ -341,11 +195,14 @@ class CasioMachine(NodeVisitor):
     # Node processing starts here!
     # =========================================================================
 
+    def _program_tree(self, program):
+        return self.items.get_optimized_tree(program) if self.optimize else program.tree
+
     def _run_prog(self, name):
         program = self.items.get_program_by_name(name)
         #print(f'DBG: entering subroutine: {name}')
         try:
-            self._visit(program.tree)
+            self._visit(self._program_tree(program))
         except SubroutineReturnException:
             pass
         #print(f'DBG: returned from subroutine: {name}')
@@ -353,41 +210,59 @@ class CasioMachine(NodeVisitor):
     def _save_pict(self, num):
         pict = self.picts.get(num)
         if not pict:
-            pict = sdl2.SDL_CreateTexture(
-                self.renderer, sdl2.SDL_PIXELFORMAT_RGBA8888,
-                sdl2.SDL_TEXTUREACCESS_TARGET, 128, 64)
+            pict = Screen()
             self.picts[num] = pict
-        # render current texture to pict
-        sdl2.SDL_SetRenderTarget(self.renderer, pict)
-        sdl2.SDL_RenderCopy(self.renderer, self.texture_graph, None, None)
-        sdl2.SDL_SetRenderTarget(self.renderer, None)
+        pict.copy_from(self.screen_graph)
 
     def _load_pict(self, num):
         pict = self.picts[num]
-        # render pict to current texture
-        self._render_begin(self.texture_graph)
-        sdl2.SDL_RenderCopy(self.renderer, pict, None, None)
-        self._render_end()
+        self._render_begin(self.screen_graph).copy_from(pict)
+
+    def _set_view_window(self, xmin, xmax, xscale, ymin, ymax, yscale):
+        if xmin == xmax or ymin == ymax:
+            raise Exception(
+                f'Invalid ViewWindow: {xmin}, {xmax}, {xscale},'
+                f' {ymin}, {ymax}, {yscale}'
+            )
+        self.view_window = (xmin, xmax, xscale, ymin, ymax, yscale)
+        # precompute the world-to-pixel transform
+        self.view_transform = raster.view_transform(xmin, xmax, ymin, ymax)
+
+    def _draw_spans(self, spans):
+        self._render_begin(self.screen_graph).fill_spans(spans)
+        self._handle_events(pump=False)
+
+    def _graph_y(self, expr):
+        fn = self.graph_functions.get(expr)
+        if fn is None:
+            fn = compile_expression(expr, b'X')
+            self.graph_functions[expr] = fn
+        # one x value per screen column
+        columns = list(range(1, 128))
+        xs = raster.column_xs(self.view_transform, columns)
+        rows = raster.to_rows(self.view_transform, fn(self, xs))
+        # connect the defined points; undefined values break the line
+        spans = []
+        points = []
+        for column, row in zip(columns, rows):
+            if row is not None:
+                points.append((column, row))
+            else:
+                spans.extend(raster.polyline(points))
+                points = []
+        spans.extend(raster.polyline(points))
+        self._draw_spans(spans)
 
     def _locate_out(self, message):
         # todo: wrap lines that are long
+        screen = self._render_begin(self.screen_text)
         if self.text_line > 7:
-            # it's scroll time! Save the current texture
-            sdl2.SDL_SetRenderTarget(self.renderer, self.texture_scroll)
-            sdl2.SDL_RenderCopy(self.renderer, self.texture_text, None, None)
-            # wipe the current texture
-            self._render_begin(self.texture_text)
-            self._clear_screen()
-            # write the bottom of the scrolled texture to the top of out text screen
-            src = sdl2.SDL_Rect(0, 8, 128, 56)
-            dst = sdl2.SDL_Rect(0, 0, 128, 56)
-            sdl2.SDL_RenderCopy(self.renderer, self.texture_scroll, src, dst)
-            locate(self.renderer, self.font_text, 1, 7, message)
+            # it's scroll time! Move everything up a line
+            screen.scroll_up(8)
+            locate(screen, self.font_text, 1, 7, message)
         else:
-            self._render_begin(self.texture_text)
-            locate(self.renderer, self.font_text, 1, self.text_line, message)
+            locate(screen, self.font_text, 1, self.text_line, message)
             self.text_line += 1
-        self._render_end()
 
     def _assign(self, value, node):
         if type(node) is Var:
@@ -408,6 +283,14 @@ class CasioMachine(NodeVisitor):
             else:
                 raise Exception('Unknown memory index assignment: {}'.format(node.left.op.type))
 
+        elif type(node) is RowIndex:
+            row = self._visit(node.row)
+            row[int(self._visit(node.index)-1)] = value
+
+        elif type(node) is IntRowIndex:
+            row = self._visit(node.row)
+            row[self._visit(node.index)-1] = value
+
         else:
             raise Exception('Unknown variable assignment node: {}'.format(type(node).__name__))
 
@@ -423,6 +306,12 @@ class CasioMachine(NodeVisitor):
             else:
                 raise Exception('Unknown memory index retrieval: {}'.format(node.left.op.type))
 
+        elif type(node) is RowIndex:
+            return self._visit_RowIndex(node)
+
+        elif type(node) is IntRowIndex:
+            return self._visit_IntRowIndex(node)
+
         else:
             raise Exception('Unknown variable retrieval node: {}'.format(type(node).__name__))
 
@@ -432,8 +321,7 @@ class CasioMachine(NodeVisitor):
 
     def _getkey(self):
         self._handle_events()
-        casio_key = SDL_CASIO_KEYMAP.get(self.key, DEFAULT_CASIO_GETKEY)
-        return casio_key
+        return self.key if self.key is not None else DEFAULT_CASIO_GETKEY
 
     def _run_statements(self, statements):
         goto = None
@@ -477,167 +365,160 @@ class CasioMachine(NodeVisitor):
         # comments don't get interpreted
         pass
 
-    def _visit_SenaryBuiltin(self, node):
-        if node.op.type == VIEWWINDOW:
-            # check that it matches our implementation
-            assert self._visit(node.arg1) == 1
-            assert self._visit(node.arg2) == 127
-            assert self._visit(node.arg3) == 0
-            assert self._visit(node.arg4) == 63
-            assert self._visit(node.arg5) == 1
-            assert self._visit(node.arg6) == 0
-        else:
-            raise Exception('Unknown SenaryBuiltin op type: {}'.format(node.op.type))
-
-    def _visit_QuaternaryBuiltin(self, node):
-        if node.op.type == FLINE:
-            x0 = self._visit(node.arg1)
-            y0 = self._visit(node.arg2)
-            x1 = self._visit(node.arg3)
-            y1 = self._visit(node.arg4)
-            self._render_begin(self.texture_graph)
-            self._set_color(True)
-            fline(self.renderer, int(x0), int(y0), int(x1), int(y1))
-            self._render_end()
-            self._handle_events(pump=False)
-        else:
-            raise Exception('Unknown QuaternaryBuiltin op type: {}'.format(node.op.type))
-
-    def _visit_TernaryBuiltin(self, node):
-        if node.op.type == TEXT:
-            y = self._visit(node.arg1)
-            x = self._visit(node.arg2)
-            s = self._visit(node.arg3)
-            if type(s) is not bytes:
-                if type(s) is float and s.is_integer():
-                    # don't print decimals
-                    s = int(s)
-                s = bytes(str(s), 'ascii')
-            self._render_begin(self.texture_graph)
-            text(self.renderer, self.font_graph, int(x), int(y), s)
-            self._render_end()
-            self._handle_events(pump=False)
-        elif node.op.type == LOCATE:
-            x = self._visit(node.arg1)
-            y = self._visit(node.arg2)
-            s = self._visit(node.arg3)
-            if type(s) is not bytes:
-                if type(s) is float and s == int(s):
-                    # don't print decimals
-                    s = int(s)
-                s = bytes(str(s), 'ascii')
-            self._render_begin(self.texture_text)
-            locate(self.renderer, self.font_text, int(x), int(y), s)
-            self._render_end()
-            self._handle_events(pump=False)
-        else:
-            raise Exception('Unknown TernaryBuiltin op type: {}'.format(node.op.type))
-
-    def _visit_BinaryBuiltin(self, node):
-        if node.op.type == PXLON:
-            y = self._visit(node.arg1)
-            x = self._visit(node.arg2)
-            self._render_begin(self.texture_graph)
-            self._set_color(True)
-            setpixel(self.renderer, int(x), int(y))
-            self._render_end()
-            self._handle_events(pump=False)
-        elif node.op.type == PXLOFF:
-            y = self._visit(node.arg1)
-            x = self._visit(node.arg2)
-            self._render_begin(self.texture_graph)
-            self._set_color(False)
-            setpixel(self.renderer, int(x), int(y))
-            self._render_end()
-            self._handle_events(pump=False)
-        else:
-            raise Exception('Unknown BinaryBuiltin op type: {}'.format(node.op.type))
-
-    def _visit_BinaryFunc(self, node):
-        if node.op.type == PXLTEST:
-            y = self._visit(node.arg1)
-            x = self._visit(node.arg2)
-            self._render_begin(self.texture_graph)
-            is_lit = pxltest(self.renderer, int(x), int(y))
-            self._render_end()
-            return 1 if is_lit else 0
-        else:
-            raise Exception('Unknown BinaryFunc op type: {}'.format(node.op.type))
-
-    def _visit_UnaryBuiltin(self, node):
-        if node.op.type == HORIZONTAL:
-            y = self._visit(node.arg1)
-            self._render_begin(self.texture_graph)
-            self._set_color(True)
-            fline(self.renderer, 1, int(y), 127, int(y))
-            self._render_end()
-        elif node.op.type == PROG:
-            name = self._visit(node.arg1)
-            self._run_prog(name)
-        elif node.op.type == STOPICT:
-            num = self._visit(node.arg1)
-            self._save_pict(int(num))
-        elif node.op.type == RCLPICT:
-            num = self._visit(node.arg1)
-            self._load_pict(int(num))
-        elif node.op.type == ISZ:
-            # NB: this is an incomplete impl!
-            self._assign(self._retrieve(node.arg1) + 1, node.arg1)
-        elif node.op.type == DSZ:
-            # NB: this is an incomplete impl!
-            self._assign(self._retrieve(node.arg1) - 1, node.arg1)
-        elif node.op.type == STRING:
-            s = self._visit(node.arg1)
-            self._locate_out(s)
-        else:
-            raise Exception('Unknown UnaryBuiltin op type: {}'.format(node.op.type))
-
-    def _visit_UnaryFunc(self, node):
-        if node.op.type == INTG:
-            value = self._visit(node.arg1)
-            return float(int(value))
-        elif node.op.type == FRAC:
-            value = self._visit(node.arg1)
-            return float(value - int(value))
-        else:
-            raise Exception('Unknown UnaryFunc op type: {}'.format(node.op.type))
-
-    def _visit_KeywordBuiltin(self, node):
-        if node.op.type == BREAK:
-            raise ControlLoopBreakException()
-        elif node.op.type == RETURN:
-            raise SubroutineReturnException()
-        elif node.op.type == STOP:
-            raise ProgramStopException()
-        else:
-            raise Exception('Unknown KeywordBuiltin op type: {}'.format(node.op.type))
-
-    def _visit_NullaryBuiltin(self, node):
-        if node.op.type == CLS:
-            self._render_begin(self.texture_graph)
-            self._clear_screen()
-            self._render_end()
-        elif node.op.type == CLRTEXT:
-            self._render_begin(self.texture_text)
-            self._clear_screen()
-            self.text_line = 1
-            self._render_end()
-        elif node.op.type == BREAK:
-            raise ControlLoopBreakException()
-        elif node.op.type == RETURN:
-            raise SubroutineReturnException()
-        elif node.op.type == STOP:
-            raise ProgramStopException()
-        else:
-            raise Exception('Unknown NullaryBuiltin op type: {}'.format(node.op.type))
+    def _visit_SenaryBuiltin_VIEWWINDOW(self, node):
+        self._set_view_window(
+            self._visit(node.arg1),
+            self._visit(node.arg2),
+            self._visit(node.arg3),
+            self._visit(node.arg4),
+            self._visit(node.arg5),
+            self._visit(node.arg6)
+        )
 
-    def _visit_NullaryFunc(self, node):
-        if node.op.type == GETKEY:
-            return self._getkey()
-        elif node.op.type == RANDNUM:
-            return float(rand_num())
-        else:
-            raise Exception('Unknown NullaryFunc op type: {}'.format(node.op.type))
+    def _visit_QuaternaryBuiltin_FLINE(self, node):
+        x0 = self._visit(node.arg1)
+        y0 = self._visit(node.arg2)
+        x1 = self._visit(node.arg3)
+        y1 = self._visit(node.arg4)
+        x0, y0 = raster.to_pixel(self.view_transform, x0, y0)
+        x1, y1 = raster.to_pixel(self.view_transform, x1, y1)
+        self._draw_spans(raster.line(x0, y0, x1, y1))
+
+    def _visit_TernaryBuiltin_TEXT(self, node):
+        y = self._visit(node.arg1)
+        x = self._visit(node.arg2)
+        s = self._visit(node.arg3)
+        if type(s) is not bytes:
+            if type(s) is float and s.is_integer():
+                # don't print decimals
+                s = int(s)
+            s = bytes(str(s), 'ascii')
+        screen = self._render_begin(self.screen_graph)
+        text(screen, self.font_graph, int(x), int(y), s)
+        self._handle_events(pump=False)
+
+    def _visit_TernaryBuiltin_CIRCLE(self, node):
+        x = self._visit(node.arg1)
+        y = self._visit(node.arg2)
+        r = self._visit(node.arg3)
+        x, y = raster.to_pixel(self.view_transform, x, y)
+        rx, ry = raster.to_radii(self.view_transform, r)
+        self._draw_spans(raster.ellipse(x, y, rx, ry))
+
+    def _visit_TernaryBuiltin_LOCATE(self, node):
+        x = self._visit(node.arg1)
+        y = self._visit(node.arg2)
+        s = self._visit(node.arg3)
+        if type(s) is not bytes:
+            if type(s) is float and s == int(s):
+                # don't print decimals
+                s = int(s)
+            s = bytes(str(s), 'ascii')
+        screen = self._render_begin(self.screen_text)
+        locate(screen, self.font_text, int(x), int(y), s)
+        self._handle_events(pump=False)
+
+    def _visit_BinaryBuiltin_PXLON(self, node):
+        y = self._visit(node.arg1)
+        x = self._visit(node.arg2)
+        self._render_begin(self.screen_graph).set_pixel(int(x), int(y), True)
+        self._handle_events(pump=False)
+
+    def _visit_BinaryBuiltin_PXLOFF(self, node):
+        y = self._visit(node.arg1)
+        x = self._visit(node.arg2)
+        self._render_begin(self.screen_graph).set_pixel(int(x), int(y), False)
+        self._handle_events(pump=False)
+
+    def _visit_BinaryBuiltin_PLOTON(self, node):
+        x = self._visit(node.arg1)
+        y = self._visit(node.arg2)
+        x, y = raster.to_pixel(self.view_transform, x, y)
+        self._draw_spans(raster.point(x, y))
+
+    def _visit_BinaryFunc_PXLTEST(self, node):
+        y = self._visit(node.arg1)
+        x = self._visit(node.arg2)
+        is_lit = self._render_begin(self.screen_graph).test_pixel(int(x), int(y))
+        return 1 if is_lit else 0
+
+    def _visit_UnaryBuiltin_HORIZONTAL(self, node):
+        y = self._visit(node.arg1)
+        row = raster.to_row(self.view_transform, y)
+        self._draw_spans(raster.hline(1, 127, row))
+
+    def _visit_UnaryBuiltin_VERTICAL(self, node):
+        x = self._visit(node.arg1)
+        column = raster.to_column(self.view_transform, x)
+        self._draw_spans(raster.vline(column, 1, 63))
+
+    def _visit_UnaryBuiltin_GRAPHYEQ(self, node):
+        self._graph_y(node.arg1)
+
+    def _visit_UnaryBuiltin_PROG(self, node):
+        name = self._visit(node.arg1)
+        self._run_prog(name)
+
+    def _visit_UnaryBuiltin_STOPICT(self, node):
+        num = self._visit(node.arg1)
+        self._save_pict(int(num))
+
+    def _visit_UnaryBuiltin_RCLPICT(self, node):
+        num = self._visit(node.arg1)
+        self._load_pict(int(num))
+
+    def _visit_UnaryBuiltin_ISZ(self, node):
+        # NB: this is an incomplete impl!
+        self._assign(self._retrieve(node.arg1) + 1, node.arg1)
+
+    def _visit_UnaryBuiltin_DSZ(self, node):
+        # NB: this is an incomplete impl!
+        self._assign(self._retrieve(node.arg1) - 1, node.arg1)
+
+    def _visit_UnaryBuiltin_STRING(self, node):
+        s = self._visit(node.arg1)
+        self._locate_out(s)
+
+    def _visit_UnaryFunc_INTG(self, node):
+        value = self._visit(node.arg1)
+        return float(int(value))
+
+    def _visit_UnaryFunc_FRAC(self, node):
+        value = self._visit(node.arg1)
+        return float(value - int(value))
+
+    def _visit_KeywordBuiltin_BREAK(self, node):
+        raise ControlLoopBreakException()
+
+    def _visit_KeywordBuiltin_RETURN(self, node):
+        raise SubroutineReturnException()
+
+    def _visit_KeywordBuiltin_STOP(self, node):
+        raise ProgramStopException()
+
+    def _visit_NullaryBuiltin_CLS(self, node):
+        self._render_begin(self.screen_graph).clear()
+
+    def _visit_NullaryBuiltin_CLRTEXT(self, node):
+        self._render_begin(self.screen_text).clear()
+        self.text_line = 1
+
+    def _visit_NullaryBuiltin_COORDOFF(self, node):
+        # coordinates, grid, axes and labels are never drawn
+        pass
+
+    _visit_NullaryBuiltin_GRIDOFF = _visit_NullaryBuiltin_COORDOFF
+    _visit_NullaryBuiltin_AXESOFF = _visit_NullaryBuiltin_COORDOFF
+    _visit_NullaryBuiltin_LABELOFF = _visit_NullaryBuiltin_COORDOFF
+    _visit_NullaryBuiltin_BREAK = _visit_KeywordBuiltin_BREAK
+    _visit_NullaryBuiltin_RETURN = _visit_KeywordBuiltin_RETURN
+    _visit_NullaryBuiltin_STOP = _visit_KeywordBuiltin_STOP
+
+    def _visit_NullaryFunc_GETKEY(self, node):
+        return self._getkey()
+
+    def _visit_NullaryFunc_RANDNUM(self, node):
+        return float(rand_num())
 
     def _visit_Num(self, node):
         return node.value
@@ -663,59 +544,65 @@ class CasioMachine(NodeVisitor):
         else:
             raise Exception('Unknown memory index initialization: {}'.format(node.mem_struct.op.type))
 
-    def _visit_BinOp(self, node):
-        if node.op.type == PLUS:
-            return self._visit(node.left) + self._visit(node.right)
-        elif node.op.type == MINUS:
-            return self._visit(node.left) - self._visit(node.right)
-        elif node.op.type == MUL:
-            return self._visit(node.left) * self._visit(node.right)
-        elif node.op.type == DIV:
-            return self._visit(node.left) / self._visit(node.right)
-        elif node.op.type == POWER:
-            return self._visit(node.left) ** self._visit(node.right)
-        elif node.op.type == EQ:
-            l = self._visit(node.left)
-            r = self._visit(node.right)
-            return 1 if l == r else 0
-        elif node.op.type == NEQ:
-            l = self._visit(node.left)
-            r = self._visit(node.right)
-            return 1 if l != r else 0
-        elif node.op.type == LT:
-            l = self._visit(node.left)
-            r = self._visit(node.right)
-            return 1 if l < r else 0
-        elif node.op.type == GT:
-            l = self._visit(node.left)
-            r = self._visit(node.right)
-            return 1 if l > r else 0
-        elif node.op.type == LTE:
-            l = self._visit(node.left)
-            r = self._visit(node.right)
-            return 1 if l <= r else 0
-        elif node.op.type == GTE:
-            l = self._visit(node.left)
-            r = self._visit(node.right)
-            return 1 if l >= r else 0
-        elif node.op.type == AND:
-            l = self._visit(node.left)
-            r = self._visit(node.right)
-            b = bool(l) and bool(r)
-            return 1 if b else 0
-        elif node.op.type == OR:
-            l = self._visit(node.left)
-            r = self._visit(node.right)
-            b = bool(l) or bool(r)
-            return 1 if b else 0
-        else:
-            raise Exception('Unknown Bin op type: {}'.format(node.op.type))
+    def _visit_BinOp_PLUS(self, node):
+        return self._visit(node.left) + self._visit(node.right)
 
-    def _visit_UnaryOp(self, node):
-        if node.op.type == MINUS:
-            return -1 * self._visit(node.expr)
-        else:
-            raise Exception('Unknown Unary op type: {}'.format(node.op.type))
+    def _visit_BinOp_MINUS(self, node):
+        return self._visit(node.left) - self._visit(node.right)
+
+    def _visit_BinOp_MUL(self, node):
+        return self._visit(node.left) * self._visit(node.right)
+
+    def _visit_BinOp_DIV(self, node):
+        return self._visit(node.left) / self._visit(node.right)
+
+    def _visit_BinOp_POWER(self, node):
+        return self._visit(node.left) ** self._visit(node.right)
+
+    def _visit_BinOp_EQ(self, node):
+        l = self._visit(node.left)
+        r = self._visit(node.right)
+        return 1 if l == r else 0
+
+    def _visit_BinOp_NEQ(self, node):
+        l = self._visit(node.left)
+        r = self._visit(node.right)
+        return 1 if l != r else 0
+
+    def _visit_BinOp_LT(self, node):
+        l = self._visit(node.left)
+        r = self._visit(node.right)
+        return 1 if l < r else 0
+
+    def _visit_BinOp_GT(self, node):
+        l = self._visit(node.left)
+        r = self._visit(node.right)
+        return 1 if l > r else 0
+
+    def _visit_BinOp_LTE(self, node):
+        l = self._visit(node.left)
+        r = self._visit(node.right)
+        return 1 if l <= r else 0
+
+    def _visit_BinOp_GTE(self, node):
+        l = self._visit(node.left)
+        r = self._visit(node.right)
+        return 1 if l >= r else 0
+
+    def _visit_BinOp_AND(self, node):
+        l = self._visit(node.left)
+        r = self._visit(node.right)
+        b = bool(l) and bool(r)
+        return 1 if b else 0
+
+    def _visit_BinOp_OR(self, node):
+        l = self._visit(node.left)
+        r = self._visit(node.right)
+        b = bool(l) or bool(r)
+        return 1 if b else 0
+
+    def _visit_UnaryOp_MINUS(self, node):
+        return -1 * self._visit(node.expr)
 
     def _visit_ForTo(self, node):
         currentvalue = self._visit(node.start)
@@ -748,6 +635,24 @@ class CasioMachine(NodeVisitor):
             else:
                 check_fn = lambda x: x >= endvalue
 
+        if type(node.var) is Var:
+            # the usual case, without going through _assign and _retrieve
+            vars = self.vars
+            name = node.var.value
+            vars[name] = currentvalue
+            alive = check_fn(currentvalue)
+            while alive:
+                try:
+                    self._run_statements(node.children)
+                except ControlLoopBreakException:
+                    break
+
+                newvalue = vars[name] + stepvalue
+                alive = check_fn(newvalue)
+                if alive:
+                    vars[name] = newvalue
+            return
+
         self._assign(currentvalue, node.var)
         alive = check_fn(currentvalue)
         while alive:
@@ -761,6 +666,48 @@ class CasioMachine(NodeVisitor):
             if alive:
                 self._assign(newvalue, node.var)
 
+    def _visit_CountedForTo(self, node):
+        # the counter is only written here, so it needn't be read back
+        loop = node.loop
+        vars = self.vars
+        name = loop.var.value
+        value = loop.start.value
+        step = loop.step.value
+        children = loop.children
+        for _ in range(node.count):
+            vars[name] = value
+            try:
+                self._run_statements(children)
+            except ControlLoopBreakException:
+                break
+            value += step
+
+    def _visit_HoistScope(self, node):
+        for hoisted in node.hoisted:
+            hoisted.value = None
+        self._visit(node.loop)
+
+    def _visit_Hoisted(self, node):
+        value = node.value
+        if value is None:
+            value = node.value = self._visit(node.expr)
+        return value
+
+    def _visit_MatRow(self, node):
+        x = self._visit(node.index)
+        return self.mats[node.mem_struct.value][int(x-1)]
+
+    def _visit_RowIndex(self, node):
+        row = self._visit(node.row)
+        return row[int(self._visit(node.index)-1)]
+
+    def _visit_IntMatRow(self, node):
+        return self.mats[node.mem_struct.value][self._visit(node.index)-1]
+
+    def _visit_IntRowIndex(self, node):
+        row = self._visit(node.row)
+        return row[self._visit(node.index)-1]
+
     def _visit_IfThen(self, node):
         if self._eval_bool(node.condition):
             self._run_statements(node.if_clause)
@@ -784,6 +731,51 @@ class CasioMachine(NodeVisitor):
             except ControlLoopBreakException:
                 break
 
+    def _visit_Shared(self, node):
+        return node.value
+
+    def _visit_SharedScope(self, node):
+        for shared in node.shared:
+            shared.value = self._visit(shared.expr)
+        return self._visit(node.expr)
+
+    def _visit_InlinedProg(self, node):
+        # as _run_prog, without looking the program up
+        if node.returns:
+            try:
+                self._run_statements(node.children)
+            except SubroutineReturnException:
+                pass
+        else:
+            self._run_statements(node.children)
+
+    def _visit_SetVar(self, node):
+        self.vars[node.name] = node.value
+
+    def _visit_AddToVar(self, node):
+        vars = self.vars
+        vars[node.name] = vars[node.name] + node.step
+
+    def _visit_GetkeyToVar(self, node):
+        self.vars[node.name] = self._getkey()
+
+    def _visit_AssignVar(self, node):
+        self.vars[node.name] = self._visit(node.expr)
+
+    def _visit_MatElement(self, node):
+        x = self._visit(node.row)
+        y = self._visit(node.column)
+        return self.mats[node.name][int(x-1)][int(y-1)]
+
+    def _visit_VarCompare(self, node):
+        return 1 if node.compare(self.vars[node.name], node.value) else 0
+
+    def _visit_IfVarCompare(self, node):
+        if node.compare(self.vars[node.name], node.value):
+            self._run_statements(node.source.if_clause)
+        else:
+            self._run_statements(node.source.else_clause)
+
     def _visit_Label(self, node):
         pass
 
@@ -0,0 +1,694 @@
+"""
+Optimizes the trees the machine runs. It works on a copy, so the parsed
+tree, which is what gets written back out, keeps its comments and form.
+
+- constant BinOp, UnaryOp and UnaryFunc (Intg, Frac) subtrees are folded
+  into a Num, computed the way the machine computes them;
+- an If with a constant condition is replaced by the branch that runs;
+- Comments are dropped;
+- a pure subexpression that occurs more than once in a statement (or in
+  a condition) is evaluated once, through Shared nodes;
+- a For loop with constant bounds whose body never writes its counter
+  becomes a CountedForTo;
+- in loops that don't call Prog, subexpressions that the loop doesn't
+  change are Hoisted, and Mat A[I, J] with I unchanged looks up the row
+  once (a RowIndex);
+- a Prog "NAME" of a small program that can't end up calling itself is
+  replaced by its statements (an InlinedProg), with Returns rewritten
+  into Ifs where they aren't in a loop;
+- last, the most common shapes of statements and expressions, such as
+  A+1->A, Getkey->K and If K=31, are replaced by fused nodes that run
+  in one visit.
+
+Given the IntegerFacts of the program's collection (see inference.py),
+For loops over its counters count with ints, and mat indices that are
+always ints aren't converted.
+"""
+import math
+import operator
+
+from .common import *
+from .ast import *
+from .callgraph import prog_callees
+from .interpreter import Token
+
+# the largest exponent that is folded, so that e.g. 9^9^9 isn't computed
+# while loading a program
+MAX_FOLDED_EXPONENT = 64
+
+# token type -> fn(left, right), as the machine evaluates them
+BINARY_FOLDS = {
+	PLUS	: lambda l, r: l + r,
+	MINUS	: lambda l, r: l - r,
+	MUL		: lambda l, r: l * r,
+	DIV		: lambda l, r: l / r,
+	POWER	: lambda l, r: l ** r,
+	EQ		: lambda l, r: 1 if l == r else 0,
+	NEQ		: lambda l, r: 1 if l != r else 0,
+	LT		: lambda l, r: 1 if l < r else 0,
+	GT		: lambda l, r: 1 if l > r else 0,
+	LTE		: lambda l, r: 1 if l <= r else 0,
+	GTE		: lambda l, r: 1 if l >= r else 0,
+	AND		: lambda l, r: 1 if bool(l) and bool(r) else 0,
+	OR		: lambda l, r: 1 if bool(l) or bool(r) else 0
+}
+
+UNARY_FOLDS = {
+	MINUS	: lambda a: -1 * a,
+	INTG	: lambda a: float(int(a)),
+	FRAC	: lambda a: float(a - int(a))
+}
+
+# node attributes that hold statements
+STATEMENT_LISTS = {
+	Program		: ('children',),
+	IfThen		: ('if_clause', 'else_clause'),
+	ForTo		: ('children',),
+	WhileLoop	: ('children',),
+	DoLpWhile	: ('children',),
+	InlinedProg	: ('children',)
+}
+
+# statements whose condition is evaluated on its own, maybe many times
+CONDITIONAL_STATEMENTS = (IfThen, WhileLoop, DoLpWhile)
+
+LOOP_STATEMENTS = (ForTo, WhileLoop, DoLpWhile)
+
+# statements that aren't evaluated as a whole, or whose expressions
+# aren't evaluated once per run (Graph Y= is a function of X)
+UNSHARED_STATEMENTS = (ForTo, Label, Goto, SpecialDebug)
+
+# the nodes worth evaluating once
+SHAREABLE_NODES = (BinOp, UnaryOp, UnaryFunc, BinaryFunc, MemoryIndex)
+
+# nodes that are assigned to when they're a statement's own argument
+TARGET_NODES = (Var, VariableRange, MemoryIndex, MemoryStructure)
+
+# the most iterations a For loop is counted in advance for
+MAX_COUNTED_ITERATIONS = 1 << 16
+
+# the nodes worth hoisting out of a loop, if they don't change in it
+# (not PxlTest, which reads the screen that the loop may draw on)
+HOISTABLE_NODES = (BinOp, UnaryOp, UnaryFunc, MemoryIndex)
+
+# leaves whose value is the same every time
+CONSTANT_NODES = (Num, StringLit)
+
+# the most nodes a program called with Prog can have to be inlined
+MAX_INLINED_NODES = 256
+
+# token type -> fn(var, value), for a VarCompare
+COMPARISONS = {
+	EQ	: operator.eq,
+	NEQ	: operator.ne,
+	LT	: operator.lt,
+	GT	: operator.gt,
+	LTE	: operator.le,
+	GTE	: operator.ge
+}
+
+
+def optimize_tree(tree, facts=None, programs=None):
+    """
+    Returns an optimized copy of a program tree, for running. Prog calls
+    are inlined given programs, a fn(name) that returns the tree of the
+    program with that name, or None if it can't be run.
+    """
+    tree = _Optimizer(facts, programs).node(tree)
+    return _Fuser().node(tree)
+
+
+def _fold(fn, *args):
+    try:
+        value = fn(*args)
+    except (ArithmeticError, ValueError, TypeError):
+        # e.g. a division by zero: leave it to be raised when it runs
+        return None
+    if type(value) is float and not math.isfinite(value):
+        return None
+    if type(value) not in (int, float):
+        # e.g. a complex root of a negative number
+        return None
+    return Num(Token(NUMBER, value))
+
+
+class _Optimizer():
+    def __init__(self, facts, programs):
+        self.facts = facts
+        self.programs = programs
+        # program name -> whether it may end up calling itself
+        self.recursive = dict()
+
+    def statements(self, nodes):
+        results = []
+        for node in nodes:
+            if type(node) is Comment:
+                continue
+            node = self.statement(node)
+            if type(node) is list:
+                results.extend(node)
+            else:
+                results.append(node)
+        return results
+
+    def statement(self, node):
+        """Returns the optimized statement, or a list of them to put in its place."""
+        if type(node) is UnaryBuiltin and node.op.type == PROG and self.programs:
+            node = self.inline(node) or node
+        node = self.node(node)
+        cls = type(node)
+
+        if cls is IfThen and type(node.condition) is Num:
+            if node.condition.value:
+                branch, node.else_clause = node.if_clause, []
+            else:
+                branch, node.if_clause = node.else_clause, []
+            # a Label can only be jumped to from its own list
+            if not any(type(child) is Label for child in branch):
+                return branch
+            return node
+
+        if cls in CONDITIONAL_STATEMENTS:
+            node.condition = self.share(node.condition, set())
+        if cls in LOOP_STATEMENTS:
+            return self.loop(node)
+        if cls in STATEMENT_LISTS or cls in UNSHARED_STATEMENTS:
+            return node
+        if cls is UnaryBuiltin and node.op.type == GRAPHYEQ:
+            return node
+        # the statement's own var arguments may be assigned to
+        fixed = set(
+            id(child) for child in iter_child_nodes(node)
+            if type(child) in TARGET_NODES and not (cls is Assign and child is node.expr)
+        )
+        fixed.add(id(node))
+        return self.share(node, fixed)
+
+    def node(self, node):
+        """Returns a folded copy of a node."""
+        cls = type(node)
+        new = cls.__new__(cls)
+        lists = STATEMENT_LISTS.get(cls, ())
+        for name in cls.__slots__:
+            value = getattr(node, name)
+            if name in lists:
+                value = self.statements(value)
+            else:
+                value = self.value(value)
+            setattr(new, name, value)
+        return self.fold(new)
+
+    def value(self, value):
+        if isinstance(value, AST):
+            return self.node(value)
+        if isinstance(value, list):
+            return [self.value(item) for item in value]
+        if isinstance(value, tuple):
+            return tuple(self.value(item) for item in value)
+        return value
+
+    def fold(self, node):
+        cls = type(node)
+        if cls is BinOp:
+            if type(node.left) is Num and type(node.right) is Num:
+                if node.op.type == POWER and abs(node.right.value) > MAX_FOLDED_EXPONENT:
+                    return node
+                fn = BINARY_FOLDS.get(node.op.type)
+                if fn:
+                    return _fold(fn, node.left.value, node.right.value) or node
+        elif cls is UnaryOp:
+            if type(node.expr) is Num:
+                fn = UNARY_FOLDS.get(node.op.type)
+                if fn:
+                    return _fold(fn, node.expr.value) or node
+        elif cls is UnaryFunc:
+            if type(node.arg1) is Num:
+                fn = UNARY_FOLDS.get(node.op.type)
+                if fn:
+                    return _fold(fn, node.arg1.value) or node
+        return node
+
+    def inline(self, node):
+        """
+        Returns an InlinedProg of the unoptimized statements of the program
+        a Prog calls, or None if the call has to stay.
+        """
+        if type(node.arg1) is not StringLit:
+            return None
+        name = node.arg1.value
+        tree = self.programs(name)
+        if tree is None or self.is_recursive(name):
+            return None
+        if _count_nodes(tree) > MAX_INLINED_NODES:
+            return None
+        labels = set()
+        gotos = set()
+        for child in _walk(tree):
+            if type(child) is Label:
+                labels.add(child.op.value)
+            elif type(child) is Goto:
+                gotos.add(child.op.value)
+        if gotos - labels:
+            # a Goto to a label of the caller, or one that isn't there
+            return None
+        children = tree.children
+        if _has_return(tree) and not labels:
+            # a Goto could jump past where a Return was
+            ended = _end_at_returns(children)
+            if ended is not None and _count_nodes(ended) <= MAX_INLINED_NODES:
+                children = ended
+        return InlinedProg(name, children, _has_return(children))
+
+    def is_recursive(self, name):
+        result = self.recursive.get(name)
+        if result is None:
+            # whether name is reached going down the calls from it
+            result = False
+            seen = set()
+            stack = [name]
+            while stack:
+                tree = self.programs(stack.pop())
+                if tree is None:
+                    continue
+                callees, dynamic = prog_callees(tree)
+                if dynamic or name in callees:
+                    result = True
+                    break
+                for callee in callees:
+                    if callee not in seen:
+                        seen.add(callee)
+                        stack.append(callee)
+            self.recursive[name] = result
+        return result
+
+    def loop(self, node):
+        """Returns a loop as a CountedForTo and/or in a HoistScope, where it can be."""
+        if type(node) is ForTo and self.facts and type(node.var) is Var \
+                and node.var.value in self.facts.counters:
+            # folded to integral Nums, by how counters are chosen
+            node.start = Num(Token(NUMBER, int(node.start.value)))
+            node.step = Num(Token(NUMBER, int(node.step.value)))
+
+        writes = _Writes()
+        writes.visit(node)
+        if writes.calls:
+            # a Prog may write anything
+            return node
+
+        loop = node
+        if type(node) is ForTo:
+            count = _count_iterations(node)
+            if count is not None:
+                loop = CountedForTo(node, count)
+
+        # the start, end and step of a For are only evaluated once
+        hoister = _Hoister(writes, self.facts)
+        if type(node) is ForTo:
+            node.children = hoister.replace_value(node.children)
+        else:
+            node.condition = hoister.replace(node.condition)
+            node.children = hoister.replace_value(node.children)
+        if hoister.hoisted:
+            return HoistScope(list(hoister.hoisted.values()), loop)
+        return loop
+
+    def share(self, node, fixed):
+        """
+        Wraps node in a SharedScope if it has pure subexpressions that
+        occur more than once. The nodes in fixed (by id) are kept as they
+        are, e.g. the statement itself and the vars it assigns to.
+        """
+        keys = dict()
+        counts = dict()
+        stack = [node]
+        while stack:
+            child = stack.pop()
+            stack.extend(iter_child_nodes(child))
+            if id(child) in fixed or type(child) not in SHAREABLE_NODES:
+                continue
+            key = _key(child, keys)
+            if key is not None:
+                counts[key] = counts.get(key, 0) + 1
+        if not any(count > 1 for count in counts.values()):
+            return node
+
+        shared = dict()
+        node = self._replace(node, fixed, keys, counts, shared)
+        return SharedScope(list(shared.values()), node)
+
+    def _replace(self, node, fixed, keys, counts, shared):
+        if id(node) not in fixed:
+            key = keys.get(id(node))
+            if key is not None and counts.get(key, 0) > 1:
+                # the outermost occurrences are shared, not their subtrees
+                if key not in shared:
+                    shared[key] = Shared(node)
+                return shared[key]
+        for name in type(node).__slots__:
+            value = getattr(node, name)
+            setattr(node, name, self._replace_value(value, fixed, keys, counts, shared))
+        return node
+
+    def _replace_value(self, value, fixed, keys, counts, shared):
+        if isinstance(value, AST):
+            return self._replace(value, fixed, keys, counts, shared)
+        if isinstance(value, list):
+            return [self._replace_value(item, fixed, keys, counts, shared) for item in value]
+        if isinstance(value, tuple):
+            return tuple(self._replace_value(item, fixed, keys, counts, shared) for item in value)
+        return value
+
+
+def _key(node, keys):
+    """
+    A key that is equal for equal pure expressions, or None; keys of
+    subtrees are kept in `keys` by node id.
+    """
+    node_id = id(node)
+    if node_id in keys:
+        return keys[node_id]
+    cls = type(node)
+    if cls is NullaryFunc:
+        # RandNum, GetKey and Prompt give a new value each time
+        key = None
+    else:
+        key = [cls]
+        for name in cls.__slots__:
+            part = _value_key(getattr(node, name), keys)
+            if part is None:
+                key = None
+                break
+            key.append(part)
+        if key is not None:
+            key = tuple(key)
+    keys[node_id] = key
+    return key
+
+
+def _value_key(value, keys):
+    if isinstance(value, AST):
+        return _key(value, keys)
+    if isinstance(value, Token):
+        return (Token, value.type, type(value.value), value.value)
+    if isinstance(value, (list, tuple)):
+        parts = tuple(_value_key(item, keys) for item in value)
+        return None if None in parts else parts
+    # the value's type keeps 1 and 1.0 apart
+    return (type(value), value)
+
+
+def _walk(node):
+    """Yields the nodes of a subtree, or of a list of statements."""
+    stack = list(node) if isinstance(node, list) else [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(iter_child_nodes(node))
+
+
+def _count_nodes(node):
+    return sum(1 for _ in _walk(node))
+
+
+def _is_return(node):
+    return type(node) in (KeywordBuiltin, NullaryBuiltin) and node.op.type == RETURN
+
+
+def _has_return(node):
+    return any(_is_return(child) for child in _walk(node))
+
+
+def _end_at_returns(statements):
+    """
+    Returns the statements with each Return made into the end of what
+    runs, by moving what follows an If with a Return into its branches,
+    or None if a Return is in a loop, which can only be left by raising,
+    or the statements grow too much. They themselves aren't changed.
+    """
+    # the statements that can be gone through, as what follows an If is
+    # gone through once for each branch
+    budget = [MAX_INLINED_NODES]
+
+    def end(statements):
+        budget[0] -= len(statements)
+        if budget[0] < 0:
+            return None
+        results = []
+        for i, node in enumerate(statements):
+            if _is_return(node):
+                return results
+            if not _has_return(node):
+                results.append(node)
+                continue
+            if type(node) is not IfThen:
+                return None
+            rest = statements[i+1:]
+            if_clause = end(node.if_clause + rest)
+            else_clause = end(node.else_clause + rest)
+            if if_clause is None or else_clause is None:
+                return None
+            new = IfThen(node.condition)
+            new.if_clause = if_clause
+            new.else_clause = else_clause
+            results.append(new)
+            return results
+        return results
+
+    return end(statements)
+
+
+def _count_iterations(node):
+    """
+    How many times a For loop runs, going the way the machine counts, or
+    None if it doesn't have constant bounds or writes its own counter.
+    """
+    if type(node.var) is not Var:
+        return None
+    if not all(type(value) is Num for value in (node.start, node.end, node.step)):
+        return None
+    writes = _Writes()
+    for child in node.children:
+        writes.visit(child)
+    if node.var.value in writes.vars:
+        return None
+
+    value = node.start.value
+    step = node.step.value
+    end = node.end.value
+    if value < end and step > 0:
+        check = lambda x: x <= end
+    elif value > end and step < 0:
+        check = lambda x: x >= end
+    elif value == end and step != 0:
+        check = lambda x: x == end
+    else:
+        # runs forever, or warns and doesn't run at all
+        return None
+    count = 0
+    while check(value):
+        count += 1
+        if count > MAX_COUNTED_ITERATIONS:
+            return None
+        value += step
+    return count
+
+
+class _Writes():
+    """The vars and mats that a subtree may change, and whether it calls Prog."""
+    def __init__(self):
+        self.vars = set()
+        # mats whose elements are assigned to
+        self.mats = set()
+        # mats that are made again, which replaces their rows
+        self.dims = set()
+        self.calls = False
+
+    def visit(self, node):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            cls = type(node)
+            if cls is Assign:
+                self.target(node.var)
+            elif cls is ForTo:
+                self.target(node.var)
+            elif cls is Initialize:
+                self.dims.add(node.mem_struct.value)
+                self.mats.add(node.mem_struct.value)
+            elif cls is UnaryBuiltin:
+                if node.op.type in (ISZ, DSZ):
+                    self.target(node.arg1)
+                elif node.op.type == PROG:
+                    self.calls = True
+            stack.extend(iter_child_nodes(node))
+
+    def target(self, node):
+        cls = type(node)
+        if cls is Var:
+            self.vars.add(node.value)
+        elif cls is VariableRange:
+            for c in range(node.lower.value[0], node.upper.value[0] + 1):
+                self.vars.add(bytes((c,)))
+        elif cls is MemoryIndex:
+            self.mats.add(node.left.value)
+        elif cls is RowIndex or cls is IntRowIndex:
+            self.mats.add(node.source.left.value)
+
+
+class _Hoister():
+    """Replaces what doesn't change in a loop with Hoisted nodes."""
+    def __init__(self, writes, facts):
+        self.writes = writes
+        self.facts = facts
+        # key -> Hoisted, so that equal subexpressions are hoisted once
+        self.hoisted = dict()
+        self.keys = dict()
+        self.invariant = dict()
+
+    def is_invariant(self, node):
+        node_id = id(node)
+        result = self.invariant.get(node_id)
+        if result is not None:
+            return result
+        cls = type(node)
+        if cls in CONSTANT_NODES:
+            result = True
+        elif cls is Var:
+            result = node.value not in self.writes.vars
+        elif cls is MemoryIndex:
+            result = (
+                node.left.op.type == MAT
+                and node.left.value not in self.writes.mats
+                and all(self.is_invariant(index) for index in node.right)
+            )
+        elif cls in (BinOp, UnaryOp, UnaryFunc):
+            result = all(self.is_invariant(child) for child in iter_child_nodes(node))
+        else:
+            result = False
+        self.invariant[node_id] = result
+        return result
+
+    def hoist(self, node):
+        # not _key(node), which would remember the id of a MatRow that may
+        # be dropped here
+        parts = tuple(_value_key(getattr(node, name), self.keys) for name in type(node).__slots__)
+        key = None if None in parts else (type(node),) + parts
+        if key is None:
+            return Hoisted(node)
+        hoisted = self.hoisted.get(key)
+        if hoisted is None:
+            hoisted = self.hoisted[key] = Hoisted(node)
+        return hoisted
+
+    def replace(self, node):
+        cls = type(node)
+        if cls in HOISTABLE_NODES and self.is_invariant(node):
+            return self.hoist(node)
+        if cls is MemoryIndex and node.left.op.type == MAT:
+            row, column = node.right
+            if node.left.value not in self.writes.dims and self.is_invariant(row):
+                # the row doesn't change, only where in it
+                facts = self.facts
+                row_cls = IntMatRow if facts and facts.is_int(row) else MatRow
+                index_cls = IntRowIndex if facts and facts.is_int(column) else RowIndex
+                row = self.hoist(row_cls(node.left, row))
+                return index_cls(row, self.replace(column), node)
+        if cls is UnaryBuiltin and node.op.type == GRAPHYEQ:
+            # compiled as a function of X
+            return node
+        if cls in (RowIndex, IntRowIndex, Hoisted):
+            return node
+        for name in cls.__slots__:
+            setattr(node, name, self.replace_value(getattr(node, name)))
+        return node
+
+    def replace_value(self, value):
+        if isinstance(value, AST):
+            return self.replace(value)
+        if isinstance(value, list):
+            return [self.replace_value(item) for item in value]
+        if isinstance(value, tuple):
+            return tuple(self.replace_value(item) for item in value)
+        return value
+
+
+class _Fuser():
+    """
+    Replaces the shapes of statements and expressions that programs are
+    mostly made of with fused nodes (see Fused in ast.py). It runs last,
+    as the other passes look for the nodes it replaces.
+    """
+    def __init__(self):
+        # node id -> what it was replaced with, for nodes used twice
+        # (Shared and Hoisted ones)
+        self.done = dict()
+
+    def node(self, node):
+        result = self.done.get(id(node))
+        if result is None:
+            for name in self.slots(node):
+                setattr(node, name, self.value(getattr(node, name)))
+            result = self.done[id(node)] = self.fuse(node)
+        return result
+
+    def slots(self, node):
+        cls = type(node)
+        if cls is SpecialDebug:
+            # refers to its var by name
+            return ()
+        if cls is UnaryBuiltin and node.op.type in (GRAPHYEQ, ISZ, DSZ):
+            # Graph Y= is compiled as a function of X; Isz and Dsz
+            # assign to theirs
+            return ()
+        # the var assigned to, and what a node is written as, are kept
+        return tuple(name for name in cls.__slots__ if name not in ('var', 'source'))
+
+    def value(self, value):
+        if isinstance(value, AST):
+            return self.node(value)
+        if isinstance(value, list):
+            return [self.value(item) for item in value]
+        if isinstance(value, tuple):
+            return tuple(self.value(item) for item in value)
+        return value
+
+    def fuse(self, node):
+        cls = type(node)
+        if cls is BinOp:
+            compare = COMPARISONS.get(node.op.type)
+            if compare and type(node.left) is Var and type(node.right) is Num:
+                return VarCompare(node.left.value, compare, node.right.value, node)
+        elif cls is MemoryIndex:
+            if node.left.op.type == MAT:
+                return MatElement(node.left.value, node.right[0], node.right[1], node)
+        elif cls is IfThen:
+            if type(node.condition) is VarCompare:
+                condition = node.condition
+                return IfVarCompare(condition.name, condition.compare, condition.value, node)
+        elif cls is Assign:
+            if type(node.var) is Var:
+                return self.assign(node)
+        elif cls is UnaryBuiltin:
+            if node.op.type in (ISZ, DSZ) and type(node.arg1) is Var:
+                # as the machine counts, by an int
+                step = 1 if node.op.type == ISZ else -1
+                return AddToVar(node.arg1.value, step, node)
+        return node
+
+    def assign(self, node):
+        name = node.var.value
+        expr = node.expr
+        cls = type(expr)
+        if cls is Num:
+            return SetVar(name, expr.value, node)
+        if cls is NullaryFunc and expr.op.type == GETKEY:
+            return GetkeyToVar(name, node)
+        if cls is BinOp and expr.op.type in (PLUS, MINUS):
+            left, right = expr.left, expr.right
+            if type(left) is Var and left.value == name and type(right) is Num:
+                # A-n is A+(-n), to the last bit
+                step = right.value if expr.op.type == PLUS else -right.value
+                return AddToVar(name, step, node)
+            if expr.op.type == PLUS and type(right) is Var and right.value == name and type(left) is Num:
+                return AddToVar(name, left.value, node)
+        return AssignVar(name, expr, node)
@@ -0,0 +1,303 @@
+"""
+Rasterizers for the graph screen.
+
+Shapes are broken down into spans: (x, y, w, h) rectangles in pixel
+coordinates. A whole shape can then be drawn with one batched call
+(see `graphics.Screen.fill_spans`) instead of one call per pixel.
+"""
+import math
+
+SCREEN_WIDTH = 128
+SCREEN_HEIGHT = 64
+
+
+def _clip_line(x0, y0, x1, y1):
+    """
+    Liang-Barsky line clipping against the screen.
+    Returns the clipped end points, or None if the line is not visible.
+    """
+    dx = x1 - x0
+    dy = y1 - y0
+    t0, t1 = 0.0, 1.0
+    for p, q in (
+        (-dx, x0),
+        (dx, SCREEN_WIDTH - 1 - x0),
+        (-dy, y0),
+        (dy, SCREEN_HEIGHT - 1 - y0)
+    ):
+        if p == 0:
+            if q < 0:
+                return None
+        else:
+            t = q / p
+            if p < 0:
+                if t > t1:
+                    return None
+                t0 = max(t0, t)
+            else:
+                if t < t0:
+                    return None
+                t1 = min(t1, t)
+    return (
+        int(round(x0 + t0 * dx)), int(round(y0 + t0 * dy)),
+        int(round(x0 + t1 * dx)), int(round(y0 + t1 * dy))
+    )
+
+
+def _on_screen(x, y):
+    return 0 <= x < SCREEN_WIDTH and 0 <= y < SCREEN_HEIGHT
+
+
+def points_to_spans(points):
+    """
+    Merges a collection of (x, y) points into horizontal spans.
+    Points off the screen are dropped.
+    """
+    rows = dict()
+    for x, y in points:
+        if _on_screen(x, y):
+            rows.setdefault(y, set()).add(x)
+    spans = []
+    for y, columns in rows.items():
+        columns = sorted(columns)
+        start = prev = columns[0]
+        for x in columns[1:]:
+            if x != prev + 1:
+                spans.append((start, y, prev - start + 1, 1))
+                start = x
+            prev = x
+        spans.append((start, y, prev - start + 1, 1))
+    return spans
+
+
+def point(x, y):
+    if not _on_screen(x, y):
+        return []
+    return [(x, y, 1, 1)]
+
+
+def hline(x0, x1, y):
+    """A horizontal line as a single span."""
+    if x0 > x1:
+        x0, x1 = x1, x0
+    x0 = max(x0, 0)
+    x1 = min(x1, SCREEN_WIDTH - 1)
+    if x0 > x1 or y < 0 or y >= SCREEN_HEIGHT:
+        return []
+    return [(x0, y, x1 - x0 + 1, 1)]
+
+
+def vline(x, y0, y1):
+    """A vertical line as a single span."""
+    if y0 > y1:
+        y0, y1 = y1, y0
+    y0 = max(y0, 0)
+    y1 = min(y1, SCREEN_HEIGHT - 1)
+    if y0 > y1 or x < 0 or x >= SCREEN_WIDTH:
+        return []
+    return [(x, y0, 1, y1 - y0 + 1)]
+
+
+def line(x0, y0, x1, y1):
+    """
+    Modified Bresenham's line algorithm.
+    Runs of pixels along the major axis are merged into one span each,
+    so a shallow line costs one span per row it covers.
+    """
+    if y0 == y1:
+        return hline(x0, x1, y0)
+    if x0 == x1:
+        return vline(x0, y0, y1)
+    if not (_on_screen(x0, y0) and _on_screen(x1, y1)):
+        clipped = _clip_line(x0, y0, x1, y1)
+        if clipped is None:
+            return []
+        x0, y0, x1, y1 = clipped
+
+    dx = abs(x1 - x0)
+    dy = abs(y1 - y0)
+    sx = -1 if x0 > x1 else 1
+    sy = -1 if y0 > y1 else 1
+
+    spans = []
+    x, y = x0, y0
+    if dx > dy:
+        err = dx / 2.0
+        start = x
+        while x != x1:
+            err -= dy
+            if err <= 0:
+                # the row ends here
+                spans.append((min(start, x), y, abs(x - start) + 1, 1))
+                y += sy
+                err += dx
+                start = x + sx
+            x += sx
+        spans.append((min(start, x), y, abs(x - start) + 1, 1))
+    else:
+        err = dy / 2.0
+        start = y
+        while y != y1:
+            err -= dx
+            if err <= 0:
+                # the column ends here
+                spans.append((x, min(start, y), 1, abs(y - start) + 1))
+                x += sx
+                err += dy
+                start = y + sy
+            y += sy
+        spans.append((x, min(start, y), 1, abs(y - start) + 1))
+    return spans
+
+
+def polyline(points):
+    """Spans for a connected line strip through the given points."""
+    spans = []
+    for (x0, y0), (x1, y1) in zip(points, points[1:]):
+        spans.extend(line(x0, y0, x1, y1))
+    return spans
+
+
+def circle(cx, cy, r):
+    """
+    Midpoint circle algorithm.
+    The eight octants are plotted together and merged into row spans.
+    """
+    if r < 0:
+        return []
+    if (cx + r < 0 or cx - r >= SCREEN_WIDTH
+            or cy + r < 0 or cy - r >= SCREEN_HEIGHT):
+        return []
+    points = []
+    x, y = r, 0
+    err = 1 - r
+    while x >= y:
+        points.extend((
+            (cx + x, cy + y), (cx - x, cy + y),
+            (cx + x, cy - y), (cx - x, cy - y),
+            (cx + y, cy + x), (cx - y, cy + x),
+            (cx + y, cy - x), (cx - y, cy - x)
+        ))
+        y += 1
+        if err < 0:
+            err += 2 * y + 1
+        else:
+            x -= 1
+            err += 2 * (y - x) + 1
+    return points_to_spans(points)
+
+
+def ellipse(cx, cy, rx, ry):
+    """
+    Midpoint ellipse algorithm, for circles in a View Window whose x and
+    y scales differ. The four quadrants are merged into row spans.
+    """
+    if rx < 0 or ry < 0:
+        return []
+    if rx == ry:
+        return circle(cx, cy, rx)
+    if rx == 0:
+        return vline(cx, cy - ry, cy + ry)
+    if ry == 0:
+        return hline(cx - rx, cx + rx, cy)
+    if (cx + rx < 0 or cx - rx >= SCREEN_WIDTH
+            or cy + ry < 0 or cy - ry >= SCREEN_HEIGHT):
+        return []
+    points = []
+
+    def plot(x, y):
+        points.extend((
+            (cx + x, cy + y), (cx - x, cy + y),
+            (cx + x, cy - y), (cx - x, cy - y)
+        ))
+
+    rx2 = rx * rx
+    ry2 = ry * ry
+    x, y = 0, ry
+    # region 1: slope > -1
+    d = ry2 - rx2 * ry + rx2 / 4.0
+    while ry2 * x < rx2 * y:
+        plot(x, y)
+        x += 1
+        if d < 0:
+            d += ry2 * (2 * x + 1)
+        else:
+            y -= 1
+            d += ry2 * (2 * x + 1) - 2 * rx2 * y
+    # region 2: slope <= -1
+    d = ry2 * (x + 0.5) ** 2 + rx2 * (y - 1) ** 2 - rx2 * ry2
+    while y >= 0:
+        plot(x, y)
+        y -= 1
+        if d > 0:
+            d += rx2 * (1 - 2 * y)
+        else:
+            x += 1
+            d += ry2 * 2 * x + rx2 * (1 - 2 * y)
+    return points_to_spans(points)
+
+
+# -----------------------------------------------------------------------------
+# View Window
+# -----------------------------------------------------------------------------
+
+def view_transform(xmin, xmax, ymin, ymax):
+    """
+    Precomputes the world-to-pixel mapping of a View Window as the affine
+    coefficients (ax, bx, ay, by), where
+
+        column = ax * x + bx
+        row    = ay * y + by
+
+    Xmin/Xmax map to columns 1 and 127; Ymax/Ymin map to rows 1 and 63.
+    """
+    ax = (SCREEN_WIDTH - 2) / (xmax - xmin)
+    ay = -(SCREEN_HEIGHT - 2) / (ymax - ymin)
+    return (ax, 1 - xmin * ax, ay, 1 - ymax * ay)
+
+
+def _round(v):
+    return int(math.floor(v + 0.5))
+
+
+# points, lines and radii are truncated as they always were (only the
+# values of a graph are rounded)
+
+def to_pixel(transform, x, y):
+    ax, bx, ay, by = transform
+    return int(ax * x + bx), int(ay * y + by)
+
+
+def to_column(transform, x):
+    ax, bx, ay, by = transform
+    return int(ax * x + bx)
+
+
+def to_row(transform, y):
+    ax, bx, ay, by = transform
+    return int(ay * y + by)
+
+
+def to_rows(transform, ys):
+    """
+    Transforms a whole array of y values; values that aren't finite, or
+    stop being finite once scaled, become None.
+    """
+    ax, bx, ay, by = transform
+    rows = []
+    for y in ys:
+        row = ay * y + by
+        rows.append(_round(row) if math.isfinite(row) else None)
+    return rows
+
+
+def column_xs(transform, columns):
+    """The x value at the centre of each of the given columns."""
+    ax, bx, ay, by = transform
+    return [(c - bx) / ax for c in columns]
+
+
+def to_radii(transform, r):
+    """The horizontal and vertical pixel radii of a world radius."""
+    ax, bx, ay, by = transform
+    return int(abs(ax * r)), int(abs(ay * r))
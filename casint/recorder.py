@@ -0,0 +1,311 @@
+"""
+Records the frames presented by a machine to an animation.
+
+Frames are 1-bit images of the 128x64 screen, packed 8 pixels per byte
+(most significant bit first, 1 = dark), i.e. the PBM "P4" raster layout.
+`FrameRecorder.capture` only drops duplicate frames and queues the rest;
+encoding happens on a background thread so the interpreter isn't slowed
+down. Animated GIF and APNG frames only encode the region that changed
+since the previous frame.
+"""
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+WIDTH = 128
+HEIGHT = 64
+ROW_BYTES = WIDTH // 8
+FRAME_BYTES = ROW_BYTES * HEIGHT
+
+# screen colours, as (r, g, b)
+COLOR_OFF = (0xe8, 0xe8, 0xee)
+COLOR_ON = (0x10, 0x10, 0x10)
+
+# the shortest frame delay most GIF viewers will honour
+GIF_MIN_DELAY = 0.02
+
+
+def changed_region(prev, frame):
+    """
+    Returns the bounding box (x, y, w, h) of the pixels that differ
+    between two frames, or None if they are identical.
+    """
+    if prev is None:
+        return (0, 0, WIDTH, HEIGHT)
+    rows = [
+        y for y in range(HEIGHT)
+        if prev[y * ROW_BYTES:(y + 1) * ROW_BYTES] != frame[y * ROW_BYTES:(y + 1) * ROW_BYTES]
+    ]
+    if not rows:
+        return None
+    # or together the differences of the changed rows
+    diff = 0
+    for y in rows:
+        a = int.from_bytes(prev[y * ROW_BYTES:(y + 1) * ROW_BYTES], 'big')
+        b = int.from_bytes(frame[y * ROW_BYTES:(y + 1) * ROW_BYTES], 'big')
+        diff |= a ^ b
+    left = WIDTH - diff.bit_length()
+    right = WIDTH - ((diff & -diff).bit_length() - 1)
+    return (left, rows[0], right - left, rows[-1] - rows[0] + 1)
+
+
+def crop_rows(frame, x, y, w, h):
+    """Yields each row of a region of a frame as a w-bit integer."""
+    mask = (1 << w) - 1
+    shift = WIDTH - x - w
+    for row in range(y, y + h):
+        bits = int.from_bytes(frame[row * ROW_BYTES:(row + 1) * ROW_BYTES], 'big')
+        yield (bits >> shift) & mask
+
+
+# -----------------------------------------------------------------------------
+# encoders
+# -----------------------------------------------------------------------------
+
+def lzw_encode(indices, min_code_size):
+    """GIF flavoured variable-length LZW."""
+    clear = 1 << min_code_size
+    eoi = clear + 1
+
+    out = bytearray()
+    acc = 0
+    acc_bits = 0
+
+    def emit(code):
+        nonlocal acc, acc_bits
+        acc |= code << acc_bits
+        acc_bits += code_size
+        while acc_bits >= 8:
+            out.append(acc & 0xff)
+            acc >>= 8
+            acc_bits -= 8
+
+    code_size = min_code_size + 1
+    table = dict()
+    next_code = eoi + 1
+    emit(clear)
+
+    prefix = None
+    for index in indices:
+        if prefix is None:
+            prefix = index
+            continue
+        key = (prefix, index)
+        code = table.get(key)
+        if code is not None:
+            prefix = code
+            continue
+        emit(prefix)
+        if next_code < 4096:
+            table[key] = next_code
+            next_code += 1
+            if next_code > (1 << code_size) and code_size < 12:
+                code_size += 1
+        else:
+            # table full; start over
+            emit(clear)
+            table = dict()
+            next_code = eoi + 1
+            code_size = min_code_size + 1
+        prefix = index
+    if prefix is not None:
+        emit(prefix)
+    emit(eoi)
+    if acc_bits:
+        out.append(acc & 0xff)
+    return bytes(out)
+
+
+class GifEncoder():
+    def __init__(self, path):
+        self.fp = open(path, 'wb')
+        # header, logical screen descriptor with a 2 colour global table
+        self.fp.write(b'GIF89a')
+        self.fp.write(struct.pack('<HHBBB', WIDTH, HEIGHT, 0xf0, 0, 0))
+        self.fp.write(bytes(COLOR_OFF + COLOR_ON))
+        # loop forever
+        self.fp.write(b'\x21\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00')
+
+
+    def write_frame(self, frame, region, delay):
+        x, y, w, h = region
+        # graphic control extension: keep the previous frame underneath
+        centiseconds = min(int(round(max(delay, GIF_MIN_DELAY) * 100)), 0xffff)
+        self.fp.write(struct.pack('<BBBBHBB', 0x21, 0xf9, 4, 0x04, centiseconds, 0, 0))
+        # image descriptor
+        self.fp.write(struct.pack('<BHHHHB', 0x2c, x, y, w, h, 0))
+        indices = []
+        for bits in crop_rows(frame, x, y, w, h):
+            indices.extend(map(int, format(bits, f'0{w}b')))
+        data = lzw_encode(indices, 2)
+        self.fp.write(b'\x02')
+        for i in range(0, len(data), 255):
+            block = data[i:i + 255]
+            self.fp.write(bytes((len(block),)))
+            self.fp.write(block)
+        self.fp.write(b'\x00')
+
+
+    def close(self, frame_count):
+        self.fp.write(b'\x3b')
+        self.fp.close()
+
+
+def apng_delay(delay):
+    # (numerator, denominator) in the coarsest unit that fits 16 bits
+    for denominator in (1000, 100, 1):
+        numerator = int(round(delay * denominator))
+        if numerator <= 0xffff:
+            return numerator, denominator
+    return 0xffff, 1
+
+
+class ApngEncoder():
+    def __init__(self, path):
+        self.fp = open(path, 'wb')
+        self.sequence = 0
+        self.fp.write(b'\x89PNG\r\n\x1a\n')
+        # 1 bit palette image
+        self._write_chunk(b'IHDR', struct.pack('>IIBBBBB', WIDTH, HEIGHT, 1, 3, 0, 0, 0))
+        # the frame count is patched in when the recording is closed
+        self.actl_position = self.fp.tell()
+        self._write_chunk(b'acTL', struct.pack('>II', 0, 0))
+        self._write_chunk(b'PLTE', bytes(COLOR_OFF + COLOR_ON))
+
+
+    def _write_chunk(self, chunk_type, data):
+        self.fp.write(struct.pack('>I', len(data)))
+        self.fp.write(chunk_type)
+        self.fp.write(data)
+        self.fp.write(struct.pack('>I', zlib.crc32(chunk_type + data)))
+
+
+    def write_frame(self, frame, region, delay):
+        x, y, w, h = region
+        self._write_chunk(b'fcTL', struct.pack(
+            '>IIIIIHHBB',
+            self.sequence, w, h, x, y,
+            *apng_delay(delay),
+            0, 0
+        ))
+        self.sequence += 1
+        # filter type 0 followed by the packed row
+        row_bytes = (w + 7) // 8
+        pad = row_bytes * 8 - w
+        raw = b''.join(
+            b'\x00' + (bits << pad).to_bytes(row_bytes, 'big')
+            for bits in crop_rows(frame, x, y, w, h)
+        )
+        data = zlib.compress(raw, 9)
+        if self.sequence == 1:
+            # the first frame is also the default image
+            self._write_chunk(b'IDAT', data)
+        else:
+            self._write_chunk(b'fdAT', struct.pack('>I', self.sequence) + data)
+            self.sequence += 1
+
+
+    def close(self, frame_count):
+        self._write_chunk(b'IEND', b'')
+        self.fp.seek(self.actl_position, 0)
+        self._write_chunk(b'acTL', struct.pack('>II', frame_count, 0))
+        self.fp.close()
+
+
+class PbmSequenceEncoder():
+    '''
+    Writes each frame to a numbered PBM file, e.g. out.pbm becomes
+    out00000.pbm, out00001.pbm, ...
+    Every file holds the whole frame.
+    '''
+    def __init__(self, path):
+        self.stem, self.ext = os.path.splitext(path)
+        self.count = 0
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+
+    def write_frame(self, frame, region, delay):
+        with open(f'{self.stem}{self.count:05d}{self.ext}', 'wb') as fp:
+            fp.write(f'P4\n{WIDTH} {HEIGHT}\n'.encode('ascii'))
+            fp.write(frame)
+        self.count += 1
+
+
+    def close(self, frame_count):
+        pass
+
+
+def get_encoder(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.gif':
+        return GifEncoder(path)
+    if ext in ('.png', '.apng'):
+        return ApngEncoder(path)
+    if ext == '.pbm':
+        return PbmSequenceEncoder(path)
+    raise ValueError(f'Unknown recording format: "{path}" (use .gif, .png or .pbm)')
+
+
+# -----------------------------------------------------------------------------
+# recorder
+# -----------------------------------------------------------------------------
+
+class FrameRecorder():
+    def __init__(self, path):
+        self.encoder = get_encoder(path)
+        self.last_frame = None
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def capture(self, frame):
+        """Queues a presented frame, unless it is the same as the last one."""
+        if frame == self.last_frame:
+            return
+        self.last_frame = frame
+        self.queue.put((time.monotonic(), frame))
+
+
+    def close(self):
+        """Finishes encoding the queued frames and closes the output."""
+        if self.thread is None:
+            return
+        self.queue.put((time.monotonic(), None))
+        self.thread.join()
+        self.thread = None
+
+
+    def _run(self):
+        # a frame is written once the next one arrives, as its delay
+        # is the time until the screen changed again
+        prev = None
+        pending = None
+        frame_count = 0
+        while True:
+            timestamp, frame = self.queue.get()
+            if pending:
+                pending_timestamp, pending_frame, region = pending
+                self.encoder.write_frame(pending_frame, region, timestamp - pending_timestamp)
+                frame_count += 1
+                pending = None
+            if frame is None:
+                break
+            region = changed_region(prev, frame)
+            if region is not None:
+                pending = (timestamp, frame, region)
+                prev = frame
+        self.encoder.close(frame_count)
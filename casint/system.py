@@ -3,35 +3,33 @@ import time
 from .common import *
 from .machine import CasioMachine
 from .loader import CasioProgram, CasioPict
-from .graphics import locate, fill
+from .graphics import locate
 
 
 NUM_TEXT_ROWS = 6
 
 
 class CasioSystem(CasioMachine):
-    def __init__(self, items):
-        super().__init__(items)
+    def __init__(self, items, display, recorder=None, watcher=None, optimize=True):
+        super().__init__(items, display, recorder, watcher, optimize)
 
 
     def _paint_menu(self, selection, offset):
-        # todo: use a new 'program' texture, not the graph texture
-        self._render_begin(self.texture_graph)
-        self._clear_screen()
-        locate(self.renderer, self.font_text, 1, 1, b"Program List")
+        # todo: use a new 'program' screen, not the graph screen
+        screen = self._render_begin(self.screen_graph)
+        screen.clear()
+        locate(screen, self.font_text, 1, 1, b"Program List")
         # write program names
         i = 0
         while i < NUM_TEXT_ROWS and (i+offset) < self.items.program_count:
             program = self.items.get_program_by_index(i+offset)
             if (selection-offset) == i:
                 # print the marker in inverted text
-                self._set_color(True)
-                fill(self.renderer, 1, i * 8 + 8, 127, i * 8 + 16)
-                locate(self.renderer, self.font_text_inverted, 2, i+2, program.name)
+                screen.fill(1, i * 8 + 8, 127, i * 8 + 16)
+                locate(screen, self.font_text_inverted, 2, i+2, program.name)
             else:
-                locate(self.renderer, self.font_text, 2, i+2, program.name)
+                locate(screen, self.font_text, 2, i+2, program.name)
             i += 1
-        self._render_end()
 
 
     def show_menu(self):
@@ -61,9 +59,7 @@ class CasioSystem(CasioMachine):
                 elif (selection-offset) >= NUM_TEXT_ROWS:
                     offset += 1
 
-        self._render_begin(self.texture_graph)
-        self._clear_screen()
-        self._render_end()
+        self._render_begin(self.screen_graph).clear()
 
         program = self.items.get_program_by_index(selection)
         return program
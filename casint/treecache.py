@@ -0,0 +1,82 @@
+"""
+An on-disk cache of parsed program trees, so unchanged programs aren't
+lexed and parsed again every time they are loaded.
+
+Entries are named by a hash of the program's source bytes, its source
+format and the parser and codec versions, and hold the tree as encoded by
+`astcodec`. Any change to a program, or to the parser, gives a new name;
+stale entries are simply never read again.
+"""
+import hashlib
+import os
+import tempfile
+
+from .astcodec import CODEC_VERSION, encode_tree, decode_tree
+from .interpreter import PARSER_VERSION
+
+# the cache directory used when none is given
+CACHE_DIR_ENVIRONMENT_VARIABLE = 'CASINT_CACHE_DIR'
+
+
+def default_cache_dir():
+    return os.environ.get(CACHE_DIR_ENVIRONMENT_VARIABLE) or None
+
+
+class TreeCache():
+    def __init__(self, directory):
+        self.directory = directory
+
+    def key(self, source, source_format):
+        h = hashlib.sha256()
+        h.update(f'{source_format}:{PARSER_VERSION}:{CODEC_VERSION}:'.encode('ascii'))
+        h.update(source)
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key[2:])
+
+    def load(self, source, source_format):
+        """Returns the cached tree of a program, or None."""
+        path = self._path(self.key(source, source_format))
+        try:
+            with open(path, 'rb') as fp:
+                data = fp.read()
+        except OSError:
+            return None
+        try:
+            return decode_tree(data)
+        except Exception:
+            # damaged, in whatever way; parse again and replace it
+            return None
+
+    def store(self, source, source_format, tree=None, data=None):
+        """
+        Stores the tree of a program, or its encoded bytes if they are at
+        hand. The cache is best effort: failing to write is not an error.
+        """
+        if data is None:
+            data = encode_tree(tree)
+        path = self._path(self.key(source, source_format))
+        folder = os.path.dirname(path)
+        try:
+            os.makedirs(folder, exist_ok=True)
+            # write to a temporary file first, so that a concurrent load
+            # never sees a partial entry
+            fd, temp_path = tempfile.mkstemp(dir=folder)
+            try:
+                with os.fdopen(fd, 'wb') as fp:
+                    fp.write(data)
+                os.replace(temp_path, path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+        except OSError:
+            pass
+
+
+def get_tree_cache(directory=None):
+    """A cache in `directory` (default: $CASINT_CACHE_DIR), or None if neither is set."""
+    directory = directory or default_cache_dir()
+    if not directory:
+        return None
+    return TreeCache(directory)
@@ -1,3 +1,5 @@
+import re
+
 from .common import *
 from .ast import *
 from .interpreter import (
@@ -6,274 +8,159 @@ from .interpreter import (
     LexerException,
     ParserException,
     Token,
-    is_variable,
-    is_numeric,
-    is_ucb_word_character,
+    index_by_byte,
     parse_word_as_number
 )
 
 
+# keyword -> (token type, value)
+UCB_KEYWORDS = {
+    b'DebugVar':    (SPECIAL_DEBUG, b'DebugVar'),
+    b'DebugMat':    (SPECIAL_DEBUG, b'DebugMat'),
+    b'label':       (LBL, b'Lbl '),
+    b'goto':        (GOTO, b'Goto '),
+    b'return':      (RETURN, b'Return'),
+    b'break':       (BREAK, b'Break'),
+    b'stop':        (STOP, b'Stop'),
+    b'dim':         (DIM, b'Dim '),
+    b'and':         (AND, b' And '),
+    b'or':          (OR, b' Or '),
+    b'if':          (IF, b'If '),
+    b'else':        (ELSE, b'Else'),
+    b'for':         (FOR, b'For '),
+    b'to':          (TO, b'To '),
+    b'step':        (STEP, b'Step '),
+    b'do':          (DO, b'Do'),
+    b'while':       (WHILE, b'While '),
+    b'Isz':         (ISZ, b'Isz '),
+    b'Dsz':         (DSZ, b'Dsz '),
+    b'StoPict':     (STOPICT, b'StoPict '),
+    b'RclPict':     (RCLPICT, b'RclPict '),
+    b'Cls':         (CLS, b'Cls'),
+    b'log':         (LOG, b'log '),
+    b'Intg':        (INTG, b'Intg '),
+    b'Frac':        (FRAC, b'Frac '),
+    b'RandNum':     (RANDNUM, b'Ran# '),
+    b'GetKey':      (GETKEY, b'Getkey'),
+    b'Prog':        (PROG, b'Prog'),
+    b'Text':        (TEXT, b'Text '),
+    b'F_Line':      (FLINE, b'F-Line '),
+    b'Horizontal':  (HORIZONTAL, b'Horizontal '),
+    b'Vertical':    (VERTICAL, b'Vertical '),
+    b'Circle':      (CIRCLE, b'Circle '),
+    b'PlotOn':      (PLOTON, b'PlotOn '),
+    b'GraphYEq':    (GRAPHYEQ, b'Graph Y='),
+    b'PxlOn':       (PXLON, b'PxlOn '),
+    b'PxlOff':      (PXLOFF, b'PxlOff '),
+    b'PxlChg':      (PXLCHG, b'PxlChg '),
+    b'PxlTest':     (PXLTEST, b'PxlTest('),
+    b'ViewWindow':  (VIEWWINDOW, b'ViewWindow'),
+    b'Locate':      (LOCATE, b'Locate '),
+    b'ClrText':     (CLRTEXT, b'ClrText'),
+    b'rad':         (VARIABLE, b'\xcd'),
+    b'theta':       (VARIABLE, b'\xce'),
+    b'Mat':         (MAT, b'Mat ')
+}
+
+# single character punctuation -> (token type, value)
+UCB_PUNCTUATION = {
+    b',': (COMMA, b','),
+    b';': (SEMI, b'EOL'),
+    b'+': (PLUS, b'+'),
+    b'-': (MINUS, b'-'),
+    b'(': (LPAREN, b'('),
+    b')': (RPAREN, b')'),
+    b'{': (LBRACE, b'{'),
+    b'}': (RBRACE, b'}'),
+    b'[': (LBRACKET, b'['),
+    b']': (RBRACKET, b']'),
+    b'~': (VARIABLERANGE, b'~')
+}
+
+
+# operators of one or two characters:
+# first character -> (one character token, second character, two character token)
+UCB_OPERATORS = {
+    b'=': ((ASSIGN, b'->'), b'=', (EQ, b'==')),
+    b'<': ((LT, b'<'), b'=', (LTE, b'<=')),
+    b'>': ((GT, b'>'), b'=', (GTE, b'>=')),
+    b'!': (None, b'=', (NEQ, b'!=')),
+    b'*': ((MUL, b'x'), b'*', (POWER, b'^')),
+    # the value of a comment is the rest of the line
+    b'/': ((DIV, b'/'), b'/', (COMMENT, None))
+}
+
+UCB_WHITESPACE = re.compile(rb'[ \r\n]*')
+UCB_WORD = re.compile(b'[' + re.escape(UCB_WORD_CHARACTERS) + b']+')
+UCB_COMMENT = re.compile(rb'[^\r\n\x00]*')
+
+UCB_WORD_BYTES = frozenset(UCB_WORD_CHARACTERS)
+UCB_PUNCTUATION_BY_BYTE = index_by_byte(UCB_PUNCTUATION)
+UCB_OPERATORS_BY_BYTE = {
+    c[0]: (single, second[0], double)
+    for c, (single, second, double) in UCB_OPERATORS.items()
+}
+
+
 class UcbLexer(Lexer):
     def string(self):
-        result = b''
-        self.advance()
-        while self.current_char is not None and self.current_char != b'"':
-            result += self.current_char
-            self.advance()
-        self.advance()
-        return translate_ascii_bytes_to_casio(result)
+        return translate_ascii_bytes_to_casio(self.quoted())
 
 
     def comment(self):
-        result = b''
         # read until the line end
-        while self.current_char is not None and self.current_char not in (b'\r', b'\n'):
-            result += self.current_char
-            self.advance()
-        return result
+        return self.match(UCB_COMMENT)
 
 
     def ucb_word(self):
-        result = b''
-        while self.current_char is not None and is_ucb_word_character(self.current_char):
-            result += self.current_char
-            self.advance()
-        return result
+        return self.match(UCB_WORD)
 
 
     def get_next_token(self):
-        while self.current_char is not None:
-            #print(f'{self.current_char}')
-
-            if self.current_char in (b' ', b'\r', b'\n'):
-                # ignore whitespace
-                self.advance()
-                continue
-
-            if is_ucb_word_character(self.current_char):
-                word = self.ucb_word()
-                #print(f'word: {word}')
-
-                # check for special keywords
-                if word in (b'DebugVar', b'DebugMat'):
-                    return Token(SPECIAL_DEBUG, word)
-
-                if word == b'label':
-                    return Token(LBL, b'Lbl ')
-
-                if word == b'goto':
-                    return Token(GOTO, b'Goto ')
-
-                if word == b'return':
-                    return Token(RETURN, b'Return')
-
-                if word == b'break':
-                    return Token(BREAK, b'Break')
-
-                if word == b'stop':
-                    return Token(STOP, b'Stop')
-
-                if word == b'dim':
-                    return Token(DIM, b'Dim ')
-
-                if word == b'and':
-                    return Token(AND, b' And ')
-
-                if word == b'or':
-                    return Token(OR, b' Or ')
-
-                if word == b'if':
-                    return Token(IF, b'If ')
-
-                if word == b'else':
-                    return Token(ELSE, b'Else')
-
-                if word == b'for':
-                    return Token(FOR, b'For ')
-
-                if word == b'to':
-                    return Token(TO, b'To ')
-
-                if word == b'step':
-                    return Token(STEP, b'Step ')
-
-                if word == b'do':
-                    return Token(DO, b'Do')
-
-                if word == b'while':
-                    return Token(WHILE, b'While ')
-
-                if word == b'Isz':
-                    return Token(ISZ, b'Isz ')
-
-                if word == b'Dsz':
-                    return Token(DSZ, b'Dsz ')
-
-                if word == b'StoPict':
-                    return Token(STOPICT, b'StoPict ')
-
-                if word == b'RclPict':
-                    return Token(RCLPICT, b'RclPict ')
-
-                if word == b'Cls':
-                    return Token(CLS, b'Cls')
-
-                if word == b'log':
-                    return Token(LOG, b'log ')
-
-                if word == b'Intg':
-                    return Token(INTG, b'Intg ')
-
-                if word == b'Frac':
-                    return Token(FRAC, b'Frac ')
-
-                if word == b'RandNum':
-                    return Token(RANDNUM, b'Ran# ')
-
-                if word == b'GetKey':
-                    return Token(GETKEY, b'Getkey')
-
-                if word == b'Prog':
-                    return Token(PROG, b'Prog')
-
-                if word == b'Text':
-                    return Token(TEXT, b'Text ')
-
-                if word == b'F_Line':
-                    return Token(FLINE, b'F-Line ')
-
-                if word == b'Horizontal':
-                    return Token(HORIZONTAL, b'Horizontal ')
+        # ignore whitespace
+        self.match(UCB_WHITESPACE)
 
-                if word == b'PxlOn':
-                    return Token(PXLON, b'PxlOn ')
+        c = self.char()
+        if c is None:
+            return Token(EOF, None)
 
-                if word == b'PxlOff':
-                    return Token(PXLOFF, b'PxlOff ')
+        if c in UCB_WORD_BYTES:
+            word = self.ucb_word()
 
-                if word == b'PxlChg':
-                    return Token(PXLCHG, b'PxlChg ')
+            # check for special keywords
+            keyword = UCB_KEYWORDS.get(word)
+            if keyword is not None:
+                return Token(*keyword)
 
-                if word == b'PxlTest':
-                    return Token(PXLTEST, b'PxlTest(')
+            if len(word) == 1 and word in ALPHA_MEM_CHARS:
+                return Token(VARIABLE, word)
 
-                if word == b'ViewWindow':
-                    return Token(VIEWWINDOW, b'ViewWindow')
+            if word[0] in b'0123456789.':
+                return Token(NUMBER, parse_word_as_number(word))
 
-                if word == b'Locate':
-                    return Token(LOCATE, b'Locate ')
-
-                if word == b'ClrText':
-                    return Token(CLRTEXT, b'ClrText')
-
-                if word == b'rad':
-                    return Token(VARIABLE, b'\xcd')
-
-                if word == b'theta':
-                    return Token(VARIABLE, b'\xce')
-
-                if word == b'Mat':
-                    return Token(MAT, b'Mat ')
-
-                if len(word) == 1 and is_variable(word):
-                    return Token(VARIABLE, word)
-
-                if is_numeric(word[0]):
-                    return Token(NUMBER, parse_word_as_number(word))
-
-                else:
-                    self.error()
-
-            if self.current_char == b'"':
-                return Token(STRING, self.string())
-
-            if self.current_char == b',':
-                self.advance()
-                return Token(COMMA, b',')
-
-            if self.current_char == b';':
-                self.advance()
-                return Token(SEMI, b'EOL')
-
-            if self.current_char == b'=':
-                self.advance()
-                if self.current_char == b'=':
-                    self.advance()
-                    return Token(EQ, b'==')
-                return Token(ASSIGN, b'->')
-
-            if self.current_char == b'<':
-                self.advance()
-                if self.current_char == b'=':
-                    self.advance()
-                    return Token(LTE, b'<=')
-                return Token(LT, b'<')
-
-            if self.current_char == b'>':
-                self.advance()
-                if self.current_char == b'=':
-                    self.advance()
-                    return Token(GTE, b'>=')
-                return Token(GT, b'>')
-
-            if self.current_char == b'!' and self.peek() == b'=':
-                self.advance()
-                self.advance()
-                return Token(NEQ, b'!=')
-
-            if self.current_char == b'+':
-                self.advance()
-                return Token(PLUS, b'+')
+            self.error()
 
-            if self.current_char == b'-':
-                self.advance()
-                return Token(MINUS, b'-')
+        punctuation = UCB_PUNCTUATION_BY_BYTE.get(c)
+        if punctuation is not None:
+            self.pos += 1
+            return Token(*punctuation)
 
-            if self.current_char == b'*':
-                self.advance()
-                if self.current_char == b'*':
-                    self.advance()
-                    return Token(POWER, b'^')
-                return Token(MUL, b'x')
+        if c == ord('"'):
+            return Token(STRING, self.string())
 
-            if self.current_char == b'/':
-                self.advance()
-                if self.current_char == b'/':
-                    self.advance()
+        operator = UCB_OPERATORS_BY_BYTE.get(c)
+        if operator is not None:
+            single, second, double = operator
+            if self.peek() == second:
+                self.pos += 2
+                if double[0] == COMMENT:
                     return Token(COMMENT, self.comment())
-                return Token(DIV, b'/')
-
-            if self.current_char == b'(':
-                self.advance()
-                return Token(LPAREN, b'(')
-
-            if self.current_char == b')':
-                self.advance()
-                return Token(RPAREN, b')')
+                return Token(*double)
+            if single is not None:
+                self.pos += 1
+                return Token(*single)
 
-            if self.current_char == b'{':
-                self.advance()
-                return Token(LBRACE, b'{')
-
-            if self.current_char == b'}':
-                self.advance()
-                return Token(RBRACE, b'}')
-
-            if self.current_char == b'[':
-                self.advance()
-                return Token(LBRACKET, b'[')
-
-            if self.current_char == b']':
-                self.advance()
-                return Token(RBRACKET, b']')
-
-            if self.current_char == b'~':
-                self.advance()
-                return Token(VARIABLERANGE, b'~')
-
-            self.error()
-
-        return Token(EOF, None)
+        self.error()
 
 
 class UcbParser(Parser):
@@ -397,7 +284,7 @@ class UcbParser(Parser):
         self.eat(LPAREN)
         arg1 = self.num_limited(1, 20)
         self.eat(RPAREN)
-        return UnaryBuiltin(token, b'StoPict', b'\xf7\x93', arg1)
+        return UnaryBuiltin(token, arg1)
 
 
     def rclpict(self, token):
@@ -405,7 +292,7 @@ class UcbParser(Parser):
         self.eat(LPAREN)
         arg1 = self.num_limited(1, 20)
         self.eat(RPAREN)
-        return UnaryBuiltin(token, b'RclPict', b'\xf7\x94', arg1)
+        return UnaryBuiltin(token, arg1)
 
 
     def prog(self, token):
@@ -413,47 +300,47 @@ class UcbParser(Parser):
         self.eat(LPAREN)
         arg1 = self.string_literal()
         self.eat(RPAREN)
-        return UnaryBuiltin(token, b'Prog', b'\xed', arg1)
+        return UnaryBuiltin(token, arg1)
 
 
-    def nullary_builtin(self, token, ucb_name, g1m_name):
+    def nullary_builtin(self, token):
         self.eat(token.type)
         self.eat(LPAREN)
         self.eat(RPAREN)
-        return NullaryBuiltin(token, ucb_name, g1m_name)
+        return NullaryBuiltin(token)
 
 
-    def nullary_func(self, token, ucb_name, g1m_name):
+    def nullary_func(self, token):
         self.eat(token.type)
         self.eat(LPAREN)
         self.eat(RPAREN)
-        return NullaryFunc(token, ucb_name, g1m_name)
+        return NullaryFunc(token)
 
 
-    def unary_builtin(self, token, ucb_name, g1m_name, fn1):
+    def unary_builtin(self, token, fn1):
         self.eat(token.type)
         self.eat(LPAREN)
         arg1 = fn1()
         self.eat(RPAREN)
-        return UnaryBuiltin(token, ucb_name, g1m_name, arg1)
+        return UnaryBuiltin(token, arg1)
 
 
-    def unary_func(self, token, ucb_name, g1m_name):
+    def unary_func(self, token):
         self.eat(token.type)
         self.eat(LPAREN)
         arg1 = self.expression()
         self.eat(RPAREN)
-        return UnaryFunc(token, ucb_name, g1m_name, arg1)
+        return UnaryFunc(token, arg1)
 
 
-    def binary_builtin(self, token, ucb_name, g1m_name):
+    def binary_builtin(self, token):
         self.eat(token.type)
         self.eat(LPAREN)
         arg1 = self.expression()
         self.eat(COMMA)
         arg2 = self.expression()
         self.eat(RPAREN)
-        return BinaryBuiltin(token, ucb_name, g1m_name, arg1, arg2)
+        return BinaryBuiltin(token, arg1, arg2)
 
 
     def pxltest(self, token):
@@ -463,7 +350,7 @@ class UcbParser(Parser):
         self.eat(COMMA)
         arg2 = self.expression()
         self.eat(RPAREN)
-        return BinaryFunc(token, b'PxlTest', b'\xf7\xaf', arg1, arg2)
+        return BinaryFunc(token, arg1, arg2)
 
 
     def text(self, token):
@@ -479,7 +366,7 @@ class UcbParser(Parser):
         else:
             arg3 = self.expression()
         self.eat(RPAREN)
-        return TernaryBuiltin(token, b'Text', b'\xf7\xa5', arg1, arg2, arg3)
+        return TernaryBuiltin(token, arg1, arg2, arg3)
 
 
     def locate(self, token):
@@ -495,10 +382,22 @@ class UcbParser(Parser):
         else:
             arg3 = self.expression()
         self.eat(RPAREN)
-        return TernaryBuiltin(token, b'Locate', b'\xf7\x10', arg1, arg2, arg3)
+        return TernaryBuiltin(token, arg1, arg2, arg3)
+
+
+    def ternary_builtin(self, token):
+        self.eat(token.type)
+        self.eat(LPAREN)
+        arg1 = self.expression()
+        self.eat(COMMA)
+        arg2 = self.expression()
+        self.eat(COMMA)
+        arg3 = self.expression()
+        self.eat(RPAREN)
+        return TernaryBuiltin(token, arg1, arg2, arg3)
 
 
-    def quaternary_builtin(self, token, ucb_name, g1m_name):
+    def quaternary_builtin(self, token):
         self.eat(token.type)
         self.eat(LPAREN)
         arg1 = self.expression()
@@ -509,10 +408,10 @@ class UcbParser(Parser):
         self.eat(COMMA)
         arg4 = self.expression()
         self.eat(RPAREN)
-        return QuaternaryBuiltin(token, ucb_name, g1m_name, arg1, arg2, arg3, arg4)
+        return QuaternaryBuiltin(token, arg1, arg2, arg3, arg4)
 
 
-    def senary_builtin(self, token, ucb_name, g1m_name):
+    def senary_builtin(self, token):
         self.eat(token.type)
         self.eat(LPAREN)
         arg1 = self.expression()
@@ -527,11 +426,15 @@ class UcbParser(Parser):
         self.eat(COMMA)
         arg6 = self.expression()
         self.eat(RPAREN)
-        return SenaryBuiltin(token, ucb_name, g1m_name, arg1, arg2, arg3, arg4, arg5, arg6)
+        return SenaryBuiltin(token, arg1, arg2, arg3, arg4, arg5, arg6)
 
 
-    def assignment_statement(self):
-        var = self.variable_or_mat_set()
+    def assignment(self, first, var):
+        # var = expr, where the expression parsed so far is only the var
+        if first.type == VARIABLE and isinstance(var, Var):
+            var = self.variable_range(var)
+        elif not (first.type == MAT and isinstance(var, MemoryIndex)):
+            return None
         self.eat(ASSIGN)
         expr = self.expression()
         node = Assign(expr, var)
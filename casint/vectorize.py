@@ -0,0 +1,225 @@
+"""
+Batch evaluation of an expression over many values of one variable.
+
+Graph Y= needs its expression evaluated for every screen column. Instead
+of interpreting the tree once per column, the tree is compiled once into
+a chain of closures that each operate on a whole array of values. NumPy
+arrays are used when NumPy is installed, otherwise plain lists.
+"""
+import math
+from random import random as rand_num
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .common import *
+from .ast import BinOp, UnaryOp, UnaryFunc, NullaryFunc, Var, iter_child_nodes
+
+
+NAN = float('nan')
+
+
+def depends_on(node, var):
+    """Returns True if the expression reads the variable `var`."""
+    if type(node) is Var:
+        return node.value == var
+    if type(node) is NullaryFunc and node.op.type == RANDNUM:
+        # a new random number for every value
+        return True
+    return any(depends_on(child, var) for child in iter_child_nodes(node))
+
+
+# -----------------------------------------------------------------------------
+# list based operations
+# -----------------------------------------------------------------------------
+
+def _div(a, b):
+    return a / b if b else NAN
+
+
+def _pow(a, b):
+    try:
+        value = a ** b
+    except (ZeroDivisionError, OverflowError):
+        return NAN
+    if type(value) is complex:
+        return NAN
+    return value
+
+
+def _intg(a):
+    return float(int(a)) if math.isfinite(a) else a
+
+
+def _frac(a):
+    return float(a - int(a)) if math.isfinite(a) else NAN
+
+
+LIST_BINARY_OPS = {
+    PLUS:   lambda a, b: a + b,
+    MINUS:  lambda a, b: a - b,
+    MUL:    lambda a, b: a * b,
+    DIV:    _div,
+    POWER:  _pow,
+    EQ:     lambda a, b: 1 if a == b else 0,
+    NEQ:    lambda a, b: 1 if a != b else 0,
+    LT:     lambda a, b: 1 if a < b else 0,
+    GT:     lambda a, b: 1 if a > b else 0,
+    LTE:    lambda a, b: 1 if a <= b else 0,
+    GTE:    lambda a, b: 1 if a >= b else 0,
+    AND:    lambda a, b: 1 if a and b else 0,
+    OR:     lambda a, b: 1 if a or b else 0
+}
+
+LIST_UNARY_FUNCS = {
+    INTG:   _intg,
+    FRAC:   _frac
+}
+
+
+def _list_map1(fn, a):
+    return [fn(x) for x in a]
+
+
+def _list_map2(fn, a, b):
+    if type(a) is list:
+        if type(b) is list:
+            return [fn(x, y) for x, y in zip(a, b)]
+        return [fn(x, b) for x in a]
+    return [fn(a, y) for y in b]
+
+
+# -----------------------------------------------------------------------------
+# numpy based operations
+# -----------------------------------------------------------------------------
+
+if numpy is not None:
+    def _bool(a):
+        return numpy.where(a, 1.0, 0.0)
+
+    NUMPY_BINARY_OPS = {
+        PLUS:   numpy.add,
+        MINUS:  numpy.subtract,
+        MUL:    numpy.multiply,
+        DIV:    numpy.true_divide,
+        POWER:  numpy.power,
+        EQ:     lambda a, b: _bool(numpy.equal(a, b)),
+        NEQ:    lambda a, b: _bool(numpy.not_equal(a, b)),
+        LT:     lambda a, b: _bool(numpy.less(a, b)),
+        GT:     lambda a, b: _bool(numpy.greater(a, b)),
+        LTE:    lambda a, b: _bool(numpy.less_equal(a, b)),
+        GTE:    lambda a, b: _bool(numpy.greater_equal(a, b)),
+        AND:    lambda a, b: _bool(numpy.logical_and(a, b)),
+        OR:     lambda a, b: _bool(numpy.logical_or(a, b))
+    }
+
+    NUMPY_UNARY_FUNCS = {
+        INTG:   numpy.trunc,
+        FRAC:   lambda a: a - numpy.trunc(a)
+    }
+
+
+# -----------------------------------------------------------------------------
+# compilation
+# -----------------------------------------------------------------------------
+
+def _compile_scalar(node):
+    # doesn't depend on the variable: evaluate once per batch
+    def fn(machine, xs):
+        try:
+            return machine._visit(node)
+        except (ZeroDivisionError, OverflowError, ValueError):
+            return NAN
+    return fn
+
+
+def _compile_interpreted(node, var):
+    # no batch implementation; interpret the node for each value
+    def fn(machine, xs):
+        saved = machine.vars[var]
+        ys = []
+        try:
+            for x in xs:
+                machine.vars[var] = x
+                try:
+                    ys.append(float(machine._visit(node)))
+                except (ZeroDivisionError, OverflowError, ValueError):
+                    ys.append(NAN)
+        finally:
+            machine.vars[var] = saved
+        if numpy is not None:
+            return numpy.array(ys)
+        return ys
+    return fn
+
+
+def _compile(node, var):
+    if not depends_on(node, var):
+        return _compile_scalar(node)
+
+    if type(node) is Var:
+        return lambda machine, xs: xs
+
+    if type(node) is BinOp:
+        left = _compile(node.left, var)
+        right = _compile(node.right, var)
+        if numpy is not None:
+            op = NUMPY_BINARY_OPS.get(node.op.type)
+            if op is not None:
+                return lambda machine, xs: op(left(machine, xs), right(machine, xs))
+        else:
+            op = LIST_BINARY_OPS.get(node.op.type)
+            if op is not None:
+                return lambda machine, xs: _list_map2(op, left(machine, xs), right(machine, xs))
+
+    elif type(node) is UnaryOp and node.op.type == MINUS:
+        expr = _compile(node.expr, var)
+        if numpy is not None:
+            return lambda machine, xs: numpy.negative(expr(machine, xs))
+        return lambda machine, xs: _list_map1(lambda a: -1 * a, expr(machine, xs))
+
+    elif type(node) is UnaryFunc:
+        arg1 = _compile(node.arg1, var)
+        if numpy is not None:
+            op = NUMPY_UNARY_FUNCS.get(node.op.type)
+            if op is not None:
+                return lambda machine, xs: op(arg1(machine, xs))
+        else:
+            op = LIST_UNARY_FUNCS.get(node.op.type)
+            if op is not None:
+                return lambda machine, xs: _list_map1(op, arg1(machine, xs))
+
+    elif type(node) is NullaryFunc and node.op.type == RANDNUM:
+        if numpy is not None:
+            return lambda machine, xs: numpy.random.random(len(xs))
+        return lambda machine, xs: [float(rand_num()) for x in xs]
+
+    return _compile_interpreted(node, var)
+
+
+def compile_expression(node, var):
+    """
+    Compiles an expression into a function `fn(machine, xs)` that returns
+    the value of the expression for each value of `var` in `xs`.
+    Undefined values (e.g. division by zero) are returned as NaN or
+    infinity; callers should skip values that are not finite.
+    """
+    fn = _compile(node, var)
+
+    if numpy is not None:
+        def evaluate(machine, xs):
+            xs = numpy.asarray(xs, dtype=float)
+            with numpy.errstate(all='ignore'):
+                ys = fn(machine, xs)
+            return numpy.broadcast_to(numpy.asarray(ys, dtype=float), xs.shape).tolist()
+    else:
+        def evaluate(machine, xs):
+            xs = [float(x) for x in xs]
+            ys = fn(machine, xs)
+            if type(ys) is not list:
+                ys = [float(ys)] * len(xs)
+            return ys
+
+    return evaluate
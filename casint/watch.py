@@ -0,0 +1,105 @@
+"""
+Watch mode: reloads the programs of a UCB directory while they're being
+edited. Files are polled with os.stat, and a changed program is re-parsed
+incrementally and swapped into the item collection. The machine keeps
+running, with its screens, vars and mats intact; the new version is used
+from the next time the program is run or called with Prog.
+"""
+import os
+import time
+
+from .incremental import IncrementalParse
+from .loader import get_item_name_from_filename, load_program_from_ucb_file
+
+WATCH_INTERVAL_SECONDS = 0.5
+
+
+def _signature(filepath):
+    try:
+        st = os.stat(filepath)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+class UcbDirWatcher():
+    def __init__(self, dirpath, items, interval=WATCH_INTERVAL_SECONDS):
+        self.dirpath = dirpath
+        self.items = items
+        items.watched = True
+        self.interval = interval
+        self.next_poll = time.monotonic() + interval
+        # the last seen signature of each file
+        self.signatures = {
+            filepath: _signature(filepath) for filepath in self._ucb_files()
+        }
+        # incremental parses of the files that have been reloaded
+        self.parses = dict()
+
+    def _ucb_files(self):
+        try:
+            filenames = os.listdir(self.dirpath)
+        except OSError:
+            return []
+        return [
+            os.path.join(self.dirpath, filename)
+            for filename in filenames
+            if filename.lower().endswith('.ucb')
+        ]
+
+    def poll(self):
+        """Reloads any programs that changed, at most once per interval."""
+        now = time.monotonic()
+        if now < self.next_poll:
+            return
+        self.next_poll = now + self.interval
+
+        for filepath in self._ucb_files():
+            signature = _signature(filepath)
+            if signature is None or signature == self.signatures.get(filepath):
+                continue
+            self.signatures[filepath] = signature
+            self._reload(filepath)
+
+    def _reload(self, filepath):
+        filename = os.path.basename(filepath)
+        try:
+            name = get_item_name_from_filename(filename)
+            with open(filepath, 'rb') as fp:
+                source = fp.read()
+        except Exception as e:
+            print(f'Could not reload {filename}: {e}')
+            return
+
+        program = self.items.get_program_by_name(name)
+        if program is None:
+            # a new file
+            program = load_program_from_ucb_file(filepath, name)
+            self.items.add(program)
+            print(f'Added program: "{program.stringname}"')
+            return
+        if source == program.source:
+            return
+
+        previous = self.parses.get(filepath)
+        try:
+            if previous is None:
+                parse = IncrementalParse.parse(source, filepath)
+            else:
+                parse = previous.update(source)
+        except Exception as e:
+            # keep running the last version that parsed
+            print(f'Could not reload "{program.stringname}": {e}')
+            return
+        self.parses[filepath] = parse
+        program.replace_source(source, parse.tree)
+        self.items.forget_optimized_trees()
+
+        if parse.statements is None or previous is None:
+            print(f'Reloaded program: "{program.stringname}"')
+        else:
+            print(
+                f'Reloaded program: "{program.stringname}"'
+                f' ({len(parse.statements) - parse.reused} of'
+                f' {len(parse.statements)} statements parsed)'
+            )
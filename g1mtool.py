@@ -1,33 +1,51 @@
 import os
 import sys
 
+from casint.callgraph import CallGraph
+from casint.common import translate_casio_bytes_to_ascii
 from casint.loader import (
     G1mFile,
     load_items_from_g1m_file,
-    load_items_from_ucb_dir
+    load_items_from_ucb_dir,
+    parse_programs
 )
+from casint.treecache import get_tree_cache
 
 
 def prepare_output_folder(output_folder):
     os.makedirs(output_folder, exist_ok=True)
 
 
-def unpack(filepath, output_folder):
-    # load the input
-    items = load_items_from_g1m_file(filepath)
-    # get output ready
-    prepare_output_folder(output_folder)
-    # write items
-    for item in items:
-        item_filename = item.get_ucb_filename()
-        item_filepath = os.path.join(output_folder, item_filename)
-        with open(item_filepath, 'wb') as fp:
-            item.write_ucb(fp)
+def unpack(filepaths, output_folder, workers=0):
+    # load the inputs; several files each get a folder of their own
+    cache = get_tree_cache()
+    outputs = []
+    for filepath in filepaths:
+        folder = output_folder
+        if len(filepaths) > 1:
+            stem = os.path.splitext(os.path.basename(filepath))[0]
+            folder = os.path.join(output_folder, stem)
+        outputs.append((load_items_from_g1m_file(filepath, cache=cache), folder))
+    # parse the programs of all the files in one pool
+    if workers != 0:
+        parse_programs(
+            [program for items, _ in outputs for program in items.get_programs()],
+            workers
+        )
+    for items, folder in outputs:
+        # get output ready
+        prepare_output_folder(folder)
+        # write items
+        for item in items:
+            item_filename = item.get_ucb_filename()
+            item_filepath = os.path.join(folder, item_filename)
+            with open(item_filepath, 'wb') as fp:
+                item.write_ucb(fp)
 
 
-def pack(input_folder, filepath):
+def pack(input_folder, filepath, workers=0):
     # load the input
-    items = load_items_from_ucb_dir(input_folder)
+    items = load_items_from_ucb_dir(input_folder, workers, get_tree_cache())
     # get output ready
     g1m_folder = os.path.dirname(filepath)
     if g1m_folder:
@@ -37,23 +55,80 @@ def pack(input_folder, filepath):
     g1m.write_items(items)
 
 
+def load_items(path, workers=0):
+    if os.path.isdir(path):
+        return load_items_from_ucb_dir(path, workers, get_tree_cache())
+    items = load_items_from_g1m_file(path, cache=get_tree_cache())
+    if workers != 0:
+        parse_programs(items.get_programs(), workers)
+    return items
+
+
+def casio_name(name):
+    return str(translate_casio_bytes_to_ascii(name), 'ascii')
+
+
+def calls(path, entry_names, workers=0):
+    # parse every program and print how they call each other
+    items = load_items(path, workers)
+    graph = CallGraph.from_items(items)
+    for program in items.get_programs():
+        if program.name in graph.errors:
+            continue
+        callees = ', '.join(casio_name(name) for name in graph.callees[program.name]) or '-'
+        dynamic = '  (and any: Prog with a computed name)' if program.name in graph.dynamic else ''
+        print(f'{program.stringname:8s} -> {callees}{dynamic}')
+    if entry_names:
+        entries = [p for p in items.get_programs() if p.stringname in entry_names]
+        unknown = set(entry_names) - set(p.stringname for p in entries)
+        for name in sorted(unknown):
+            print(f'No program named {name}')
+    else:
+        entries = graph.roots()
+    print('Entry points:', ', '.join(p.stringname for p in entries) or '-')
+    print('Unreachable:', ', '.join(p.stringname for p in graph.unreachable(entries)) or '-')
+    missing = [f'{casio_name(caller)} -> {casio_name(name)}' for caller, name in graph.missing()]
+    print('Missing:', ', '.join(missing) or '-')
+    cycles = [' -> '.join(casio_name(name) for name in cycle) for cycle in graph.cycles()]
+    print('Cycles:', ', '.join(cycles) or '-')
+    for name, e in graph.errors.items():
+        print(f'Not parsed: {casio_name(name)}: {e}')
+
+
 def print_usage():
-    print(f'Usage: {sys.argv[0]} <unpack> <file.g1m> <folder>')
-    print(f'       {sys.argv[0]} <pack> <folder> <file.g1m>')
+    print(f'Usage: {sys.argv[0]} [-j <jobs>] <unpack> <file.g1m>... <folder>')
+    print(f'       {sys.argv[0]} [-j <jobs>] <pack> <folder> <file.g1m>')
+    print(f'       {sys.argv[0]} [-j <jobs>] <calls> <file.g1m|folder> [<entry>...]')
+    print(f'  -j  parse programs in this many processes (0: one per core)')
+
+
+def parse_jobs(args):
+    # returns the worker count for the loader (0 means no pool) and the rest
+    if len(args) > 1 and args[0] == '-j':
+        jobs = int(args[1])
+        return (jobs or None), args[2:]
+    return 0, args
 
 
 if __name__ == '__main__':
-    if len(sys.argv) > 1:
-        command = sys.argv[1]
+    workers, args = parse_jobs(sys.argv[1:])
+    if len(args) > 0:
+        command = args[0]
         if command == 'unpack':
-            if len(sys.argv) == 4:
-                unpack(sys.argv[2], sys.argv[3])
+            if len(args) >= 3:
+                unpack(args[1:-1], args[-1], workers)
             else:
                 print_usage()
                 sys.exit(1)
         elif command == 'pack':
-            if len(sys.argv) == 4:
-                pack(sys.argv[2], sys.argv[3])
+            if len(args) == 3:
+                pack(args[1], args[2], workers)
+            else:
+                print_usage()
+                sys.exit(1)
+        elif command == 'calls':
+            if len(args) >= 2:
+                calls(args[1], args[2:], workers)
             else:
                 print_usage()
                 sys.exit(1)
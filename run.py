@@ -1,16 +1,8 @@
+import argparse
 import os
 import sys
 import traceback
 
-try:
-    import sdl2
-except ImportError:
-    import platform
-    arch, osname = platform.architecture()
-    if osname == 'WindowsPE':
-        os.environ['PYSDL2_DLL_PATH'] = 'lib/32' if arch == '32bit' else 'lib/64'
-    import sdl2
-
 from casint.common import translate_ascii_bytes_to_casio
 from casint.loader import (
     CasioProgram,
@@ -19,18 +11,40 @@ from casint.loader import (
     load_items_from_ucb_dir
 )
 from casint.machine import InterpreterQuitException
+from casint.recorder import FrameRecorder
 from casint.system import CasioSystem
+from casint.treecache import get_tree_cache
+from casint.watch import UcbDirWatcher
+
+
+def create_display(terminal=False):
+    if terminal:
+        from casint.display_terminal import TerminalDisplay
+        return TerminalDisplay()
+
+    try:
+        import sdl2
+    except ImportError:
+        import platform
+        arch, osname = platform.architecture()
+        if osname == 'WindowsPE':
+            os.environ['PYSDL2_DLL_PATH'] = 'lib/32' if arch == '32bit' else 'lib/64'
+        import sdl2
+    from casint.display_sdl import SdlDisplay
+    return SdlDisplay()
 
 
-def main(path, prog_name=None):
+def main(path, prog_name=None, record=None, terminal=False, cache_dir=None, watch=False,
+         optimize=True):
+    cache = get_tree_cache(cache_dir)
     # if the path is a dir, load items from ucb.
     # else, read as g1m.
     if os.path.isfile(path):
         print(f'Processing G1M file: {path}')
-        items = load_items_from_g1m_file(path)
+        items = load_items_from_g1m_file(path, cache=cache)
     elif os.path.isdir(path):
         print(f'Processing UCB dir: {path}')
-        items = load_items_from_ucb_dir(path)
+        items = load_items_from_ucb_dir(path, cache=cache)
     else:
         print('Could not load items: unknown input')
         return 2
@@ -39,6 +53,14 @@ def main(path, prog_name=None):
         print(f'No programs could be loaded')
         return 2
 
+    watcher = None
+    if watch:
+        if not os.path.isdir(path):
+            print('Watch mode needs a UCB dir')
+            return 2
+        print(f'Watching for changes: {path}')
+        watcher = UcbDirWatcher(path, items)
+
     # check to see if we're loading a program with the given name
     program = None
     if prog_name:
@@ -52,7 +74,9 @@ def main(path, prog_name=None):
             )
             return 2
 
-    with CasioSystem(items) as casio:
+    recorder = FrameRecorder(record) if record else None
+
+    with CasioSystem(items, create_display(terminal), recorder, watcher, optimize) as casio:
         try:
             while True:
                 if program is None:
@@ -71,6 +95,9 @@ def main(path, prog_name=None):
             print((casio.vars))
             print((casio.mats))
             return 2
+        finally:
+            if recorder:
+                recorder.close()
 
         # wait for user to close program
         #casio.idle()
@@ -79,10 +106,33 @@ def main(path, prog_name=None):
 
 
 if __name__ == '__main__':
-    if len(sys.argv) == 2:
-        sys.exit(main(sys.argv[1]))
-    if len(sys.argv) == 3:
-        sys.exit(main(sys.argv[1], sys.argv[2]))
-    else:
-        print(f'Usage: {sys.argv[0]} <file.g1m> [PROG_NAME]')
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description='CASIO Basic Interpreter')
+    parser.add_argument('path', help='a G1M file or a directory of UCB files')
+    parser.add_argument('prog_name', nargs='?', help='the program to run')
+    parser.add_argument(
+        '--record', metavar='FILE',
+        help='record the screen to an animated .gif or .png, or to a numbered .pbm sequence'
+    )
+    parser.add_argument(
+        '--terminal', action='store_true',
+        help='draw the screen with braille characters in the terminal instead of an SDL window'
+    )
+    parser.add_argument(
+        '--cache-dir', metavar='DIR',
+        help='keep parsed programs in this directory to load them faster next time '
+             '(default: $CASINT_CACHE_DIR, if set)'
+    )
+    parser.add_argument(
+        '--watch', action='store_true',
+        help='reload the programs of a UCB dir when they are edited, without restarting'
+    )
+    parser.add_argument(
+        '--no-optimize', action='store_true',
+        help='run programs as parsed, without constant folding and the other optimizations'
+    )
+    args = parser.parse_args()
+    sys.exit(main(
+        args.path, args.prog_name,
+        record=args.record, terminal=args.terminal, cache_dir=args.cache_dir,
+        watch=args.watch, optimize=not args.no_optimize
+    ))
@@ -0,0 +1,339 @@
+import random
+import unittest
+
+from casint.ast import (
+    BinOp,
+    Num,
+    IfThen,
+    SharedScope,
+    InlinedProg,
+    SetVar,
+    AddToVar,
+    AssignVar,
+    GetkeyToVar,
+    MatElement,
+    VarCompare,
+    IfVarCompare,
+    iter_child_nodes
+)
+from casint.display import Display
+from casint.loader import CasioProgram, CasioItemCollection
+from casint.machine import CasioMachine
+
+
+class NullDisplay(Display):
+    '''Presents nothing and never has a key pressed.'''
+    def present(self, screen):
+        pass
+
+
+    def poll_key(self):
+        return None
+
+
+def make_items(sources):
+    '''A collection of the programs in sources, a list of (name, source).'''
+    return CasioItemCollection([
+        CasioProgram(name, len(source), source, 'ucb', name)
+        for name, source in sources
+    ])
+
+
+def run_programs(sources, optimize):
+    '''
+    Runs the first of the programs and returns its vars, its mats and the
+    name of the exception it stopped with, if any.
+    '''
+    items = make_items(sources)
+    machine = CasioMachine(items, NullDisplay(), optimize=optimize)
+    # the same random numbers for both runs
+    random.seed(0)
+    try:
+        machine.run(sources[0][0])
+        error = None
+    except Exception as e:
+        error = type(e).__name__
+    return machine.vars, machine.mats, error
+
+
+def optimized_tree(sources):
+    items = make_items(sources)
+    return items.get_optimized_tree(items.get_program_by_name(sources[0][0]))
+
+
+def walk(node):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(iter_child_nodes(node))
+
+
+def statement_expr(tree, index):
+    '''The expression assigned by a top-level statement of a tree.'''
+    node = tree.children[index]
+    # e.g. an AssignVar, made from an Assign
+    return getattr(node, 'source', node).expr
+
+
+class OptimizerTest(unittest.TestCase):
+    def assert_same_run(self, source, *callees):
+        '''The program ends the same way optimized as not, and its vars.'''
+        sources = [(b'MAIN', source)] + list(callees)
+        plain = run_programs(sources, optimize=False)
+        optimized = run_programs(sources, optimize=True)
+        self.assertEqual(plain, optimized)
+        return optimized[0]
+
+
+    def test_pxltest_not_hoisted_out_of_drawing_loop(self):
+        # X < 100 stops the loop if PxlTest is (wrongly) only read once
+        source = (
+            b'X = 0;\n'
+            b'while (PxlTest(5, 10) == 0 and X < 100) {\n'
+            b'    X = X + 1;\n'
+            b'    if (X == 4) {\n'
+            b'        PxlOn(5, 10);\n'
+            b'    }\n'
+            b'}\n'
+        )
+        self.assertEqual(self.assert_same_run(source)[b'X'], 4)
+
+
+    def test_invariant_expression_hoisted(self):
+        source = (
+            b'B = 3;\n'
+            b'for (A = 1 to 10) {\n'
+            b'    C = C + (B * 2 + 1) * A;\n'
+            b'}\n'
+        )
+        self.assertEqual(self.assert_same_run(source)[b'C'], 385)
+
+
+    def test_constants_folded(self):
+        source = (
+            b'A = (3 + 4) * 2 - 10 / 4;\n'
+            b'B = -(2 ** 3) + Intg(7.5) + Frac(2.25);\n'
+            b'C = (1 < 2) + (3 == 3) * 2;\n'
+        )
+        self.assertEqual(self.assert_same_run(source)[b'A'], 11.5)
+        tree = optimized_tree([(b'MAIN', source)])
+        for index in range(3):
+            self.assertIs(type(statement_expr(tree, index)), Num)
+
+
+    def test_large_exponent_not_folded(self):
+        source = b'A = 2 ** 65;\n'
+        self.assertEqual(self.assert_same_run(source)[b'A'], 2.0 ** 65)
+        self.assertIs(type(statement_expr(optimized_tree([(b'MAIN', source)]), 0)), BinOp)
+
+
+    def test_non_finite_not_folded(self):
+        # 10^180 * 10^180 is infinity, which isn't folded into a Num
+        source = b'A = (10 ** 60) ** 3 * (10 ** 60) ** 3;\n'
+        self.assertEqual(self.assert_same_run(source)[b'A'], float('inf'))
+        self.assertIs(type(statement_expr(optimized_tree([(b'MAIN', source)]), 0)), BinOp)
+
+
+    def test_errors_raised_when_run(self):
+        for source in (b'A = 1;\nB = 1 / 0;\nA = 2;\n', b'A = 1;\nB = (2 ** 60) ** 60;\n'):
+            plain = run_programs([(b'MAIN', source)], optimize=False)
+            self.assertIsNotNone(plain[2])
+            self.assertEqual(plain, run_programs([(b'MAIN', source)], optimize=True))
+
+
+    def test_constant_if_removed(self):
+        source = (
+            b'if (1) {\n'
+            b'    A = 1;\n'
+            b'} else {\n'
+            b'    A = 2;\n'
+            b'}\n'
+            b'if (2 < 1) {\n'
+            b'    B = 1;\n'
+            b'} else {\n'
+            b'    B = 2;\n'
+            b'}\n'
+        )
+        self.assertEqual(self.assert_same_run(source)[b'B'], 2)
+        tree = optimized_tree([(b'MAIN', source)])
+        self.assertFalse(any(type(node) is IfThen for node in walk(tree)))
+
+
+    def test_constant_if_with_label_kept(self):
+        # a Label can only be jumped to from its own list, so the branch
+        # isn't spliced into the program
+        inner = (
+            b'if (1) {\n'
+            b'    label 1;\n'
+            b'    A = A + 1;\n'
+            b'    if (A < 3) {\n'
+            b'        goto 1;\n'
+            b'    }\n'
+            b'}\n'
+        )
+        self.assertEqual(self.assert_same_run(inner)[b'A'], 3)
+        self.assertTrue(any(type(node) is IfThen and node.if_clause
+            for node in optimized_tree([(b'MAIN', inner)]).children))
+        # from outside, the label can't be found, optimized or not
+        self.assert_same_run(b'A = 0;\ngoto 1;\n' + inner)
+
+
+    def test_common_subexpressions_shared(self):
+        source = (
+            b'A = 3;\n'
+            b'B = (A * 2 + 1) * (A * 2 + 1) + Mat M[1, A - 2] * (A * 2 + 1);\n'
+            b'C = RandNum() - RandNum();\n'
+        )
+        self.assert_same_run(b'dim Mat M = (2, 2);\nMat M[1, 1] = 5;\n' + source)
+        tree = optimized_tree([(b'MAIN', source)])
+        self.assertTrue(any(type(node) is SharedScope for node in walk(tree.children[1])))
+        # RandNum gives a new value each time
+        self.assertFalse(any(type(node) is SharedScope for node in walk(tree.children[2])))
+
+
+    def inlined(self, source, *callees):
+        '''The InlinedProgs in the optimized tree of a program.'''
+        tree = optimized_tree([(b'MAIN', source)] + list(callees))
+        return [node for node in walk(tree) if type(node) is InlinedProg]
+
+
+    def test_return_rewritten_into_ifs(self):
+        source = b'for (A = 1 to 30) {\n    Prog("SUB");\n    D = D + 1;\n}\n'
+        callee = (b'SUB',
+            b'if (A > 10) {\n'
+            b'    if (A > 20) {\n'
+            b'        return;\n'
+            b'    }\n'
+            b'    C = C + 1;\n'
+            b'}\n'
+            b'B = B + A;\n'
+        )
+        self.assertEqual(self.assert_same_run(source, callee)[b'C'], 10)
+        inlined = self.inlined(source, callee)
+        self.assertEqual(len(inlined), 1)
+        # no Return left to be caught
+        self.assertFalse(inlined[0].returns)
+
+
+    def test_return_in_loop_caught(self):
+        source = b'for (A = 1 to 5) {\n    Prog("SUB");\n}\n'
+        callee = (b'SUB',
+            b'for (I = 1 to 5) {\n'
+            b'    if (I == A) {\n'
+            b'        return;\n'
+            b'    }\n'
+            b'    B = B + 1;\n'
+            b'}\n'
+            b'C = C + 1;\n'
+        )
+        self.assertEqual(self.assert_same_run(source, callee)[b'B'], 10)
+        self.assertTrue(self.inlined(source, callee)[0].returns)
+
+
+    def test_goto_to_caller_not_inlined(self):
+        source = (
+            b'for (A = 1 to 5) {\n'
+            b'    Prog("SUB");\n'
+            b'}\n'
+            b'label 1;\n'
+            b'B = B + 100;\n'
+        )
+        callee = (b'SUB', b'if (A == 3) {\n    goto 1;\n}\nB = B + 1;\n')
+        self.assertEqual(self.assert_same_run(source, callee)[b'B'], 102)
+        self.assertEqual(self.inlined(source, callee), [])
+
+
+    def test_goto_within_callee_inlined(self):
+        source = b'for (A = 1 to 5) {\n    Prog("SUB");\n}\n'
+        callee = (b'SUB', b'goto 2;\nB = B + 1;\nlabel 2;\nC = C + 1;\n')
+        self.assertEqual(self.assert_same_run(source, callee)[b'C'], 5)
+        self.assertEqual(len(self.inlined(source, callee)), 1)
+
+
+    def test_recursive_callee_not_inlined(self):
+        source = b'A = 5;\nProg("SUB");\n'
+        callee = (b'SUB', b'A = A - 1;\nB = B + 1;\nif (A > 0) {\n    Prog("SUB");\n}\n')
+        self.assertEqual(self.assert_same_run(source, callee)[b'B'], 5)
+        self.assertEqual(self.inlined(source, callee), [])
+
+
+    def test_nested_callees_inlined(self):
+        source = b'for (A = 1 to 5) {\n    Prog("SUB");\n    Prog("LEAF");\n}\n'
+        callees = (
+            (b'SUB', b'Prog("LEAF");\nB = B + 1;\n'),
+            (b'LEAF', b'C = C + A;\n')
+        )
+        self.assertEqual(self.assert_same_run(source, *callees)[b'C'], 30)
+        self.assertEqual(len(self.inlined(source, *callees)), 3)
+
+
+    def fused(self, source):
+        '''The classes of the top-level statements of the optimized tree.'''
+        return [type(node) for node in optimized_tree([(b'MAIN', source)]).children]
+
+
+    def test_adds_to_vars_fused(self):
+        source = (
+            b'A = 3;\n'
+            b'A = A - 0.1;\n'
+            b'B = 1 + B;\n'
+            b'C = C + 2.5;\n'
+            b'Isz(D);\n'
+            b'Dsz(E);\n'
+            b'F = 5 - F;\n'
+        )
+        result = self.assert_same_run(source)
+        self.assertEqual((result[b'A'], result[b'D'], result[b'E']), (3 - 0.1, 1, -1))
+        # Isz and Dsz count by an int
+        self.assertIs(type(result[b'D']), int)
+        self.assertEqual(
+            self.fused(source),
+            [SetVar, AddToVar, AddToVar, AddToVar, AddToVar, AddToVar, AssignVar]
+        )
+
+
+    def test_var_compares_fused(self):
+        source = (
+            b'for (A = 1 to 10) {\n'
+            b'    if (A == 3) {\n'
+            b'        B = B + 1;\n'
+            b'    } else {\n'
+            b'        C = C + 1;\n'
+            b'    }\n'
+            b'    if (A >= 5) {\n'
+            b'        D = D + A;\n'
+            b'    }\n'
+            b'    E = E + (A < 4) + (A != 2) + (A > 8) + (A <= 1);\n'
+            b'}\n'
+        )
+        result = self.assert_same_run(source)
+        self.assertEqual((result[b'B'], result[b'C'], result[b'D'], result[b'E']), (1, 9, 45, 15))
+        # fused nodes lead to their parts twice, through their source too
+        nodes = {id(node): node for node in walk(optimized_tree([(b'MAIN', source)]))}
+        classes = [type(node) for node in nodes.values()]
+        self.assertEqual(classes.count(IfVarCompare), 2)
+        # the two in Ifs, and the four added up
+        self.assertEqual(classes.count(VarCompare), 6)
+
+
+    def test_reads_fused(self):
+        source = (
+            b'dim Mat M = (3, 3);\n'
+            b'Mat M[2, 3] = 7;\n'
+            b'Z = Mat M[2, 3];\n'
+            b'K = GetKey();\n'
+            b'do {\n'
+            b'    A = A + 0.1;\n'
+            b'} while (A < 1);\n'
+        )
+        self.assertEqual(self.assert_same_run(source)[b'Z'], 7)
+        tree = optimized_tree([(b'MAIN', source)])
+        self.assertIs(type(tree.children[2].expr), MatElement)
+        self.assertIs(type(tree.children[3]), GetkeyToVar)
+        # the element assigned to stays as it is
+        self.assertIsNot(type(tree.children[1].var), MatElement)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+import unittest
+
+from casint import raster
+from casint.machine import DEFAULT_VIEW_WINDOW
+
+
+def default_transform():
+    xmin, xmax, xscale, ymin, ymax, yscale = DEFAULT_VIEW_WINDOW
+    return raster.view_transform(xmin, xmax, ymin, ymax)
+
+
+class ViewTransformTest(unittest.TestCase):
+    def test_default_window_truncates(self):
+        transform = default_transform()
+        self.assertEqual(raster.to_pixel(transform, 10.7, 5.5), (10, 5))
+        self.assertEqual(raster.to_row(transform, 5.7), 5)
+        self.assertEqual(raster.to_column(transform, 20.9), 20)
+
+
+    def test_graph_values_round(self):
+        self.assertEqual(raster.to_rows(default_transform(), [5.4, 5.5]), [5, 6])
+
+
+    def test_graph_values_overflowing_when_scaled(self):
+        transform = raster.view_transform(1, 127, 0, 1e-300)
+        self.assertEqual(raster.to_rows(transform, [1e306, float('nan')]), [None, None])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import os
+import tempfile
+import unittest
+
+from casint.loader import parse_program_source
+from casint.treecache import TreeCache
+
+SOURCE = (
+    b'for (A = 1 to 10) {\n'
+    b'    if (A == 3) {\n'
+    b'        B = B + A * 2;\n'
+    b'    }\n'
+    b'}\n'
+    b'Locate(1, 1, "DONE");\n'
+)
+
+
+class TreeCacheTest(unittest.TestCase):
+    def test_damaged_entries_are_not_raised(self):
+        tree = parse_program_source(SOURCE, 'ucb', b'MAIN')
+        with tempfile.TemporaryDirectory() as directory:
+            cache = TreeCache(directory)
+            cache.store(SOURCE, 'ucb', tree=tree)
+            path = cache._path(cache.key(SOURCE, 'ucb'))
+            with open(path, 'rb') as fp:
+                data = fp.read()
+            for i in range(len(data)):
+                damaged = bytearray(data)
+                damaged[i] ^= 0xff
+                with open(path, 'wb') as fp:
+                    fp.write(damaged)
+                # a tree, or None to parse again, but never an error
+                cache.load(SOURCE, 'ucb')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import math
+import unittest
+
+from casint.display import Display
+from casint.loader import CasioProgram, CasioItemCollection
+from casint.machine import CasioMachine
+from casint.vectorize import compile_expression
+
+
+class NullDisplay(Display):
+    '''Presents nothing and never has a key pressed.'''
+    def present(self, screen):
+        pass
+
+
+    def poll_key(self):
+        return None
+
+
+def graph_values(source, xs):
+    '''The values of the expression of the program's last Graph Y= at xs.'''
+    program = CasioProgram(b'MAIN', len(source), source, 'ucb', b'MAIN')
+    machine = CasioMachine(CasioItemCollection([program]), NullDisplay(), optimize=False)
+    machine.run(b'MAIN')
+    expr = program.tree.children[-1].arg1
+    return list(compile_expression(expr, b'X')(machine, xs))
+
+
+class CompileExpressionTest(unittest.TestCase):
+    def test_undefined_scalar_part_is_nan(self):
+        ys = graph_values(b'A = 0; GraphYEq(X + 1 / A);', [1, 2])
+        self.assertTrue(all(math.isnan(y) for y in ys))
+
+
+    def test_defined_values(self):
+        self.assertEqual(graph_values(b'A = 2; GraphYEq(X / A + 1);', [2, 4]), [2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
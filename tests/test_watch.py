@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+
+from casint.display import Display
+from casint.loader import load_items_from_ucb_dir
+from casint.machine import CasioMachine
+from casint.watch import UcbDirWatcher
+
+
+class NullDisplay(Display):
+    '''Presents nothing and never has a key pressed.'''
+    def present(self, screen):
+        pass
+
+
+    def poll_key(self):
+        return None
+
+
+# Q reads a key, which polls the watcher, so its edit is picked up while
+# P runs; calling itself keeps it from being inlined
+MAIN_SOURCE = (
+    b'dim Mat A = (5, 5);\n'
+    b'for (J = 1 to 3) {\n'
+    b'    Prog("Q");\n'
+    b'    for (K = 1 to 2) {\n'
+    b'        B = B + Mat A[J, K];\n'
+    b'    }\n'
+    b'}\n'
+)
+RECURSIVE_CALLEE_SOURCE = b'K = GetKey();\nif (K == 99) {\n    Prog("Q");\n}\n'
+SMALL_CALLEE_SOURCE = b'K = GetKey();\n'
+EDITED_CALLEE_SOURCE = b'J = J + 0.5;\n'
+
+
+def write_file(dirpath, filename, source):
+    with open(os.path.join(dirpath, filename), 'wb') as fp:
+        fp.write(source)
+
+
+def run_edited(callee_source, optimize):
+    '''Runs P in a watched directory, with Q edited once P has started.'''
+    with tempfile.TemporaryDirectory() as dirpath:
+        write_file(dirpath, 'P.ucb', MAIN_SOURCE)
+        write_file(dirpath, 'Q.ucb', callee_source)
+        items = load_items_from_ucb_dir(dirpath)
+        watcher = UcbDirWatcher(dirpath, items, interval=0)
+        write_file(dirpath, 'Q.ucb', EDITED_CALLEE_SOURCE)
+        machine = CasioMachine(items, NullDisplay(), watcher=watcher, optimize=optimize)
+        machine.run(b'P')
+        return machine.vars
+
+
+class WatchTest(unittest.TestCase):
+    def assert_same_run(self, callee_source):
+        plain = run_edited(callee_source, optimize=False)
+        optimized = run_edited(callee_source, optimize=True)
+        self.assertEqual(plain, optimized)
+        self.assertEqual(optimized[b'J'], 2.5)
+
+
+    def test_edited_callee_writes_fraction_to_counter(self):
+        self.assert_same_run(RECURSIVE_CALLEE_SOURCE)
+
+
+    def test_edited_callee_not_inlined(self):
+        self.assert_same_run(SMALL_CALLEE_SOURCE)
+
+
+if __name__ == '__main__':
+    unittest.main()